@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import db
+import timestamps
+
+# ================== СЧЁТЧИКИ АКТИВНОСТИ ==================
+# События складываются в почасовые и суточные корзины в той же
+# транзакции, что и само действие. Экраны статистики читают готовые
+# суммы и не пересчитывают таблицы products и users.
+LISTING_CREATED = "listing_created"
+LISTING_SOLD = "listing_sold"
+LISTING_DELETED = "listing_deleted"
+REVIEW_SUBMITTED = "review_submitted"
+NEW_USER = "new_user"
+
+EVENTS = (LISTING_CREATED, LISTING_SOLD, LISTING_DELETED, REVIEW_SUBMITTED, NEW_USER)
+
+HOURLY = "hour"
+DAILY = "day"
+
+# Почасовые корзины нужны только для окна в 24 часа
+HOURLY_RETENTION = 2 * timestamps.DAY
+
+
+def hour_start(ts):
+    return ts - ts % timestamps.HOUR
+
+
+def day_start(ts):
+    """Начало суток по местному времени, как их показывает статистика"""
+    local = timestamps.to_datetime(ts)
+    return timestamps.from_datetime(datetime(local.year, local.month, local.day))
+
+
+def record(event, seller_id=None, at=None):
+    """Учитывает событие; вызывать внутри транзакции самого действия"""
+    at = at or timestamps.now()
+    with db.connection() as conn:
+        conn.executemany("""
+            INSERT INTO activity_counters (period, bucket, event, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT (period, event, bucket) DO UPDATE SET count = count + 1
+        """, [(HOURLY, hour_start(at), event), (DAILY, day_start(at), event)])
+        if event == LISTING_CREATED and seller_id is not None:
+            conn.execute("""
+                INSERT INTO seller_activity (seller_id, bucket, count) VALUES (?, ?, 1)
+                ON CONFLICT (seller_id, bucket) DO UPDATE SET count = count + 1
+            """, (seller_id, hour_start(at)))
+
+
+def daily(event, days, now=None):
+    """[(начало суток, число)] за последние `days` суток, от новых к старым"""
+    since = day_start(now or timestamps.now()) - (days - 1) * timestamps.DAY
+    with db.connection() as conn:
+        return conn.execute(
+            "SELECT bucket, count FROM activity_counters WHERE period = ? AND event = ? AND bucket >= ? "
+            "ORDER BY bucket DESC", (DAILY, event, since)
+        ).fetchall()
+
+
+def last_24h(now=None):
+    """{событие: число} за последние 24 часовые корзины"""
+    since = hour_start(now or timestamps.now()) - 23 * timestamps.HOUR
+    with db.connection() as conn:
+        rows = conn.execute(
+            "SELECT event, SUM(count) FROM activity_counters WHERE period = ? AND bucket >= ? GROUP BY event",
+            (HOURLY, since)
+        ).fetchall()
+    totals = dict.fromkeys(EVENTS, 0)
+    totals.update(rows)
+    return totals
+
+
+def leaderboard(limit=None, min_count=1, now=None):
+    """[(seller_id, товаров за 24 часа)] по убыванию; читает только корзины за сутки"""
+    since = hour_start(now or timestamps.now()) - 23 * timestamps.HOUR
+    with db.connection() as conn:
+        return conn.execute("""
+            SELECT seller_id, SUM(count) AS total FROM seller_activity
+            WHERE bucket >= ? GROUP BY seller_id HAVING total >= ?
+            ORDER BY total DESC, seller_id LIMIT ?
+        """, (since, min_count, -1 if limit is None else limit)).fetchall()
+
+
+def prune(now):
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM activity_counters WHERE period = ? AND bucket < ?", (HOURLY, now - HOURLY_RETENTION))
+        removed = c.rowcount
+        c.execute("DELETE FROM seller_activity WHERE bucket < ?", (now - HOURLY_RETENTION,))
+        return removed + c.rowcount
+
+
+# ================== ЗАПОЛНЕНИЕ ПО ИСТОРИИ ==================
+# Местная полночь в SQL: дата в местном времени, переведённая обратно в UTC
+_SQL_DAY = "CAST(strftime('%s', date({0}, 'unixepoch', 'localtime'), 'utc') AS INTEGER)"
+_SQL_HOUR = "({0} - {0} % 3600)"
+
+# Событие и запрос, возвращающий время каждого такого события
+_HISTORY = {
+    LISTING_CREATED: "SELECT created_at AS at, seller_id FROM products_all WHERE created_at IS NOT NULL",
+    REVIEW_SUBMITTED: "SELECT created_at AS at, NULL FROM reviews WHERE created_at IS NOT NULL",
+    NEW_USER: "SELECT registered_at AS at, NULL FROM users WHERE registered_at IS NOT NULL",
+}
+
+
+def backfill():
+    """Пересчитывает счётчики по истории в базе; возвращает {событие: число}.
+
+    Проданные и удалённые товары из базы исчезают, поэтому счётчики
+    продаж и удалений остаются как есть.
+    """
+    totals = {}
+    with db.connection() as conn:
+        c = conn.cursor()
+        for event, source in _HISTORY.items():
+            c.execute("DELETE FROM activity_counters WHERE event = ?", (event,))
+            # Почасовые корзины старше HOURLY_RETENTION всё равно не хранятся
+            for period, bucket, since in ((HOURLY, _SQL_HOUR, timestamps.now() - HOURLY_RETENTION),
+                                          (DAILY, _SQL_DAY, 0)):
+                c.execute(f"""
+                    INSERT INTO activity_counters (period, bucket, event, count)
+                    SELECT ?, {bucket.format("at")} AS b, ?, COUNT(*) FROM ({source}) WHERE at >= ? GROUP BY b
+                """, (period, event, since))
+            totals[event] = c.execute(f"SELECT COUNT(*) FROM ({source})").fetchone()[0]
+        c.execute("DELETE FROM seller_activity")
+        c.execute(f"""
+            INSERT INTO seller_activity (seller_id, bucket, count)
+            SELECT seller_id, {_SQL_HOUR.format("created_at")} AS b, COUNT(*) FROM products_all
+            WHERE created_at >= ? GROUP BY seller_id, b
+        """, (timestamps.now() - HOURLY_RETENTION,))
+    return totals
@@ -0,0 +1,65 @@
+import logging
+import os
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ АРХИВАЦИИ ==================
+# Истёкший товар ещё GRACE висит в products (его можно найти по ID и
+# продлить), после чего переносится в products_archive.
+GRACE = int(os.getenv("BRAINROT_ARCHIVE_GRACE_DAYS", "7")) * timestamps.DAY
+BATCH_SIZE = 500
+# Недоставленные сообщения и старые сводки хранятся для разбора, но не вечно
+RETENTION = 14 * timestamps.DAY
+
+PRODUCT_COLUMNS = ("id, seller_id, title, description, price, contact, "
+                   "created_at, expires_at, last_extended_at, last_checked_at")
+
+
+def archive_batch(expired_before, limit=BATCH_SIZE):
+    """Переносит пачку истёкших товаров в архив одной транзакцией; возвращает их id"""
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM products WHERE expires_at < ? ORDER BY expires_at, id LIMIT ?",
+                  (expired_before, limit))
+        ids = [row[0] for row in c.fetchall()]
+        if not ids:
+            return ids
+        placeholders = ",".join("?" * len(ids))
+        c.execute(f"INSERT OR REPLACE INTO products_archive ({PRODUCT_COLUMNS}) "
+                  f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})", ids)
+        c.execute(f"DELETE FROM products WHERE id IN ({placeholders})", ids)
+        c.execute(f"DELETE FROM notification_ledger WHERE product_id IN ({placeholders})", ids)
+        c.execute(f"DELETE FROM digest_items WHERE product_id IN ({placeholders})", ids)
+    return ids
+
+
+def prune(now):
+    """Удаляет служебные строки, которые больше не нужны; возвращает их число"""
+    with db.connection() as conn:
+        c = conn.cursor()
+        removed = 0
+        # Уведомления о прошедших сроках уже никогда не понадобятся
+        c.execute("DELETE FROM notification_ledger WHERE deadline < ?", (now,))
+        removed += c.rowcount
+        c.execute("DELETE FROM outbox WHERE status = 'failed' AND created_at < ?", (now - RETENTION,))
+        removed += c.rowcount
+        c.execute("DELETE FROM digest_items WHERE digest_id IN (SELECT id FROM digests WHERE created_at < ?)",
+                  (now - RETENTION,))
+        removed += c.rowcount
+        c.execute("DELETE FROM digests WHERE created_at < ?", (now - RETENTION,))
+        removed += c.rowcount
+    return removed
+
+
+def vacuum():
+    """Возвращает системе свободные страницы файла; сколько байт освобождено"""
+    with db.connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # Прагма освобождает страницы по одной на каждую строку результата
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (free_before - free_after) * page_size
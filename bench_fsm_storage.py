@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# ================== ЗАМЕР ХРАНИЛИЩА FSM ==================
+# Сравнивает SQLiteStorage с MemoryStorage из aiogram на тех же вызовах,
+# что делают обработчики диалогов, и отдельно меряет сброс в базу:
+#
+#   python bench_fsm_storage.py --ops 20000 --keys 500
+#
+# База - временная, рабочая brainrot_shop.db не трогается.
+OPERATIONS = ("set_state", "update_data", "get_state", "get_data")
+
+
+async def _time(storage, operation, keys, ops):
+    started = time.perf_counter()
+    for n in range(ops):
+        key = keys[n % len(keys)]
+        if operation == "set_state":
+            await storage.set_state(key, "ProductForm:title")
+        elif operation == "update_data":
+            await storage.update_data(key, {"title": "Brainrot", "n": n})
+        elif operation == "get_state":
+            await storage.get_state(key)
+        else:
+            await storage.get_data(key)
+    return (time.perf_counter() - started) / ops
+
+
+async def run(args):
+    # db читает путь к базе при импорте
+    import db
+    import fsm_storage
+    import migrations
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    await db.run(migrations.migrate, 6)
+    keys = [StorageKey(bot_id=1, chat_id=n, user_id=n) for n in range(args.keys)]
+    sqlite = fsm_storage.SQLiteStorage()
+    await sqlite.load()
+    storages = {"memory": MemoryStorage(), "sqlite": sqlite}
+
+    print(f"{'Операция':<14}" + "".join(f"{name + ', мкс':>14}" for name in storages))
+    for operation in OPERATIONS:
+        cells = []
+        for storage in storages.values():
+            best = min([await _time(storage, operation, keys, args.ops) for _ in range(args.repeat)])
+            cells.append(f"{best * 1e6:>14.2f}")
+        print(f"{operation:<14}" + "".join(cells))
+
+    # Сброс: все ключи изменены с прошлого flush()
+    for key in keys:
+        await sqlite.update_data(key, {"title": "Brainrot", "n": -1})
+    started = time.perf_counter()
+    await sqlite.flush()
+    elapsed = time.perf_counter() - started
+    print(f"\nflush() {len(keys)} изменённых ключей: {elapsed * 1000:.1f} мс "
+          f"({elapsed / len(keys) * 1e6:.1f} мкс на ключ)")
+    await sqlite.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержки SQLiteStorage против MemoryStorage")
+    parser.add_argument("--ops", type=int, default=20000, help="вызовов каждой операции за замер")
+    parser.add_argument("--keys", type=int, default=500, help="разных пользователей")
+    parser.add_argument("--repeat", type=int, default=3, help="замеров, берётся лучший")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="brainrot-bench-")
+    os.environ["BRAINROT_DB"] = os.path.join(workdir, "brainrot_shop.db")
+    try:
+        asyncio.run(run(args))
+    finally:
+        import db
+
+        db.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
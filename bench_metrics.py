@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import time
+
+from aiogram.dispatcher.event.handler import HandlerObject
+
+import metrics
+import middlewares
+
+# ================== ЗАМЕР НАКЛАДНЫХ РАСХОДОВ МЕТРИК ==================
+# Сколько добавляет HandlerMetricsMiddleware к вызову обработчика,
+# сколько стоит одно наблюдение гистограммы и отрисовка /metrics:
+#
+#   python bench_metrics.py --calls 200000
+
+
+async def cmd_bench(event, data):
+    return None
+
+
+async def _time_calls(call, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        await call()
+    return (time.perf_counter() - started) / calls
+
+
+def _fill(handlers, funcs, methods):
+    """Примерно столько рядов, сколько набирает живой бот"""
+    for n in range(handlers):
+        metrics.handler_seconds.observe(f"handler_{n}", 0.004)
+        metrics.handler_errors.inc(f"handler_{n}")
+    for n in range(funcs):
+        metrics.db_seconds.observe(f"func_{n}", 0.002)
+    for n in range(methods):
+        metrics.api_seconds.observe(f"method_{n}", 0.05)
+        metrics.api_errors.inc(f"method_{n}")
+
+
+async def run(args):
+    middleware = middlewares.HandlerMetricsMiddleware()
+    data = {"handler": HandlerObject(callback=cmd_bench)}
+    bare = min([await _time_calls(lambda: cmd_bench(None, data), args.calls) for _ in range(args.repeat)])
+    wrapped = min([await _time_calls(lambda: middleware(cmd_bench, None, data), args.calls)
+                   for _ in range(args.repeat)])
+    print(f"Обработчик без middleware:  {bare * 1e6:.2f} мкс")
+    print(f"С HandlerMetricsMiddleware: {wrapped * 1e6:.2f} мкс (+{(wrapped - bare) * 1e6:.2f})")
+
+    started = time.perf_counter()
+    for _ in range(args.calls):
+        metrics.db_seconds.observe("bench", 0.003)
+    print(f"Histogram.observe:          {(time.perf_counter() - started) / args.calls * 1e6:.2f} мкс")
+
+    _fill(args.handlers, args.funcs, args.methods)
+    started = time.perf_counter()
+    for _ in range(args.renders):
+        body = metrics.render()
+    elapsed = (time.perf_counter() - started) / args.renders
+    print(f"render():                   {elapsed * 1000:.2f} мс "
+          f"({len(body.splitlines())} строк, {len(body) // 1024} КБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы метрик Brainrot Shop Bot")
+    parser.add_argument("--calls", type=int, default=200000, help="вызовов за замер")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров, берётся лучший")
+    parser.add_argument("--renders", type=int, default=100, help="отрисовок /metrics")
+    parser.add_argument("--handlers", type=int, default=60, help="рядов по обработчикам")
+    parser.add_argument("--funcs", type=int, default=80, help="рядов по функциям БД")
+    parser.add_argument("--methods", type=int, default=10, help="рядов по методам Bot API")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import os
+from collections import OrderedDict
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import invalidation
+import timestamps
+
+# ================== КЭШ ОТРИСОВАННЫХ КАРТОЧЕК ==================
+CACHE_SIZE = int(os.getenv("BRAINROT_CARD_CACHE", "2048"))
+
+
+class RenderCache:
+    """LRU-кэш готовых текстов и клавиатур.
+
+    Второй элемент ключа - id товара: discard() убирает все записи
+    товара, а учёт по товарам живёт ровно столько, сколько сами записи.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._by_product = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_or_render(self, key, render):
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            value = render()
+            self._items[key] = value
+            self._by_product.setdefault(key[1], set()).add(key)
+            if len(self._items) > self.maxsize:
+                evicted, _ = self._items.popitem(last=False)
+                self._unlink(evicted)
+            return value
+        self.hits += 1
+        self._items.move_to_end(key)
+        return value
+
+    def discard(self, product_id):
+        for key in self._by_product.pop(product_id, ()):
+            self._items.pop(key, None)
+
+    def _unlink(self, key):
+        keys = self._by_product.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_product[key[1]]
+
+    def stats_text(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return f"{self.hits} попаданий / {self.misses} промахов ({ratio:.0f}%), {len(self)}/{self.maxsize} записей"
+
+
+cache = RenderCache()
+
+
+# Карточки сбрасываются при редактировании, продлении, удалении и
+# архивации товара; отдельных версий товаров, которые копились бы
+# для каждого когда-либо изменённого товара, не хранится.
+def invalidate(product_id):
+    cache.discard(int(product_id))
+    invalidation.publish(invalidation.PRODUCT, product_id)
+
+
+def _forget(product_ids):
+    """Товары, изменённые другими воркерами"""
+    for product_id in product_ids:
+        cache.discard(product_id)
+
+
+invalidation.subscribe(invalidation.PRODUCT, _forget)
+
+
+# ================== ОТРИСОВКА ==================
+def _render_product_card(product):
+    product_id, seller_id, title, description, price, contact = product[:6]
+    text = (
+        f"🛒 Товар #{product_id}\n\n"
+        f"📌 Название: {title}\n"
+        f"📝 Описание: {description}\n"
+        f"💰 Цена: {price}\n"
+        f"👤 Контакты: @{contact}\n"
+        f"⏳ Истекает: {timestamps.format_ts(product[7])}"
+    )
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✅ Купить", callback_data=f"buy_{product_id}")
+    builder.button(text="⭐ Отзывы о продавце", callback_data=f"reviews:{seller_id}:{product_id}")
+    builder.button(text="🏠 Главное меню", callback_data="back_to_main")
+    builder.adjust(2)
+    return text, builder.as_markup()
+
+
+def product_card(product):
+    """Карточка товара в ленте покупателя: (text, reply_markup)"""
+    product_id = product[0]
+    return cache.get_or_render(("card", product_id),
+                               lambda: _render_product_card(product))
+
+
+def _render_admin_line(product):
+    product_id, title, price, contact, seller_id, username, expires_at = product
+    safe_title = title[:35] + "..." if len(title) > 35 else title
+    seller_info = f"@{username}" if username else f"ID: {seller_id}"
+    return (
+        f"<b>🔢 ID: {product_id}</b>\n"
+        f"📌 {safe_title}\n"
+        f"💰 {price} | 👤 {seller_info}\n"
+        f"📞 @{contact}\n"
+        f"⏳ Истекает: {timestamps.format_ts(expires_at)}\n"
+        f"────────────────────\n"
+    )
+
+
+def admin_line(product):
+    """Строка товара в админском списке; username продавца входит в ключ"""
+    product_id, username = product[0], product[5]
+    return cache.get_or_render(("admin", product_id, username),
+                               lambda: _render_admin_line(product))
+
+
+def _render_seller_line(product):
+    pid, title, price, contact, expires_at = product
+    return f"#{pid} - {title}\n   💰 {price} | 👤 @{contact}\n   ⏳ Истекает: {timestamps.format_ts(expires_at)}\n\n"
+
+
+def seller_line(product):
+    """Строка товара в списке «Мои товары»"""
+    product_id = product[0]
+    return cache.get_or_render(("seller", product_id),
+                               lambda: _render_seller_line(product))
@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ БАЗЫ ДАННЫХ ==================
+DB_PATH = os.getenv("BRAINROT_DB", "brainrot_shop.db")
+POOL_SIZE = int(os.getenv("BRAINROT_DB_POOL", "4"))
+
+PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+
+# ================== ПУЛ СОЕДИНЕНИЙ ==================
+class ConnectionPool:
+    """Небольшой пул постоянных соединений с SQLite"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._current = ContextVar(f"db_conn_{id(self)}", default=None)
+        self._after = ContextVar(f"db_after_{id(self)}", default=None)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение из пула.
+
+        Вложенные вызовы в том же контексте (задаче asyncio или потоке)
+        получают то же самое соединение, поэтому хелперы можно свободно
+        вызывать друг из друга. Коммит делается при выходе из самого
+        внешнего блока, при ошибке - откат.
+        """
+        conn = self._current.get()
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        callbacks = []
+        token = self._current.set(conn)
+        callbacks_token = self._after.set(callbacks)
+        committed = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+            committed = True
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._after.reset(callbacks_token)
+            self._current.reset(token)
+            self._release(conn)
+            for callback, on_commit in callbacks:
+                if on_commit and not committed:
+                    continue
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка в обработчике после транзакции: {e}")
+
+    def after_transaction(self, callback):
+        """Вызывает callback, когда текущая транзакция завершится (коммитом или откатом).
+
+        Вне блока connection() вызывает сразу. Нужен для сброса кэшей:
+        если сбросить кэш до коммита, другой поток успеет снова
+        прочитать из базы старые данные.
+        """
+        self._defer(callback, on_commit=False)
+
+    def after_commit(self, callback):
+        """Как after_transaction, но при откате callback не вызывается.
+
+        Для изменений в памяти, которые верны, только если записались в базу.
+        """
+        self._defer(callback, on_commit=True)
+
+    def _defer(self, callback, on_commit):
+        callbacks = self._after.get()
+        if callbacks is None:
+            callback()
+        else:
+            callbacks.append((callback, on_commit))
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
+
+
+pool = ConnectionPool()
+
+
+def connection():
+    return pool.connection()
+
+
+def after_transaction(callback):
+    pool.after_transaction(callback)
+
+
+def after_commit(callback):
+    pool.after_commit(callback)
+
+
+# ================== АСИНХРОННЫЙ ДОСТУП ==================
+# Все запросы выполняются в отдельных потоках, чтобы event loop бота
+# никогда не ждал диск. Потоков ровно столько, сколько соединений в пуле,
+# поэтому поток никогда не ждёт свободное соединение.
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+
+
+def _call(func, args, kwargs):
+    with pool.connection():
+        return func(*args, **kwargs)
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков.
+
+    Всё, что функция делает с базой (включая вложенные хелперы), идёт
+    через одно соединение и одну транзакцию. Функция видит контекст
+    вызывающей задачи (например, профиль автора апдейта).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, context.run, functools.partial(_call, func, args, kwargs))
+    finally:
+        metrics.db_seconds.observe(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+
+def _fetchone(sql, params):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(sql, params):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def _execute(sql, params):
+    with pool.connection() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+async def fetchone(sql, params=()):
+    return await run(_fetchone, sql, params)
+
+
+async def fetchall(sql, params=()):
+    return await run(_fetchall, sql, params)
+
+
+async def execute(sql, params=()):
+    return await run(_execute, sql, params)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
+    pool.close()
@@ -0,0 +1,164 @@
+import os
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+import db
+import outbox
+import timestamps
+
+# ================== СВОДКИ ДЛЯ ПРОДАВЦОВ ==================
+# Если у продавца одновременно подходит срок у нескольких товаров, он
+# получает одно сообщение со списком вместо сообщения на каждый товар.
+EXPIRY = "expiry"
+RELEVANCE = "relevance"
+
+# С какого количества товаров вместо отдельных сообщений шлётся сводка
+MIN_ITEMS = int(os.getenv("BRAINROT_DIGEST_MIN", "2"))
+PAGE_SIZE = 5
+
+EXTEND_COOLDOWN = 3 * timestamps.DAY
+
+
+def create(seller_id, kind, product_ids):
+    with db.connection() as conn:
+        digest_id = conn.execute(
+            "INSERT INTO digests (seller_id, kind) VALUES (?, ?)", (seller_id, kind)
+        ).lastrowid
+        conn.executemany("INSERT OR IGNORE INTO digest_items (digest_id, product_id) VALUES (?, ?)",
+                         [(digest_id, product_id) for product_id in product_ids])
+    return digest_id
+
+
+def _owned(conn, digest_id, user_id):
+    row = conn.execute("SELECT seller_id, kind FROM digests WHERE id = ?", (digest_id,)).fetchone()
+    if row is None or row[0] != user_id:
+        return None
+    return row[1]
+
+
+def _pending_ids(conn, digest_id):
+    return [row[0] for row in conn.execute("""
+        SELECT i.product_id FROM digest_items i JOIN products p ON p.id = i.product_id
+        WHERE i.digest_id = ? AND i.done = 0 ORDER BY p.expires_at, p.id
+    """, (digest_id,))]
+
+
+def load_page(digest_id, user_id, page):
+    """(kind, товары страницы, всего, номер страницы) или None для чужой сводки"""
+    with db.connection() as conn:
+        kind = _owned(conn, digest_id, user_id)
+        if kind is None:
+            return None
+        total = conn.execute("""
+            SELECT COUNT(*) FROM digest_items i JOIN products p ON p.id = i.product_id
+            WHERE i.digest_id = ? AND i.done = 0
+        """, (digest_id,)).fetchone()[0]
+        pages = max(1, -(-total // PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        items = conn.execute("""
+            SELECT p.id, p.title, p.expires_at FROM digest_items i JOIN products p ON p.id = i.product_id
+            WHERE i.digest_id = ? AND i.done = 0 ORDER BY p.expires_at, p.id LIMIT ? OFFSET ?
+        """, (digest_id, PAGE_SIZE, page * PAGE_SIZE)).fetchall()
+    return kind, items, total, page
+
+
+def mark_done(digest_id, product_ids):
+    with db.connection() as conn:
+        conn.executemany("UPDATE digest_items SET done = 1 WHERE digest_id = ? AND product_id = ?",
+                         [(digest_id, product_id) for product_id in product_ids])
+
+
+def extend_all(digest_id, user_id):
+    """Продлевает все необработанные товары сводки одним UPDATE.
+
+    Возвращает (новый срок, продлённые id, пропущенные id) или None.
+    Пропускаются товары, которые продлевались меньше трёх дней назад.
+    """
+    now = timestamps.now()
+    new_expires_at = now + 3 * timestamps.DAY
+    with db.connection() as conn:
+        if _owned(conn, digest_id, user_id) != EXPIRY:
+            return None
+        pending = _pending_ids(conn, digest_id)
+        extended = [row[0] for row in conn.execute(f"""
+            SELECT id FROM products
+            WHERE id IN ({",".join("?" * len(pending))}) AND seller_id = ?
+              AND (last_extended_at IS NULL OR last_extended_at <= ?)
+        """, (*pending, user_id, now - EXTEND_COOLDOWN))] if pending else []
+        if extended:
+            conn.execute(f"""
+                UPDATE products SET expires_at = ?, last_extended_at = ?
+                WHERE id IN ({",".join("?" * len(extended))})
+            """, (new_expires_at, now, *extended))
+            mark_done(digest_id, extended)
+    done = set(extended)
+    skipped = [product_id for product_id in pending if product_id not in done]
+    return new_expires_at, extended, skipped
+
+
+def confirm_all(digest_id, user_id):
+    """Подтверждает актуальность всех необработанных товаров сводки; список id или None"""
+    with db.connection() as conn:
+        if _owned(conn, digest_id, user_id) != RELEVANCE:
+            return None
+        pending = _pending_ids(conn, digest_id)
+        if pending:
+            conn.execute(f"""
+                UPDATE products SET last_checked_at = ?
+                WHERE id IN ({",".join("?" * len(pending))}) AND seller_id = ?
+            """, (timestamps.now(), *pending, user_id))
+            mark_done(digest_id, pending)
+    return pending
+
+
+# ================== ОТРИСОВКА ==================
+def render(digest_id, kind, items, total, page):
+    """Текст и клавиатура страницы сводки"""
+    if total == 0:
+        return "✅ Все товары из этой подборки обработаны.", None
+    pages = -(-total // PAGE_SIZE)
+    if kind == EXPIRY:
+        header = f"⚠️ <b>Скоро истекут ваши товары: {total}</b>\n\n"
+        footer = "\nПродлите нужные товары ещё на 3 дня."
+    else:
+        header = f"❓ <b>Проверка актуальности: {total} товаров</b>\n\n"
+        footer = "\nОтметьте проданные товары, остальные останутся в ленте."
+    lines = []
+    kb = InlineKeyboardBuilder()
+    rows = []
+    for number, (product_id, title, expires_at) in enumerate(items, start=page * PAGE_SIZE + 1):
+        if kind == EXPIRY:
+            lines.append(f"{number}. {title} — до {timestamps.format_ts(expires_at)}")
+            kb.button(text=f"⏳ Продлить №{number}", callback_data=f"dg_ext_{digest_id}_{product_id}_{page}")
+            rows.append(1)
+        else:
+            lines.append(f"{number}. {title}")
+            kb.button(text=f"✅ №{number} продан", callback_data=f"dg_sold_{digest_id}_{product_id}_{page}")
+            kb.button(text=f"🔄 №{number} продаётся", callback_data=f"dg_keep_{digest_id}_{product_id}_{page}")
+            rows.append(2)
+    if pages > 1:
+        if page > 0:
+            kb.button(text="◀️", callback_data=f"dg_page_{digest_id}_{page - 1}")
+        kb.button(text=f"{page + 1}/{pages}", callback_data=f"dg_page_{digest_id}_{page}")
+        if page < pages - 1:
+            kb.button(text="▶️", callback_data=f"dg_page_{digest_id}_{page + 1}")
+        rows.append(1 + (page > 0) + (page < pages - 1))
+    if kind == EXPIRY:
+        kb.button(text="⏳ Продлить все", callback_data=f"dg_extall_{digest_id}")
+    else:
+        kb.button(text="🔄 Все ещё продаются", callback_data=f"dg_keepall_{digest_id}")
+    rows.append(1)
+    kb.adjust(*rows)
+    return header + "\n".join(lines) + footer, kb.as_markup()
+
+
+def queue(seller_id, kind, products):
+    """Создаёт сводку и ставит её первую страницу в очередь отправки.
+
+    products - список (id, title, expires_at), уже упорядоченный по сроку.
+    """
+    with db.connection():
+        digest_id = create(seller_id, kind, [product[0] for product in products])
+        text, markup = render(digest_id, kind, products[:PAGE_SIZE], len(products), 0)
+        outbox.enqueue(seller_id, text, parse_mode="HTML", reply_markup=markup)
+    return digest_id
@@ -0,0 +1,169 @@
+import bisect
+import logging
+import db
+import invalidation
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== ИНДЕКС ЛЕНТЫ ПОКУПАТЕЛЯ ==================
+# Карточка товара: ровно те поля, которые нужны для показа в ленте.
+# Порядок совпадает с началом строки SELECT * FROM products.
+CARD_COLUMNS = "id, seller_id, title, description, price, contact, created_at, expires_at"
+
+
+class FeedIndex:
+    """Активные товары в памяти, отсортированные по id.
+
+    Листание ленты не ходит в базу: индекс загружается один раз при
+    старте и дальше обновляется точечно теми обработчиками, которые
+    меняют товары. Истёкшие товары выбрасываются при первой встрече.
+    """
+
+    def __init__(self):
+        self._ids = []
+        self._cards = {}
+        self._expires = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self, cards, now=None):
+        now = now or timestamps.now()
+        self._ids = []
+        self._cards = {}
+        self._expires = {}
+        for card in cards:
+            expires = card[7]
+            if expires is not None and expires > now:
+                self._cards[card[0]] = tuple(card)
+                self._expires[card[0]] = expires
+        self._ids = sorted(self._cards)
+        self.loaded = True
+
+    def put(self, card, now=None):
+        """Добавляет или обновляет карточку; неактивный товар убирается"""
+        now = now or timestamps.now()
+        product_id = card[0]
+        expires = card[7]
+        if expires is None or expires <= now:
+            self.discard(product_id)
+            return
+        if product_id not in self._cards:
+            bisect.insort(self._ids, product_id)
+        self._cards[product_id] = tuple(card)
+        self._expires[product_id] = expires
+
+    def discard(self, product_id):
+        if self._cards.pop(product_id, None) is None:
+            return
+        del self._expires[product_id]
+        i = bisect.bisect_left(self._ids, product_id)
+        if i < len(self._ids) and self._ids[i] == product_id:
+            del self._ids[i]
+
+    def get(self, product_id):
+        return self._cards.get(product_id)
+
+    def next_after(self, after_id, now=None):
+        """Первый активный товар после after_id, с переходом в начало ленты"""
+        now = now or timestamps.now()
+        n = len(self._ids)
+        start = bisect.bisect_right(self._ids, after_id)
+        expired = []
+        found = None
+        for k in range(n):
+            product_id = self._ids[(start + k) % n]
+            if self._expires[product_id] > now:
+                found = product_id
+                break
+            expired.append(product_id)
+        for product_id in expired:
+            self.discard(product_id)
+        return self._cards.get(found)
+
+    def diff(self, cards, now=None):
+        """Сравнивает индекс со списком активных карточек из базы.
+
+        Возвращает (отсутствуют в индексе, устарели в индексе, лишние в индексе).
+        """
+        now = now or timestamps.now()
+        expected = {card[0]: tuple(card) for card in cards}
+        active = {pid: card for pid, card in self._cards.items() if self._expires[pid] > now}
+        missing = sorted(set(expected) - set(active))
+        extra = sorted(set(active) - set(expected))
+        stale = sorted(pid for pid in set(expected) & set(active) if expected[pid] != active[pid])
+        return missing, stale, extra
+
+
+index = FeedIndex()
+
+
+# ================== СИНХРОНИЗАЦИЯ С БАЗОЙ ==================
+def load_active_cards(now=None):
+    with db.connection() as conn:
+        return conn.execute(
+            f"SELECT {CARD_COLUMNS} FROM products WHERE expires_at > ? ORDER BY id",
+            (now or timestamps.now(),)
+        ).fetchall()
+
+
+def load_card(product_id):
+    with db.connection() as conn:
+        return conn.execute(f"SELECT {CARD_COLUMNS} FROM products WHERE id = ?", (product_id,)).fetchone()
+
+
+def load_cards(product_ids):
+    with db.connection() as conn:
+        return conn.execute(
+            f"SELECT {CARD_COLUMNS} FROM products WHERE id IN ({','.join('?' * len(product_ids))})", product_ids
+        ).fetchall()
+
+
+async def load():
+    cards = await db.run(load_active_cards)
+    index.load(cards)
+    logger.info(f"✅ Индекс ленты загружен: {len(index)} активных товаров")
+
+
+async def refresh(product_id):
+    """Перечитывает один товар из базы после его изменения"""
+    product_id = int(product_id)
+    card = await db.run(load_card, product_id)
+    if card is None:
+        index.discard(product_id)
+    else:
+        index.put(card)
+    invalidation.publish(invalidation.PRODUCT, product_id)
+
+
+async def _reload(product_ids):
+    """Перечитывает товары, изменённые другими воркерами"""
+    if not index.loaded:
+        return
+    cards = {card[0]: card for card in await db.run(load_cards, product_ids)}
+    for product_id in product_ids:
+        if product_id in cards:
+            index.put(cards[product_id])
+        else:
+            index.discard(product_id)
+
+
+invalidation.subscribe(invalidation.PRODUCT, _reload)
+
+
+async def verify():
+    """Сверяет индекс с базой и перезагружает его при расхождении.
+
+    Возвращает id товаров, по которым было расхождение.
+    """
+    now = timestamps.now()
+    cards = await db.run(load_active_cards, now)
+    missing, stale, extra = index.diff(cards, now)
+    if missing or stale or extra:
+        logger.warning(
+            f"⚠️ Индекс ленты расходится с базой: нет {missing}, устарели {stale}, лишние {extra}. Перезагружаю"
+        )
+        index.load(cards, now)
+    return missing + stale + extra
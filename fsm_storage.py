@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ ХРАНИЛИЩА FSM ==================
+# Состояния диалогов (добавление товара, отзыв, действия админа)
+# переживают перезапуск бота. Чтение и запись идут через словарь в
+# памяти, а изменения раз в FLUSH_INTERVAL сбрасываются в базу пачкой.
+FLUSH_INTERVAL = float(os.getenv("BRAINROT_FSM_FLUSH", "0.5"))
+# Брошенный на середине диалог забывается через сутки
+TTL = int(os.getenv("BRAINROT_FSM_TTL_HOURS", "24")) * timestamps.HOUR
+CLEANUP_INTERVAL = timestamps.HOUR
+
+
+def _key(key):
+    return ":".join("" if part is None else str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+# ================== ТАБЛИЦА В БАЗЕ ==================
+def load_active(since):
+    with db.connection() as conn:
+        return conn.execute(
+            "SELECT key, state, data, updated_at FROM fsm_storage WHERE updated_at >= ?", (since,)
+        ).fetchall()
+
+
+def save(rows, removed):
+    """rows - [(key, state, data, updated_at)], removed - ключи пустых записей"""
+    with db.connection() as conn:
+        conn.executemany("""
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                            updated_at = excluded.updated_at
+        """, rows)
+        conn.executemany("DELETE FROM fsm_storage WHERE key = ?", [(key,) for key in removed])
+
+
+def delete_stale(before):
+    with db.connection() as conn:
+        return conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,)).rowcount
+
+
+# ================== ХРАНИЛИЩЕ ==================
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite с кэшем в памяти.
+
+    После load() кэш содержит все живые записи, поэтому get_* не ходят
+    в базу. set_* меняют кэш и помечают ключ; фоновая задача run()
+    записывает помеченные ключи одной транзакцией. close() (его вызывает
+    Dispatcher при остановке) сбрасывает то, что не успело уйти.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, ttl=TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        # ключ -> [состояние, данные, время изменения]
+        self._cache = {}
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _entry(self, key):
+        name = _key(key)
+        entry = self._cache.get(name)
+        if entry is None:
+            entry = self._cache[name] = [None, {}, 0]
+        return name, entry
+
+    def _touch(self, name, entry):
+        entry[2] = timestamps.now()
+        self._dirty.add(name)
+        self._wakeup.set()
+
+    async def set_state(self, key, state=None):
+        name, entry = self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._touch(name, entry)
+
+    async def get_state(self, key):
+        entry = self._cache.get(_key(key))
+        return entry[0] if entry else None
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name, entry = self._entry(key)
+        entry[1] = data.copy()
+        self._touch(name, entry)
+
+    async def get_data(self, key):
+        entry = self._cache.get(_key(key))
+        return entry[1].copy() if entry else {}
+
+    async def load(self, owns=None):
+        """owns(user_id) - какие диалоги брать, когда пользователи поделены между воркерами"""
+        rows = await db.run(load_active, timestamps.now() - self.ttl)
+        for name, state, data, updated_at in rows:
+            if owns is None or owns(int(name.split(":")[2])):
+                self._cache[name] = [state, json.loads(data) if data else {}, updated_at]
+        logger.info(f"✅ Хранилище FSM: восстановлено {len(self)} диалогов")
+
+    async def flush(self):
+        if not self._dirty:
+            return 0
+        names, self._dirty = self._dirty, set()
+        rows, removed = [], []
+        for name in names:
+            entry = self._cache.get(name)
+            if entry is None:
+                continue
+            state, data, updated_at = entry
+            if state is None and not data:
+                # Диалог завершён (state.clear()) - запись больше не нужна
+                removed.append(name)
+            else:
+                rows.append((name, state, json.dumps(data, ensure_ascii=False), updated_at))
+        try:
+            await db.run(save, rows, removed)
+        except Exception:
+            # Повторим со следующей пачкой
+            self._dirty |= names
+            raise
+        for name in removed:
+            entry = self._cache.get(name)
+            # Пока шла запись, диалог мог начаться заново
+            if entry is not None and entry[0] is None and not entry[1]:
+                del self._cache[name]
+        self.flushes += 1
+        return len(names)
+
+    async def expire(self):
+        before = timestamps.now() - self.ttl
+        for name in [name for name, entry in self._cache.items() if entry[2] < before]:
+            del self._cache[name]
+            self._dirty.discard(name)
+        return await db.run(delete_stale, before)
+
+    async def run(self):
+        next_cleanup = timestamps.now() + CLEANUP_INTERVAL
+        while True:
+            timeout = max(next_cleanup - timestamps.now(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                # Даём накопиться изменениям, чтобы записать их одной транзакцией
+                await asyncio.sleep(self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if timestamps.now() >= next_cleanup:
+                    next_cleanup = timestamps.now() + CLEANUP_INTERVAL
+                    removed = await self.expire()
+                    if removed:
+                        logger.info(f"🧹 Хранилище FSM: удалено {removed} брошенных диалогов")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при сохранении состояний FSM: {e}")
+
+    async def close(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить состояния FSM при остановке: {e}")
+
+    def stats_text(self):
+        return f"{len(self)} диалогов, {len(self._dirty)} ждут записи, сбросов {self.flushes}"
@@ -0,0 +1,131 @@
+import asyncio
+import inspect
+import logging
+import threading
+from collections import defaultdict
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== СБРОС КЭШЕЙ МЕЖДУ ПРОЦЕССАМИ ==================
+# Когда бот работает несколькими воркерами, у каждого свои кэши в
+# памяти (лента, карточки, профили, лимиты). Изменение, сделанное в
+# одном воркере, записывается в таблицу cache_events, остальные
+# воркеры читают её и сбрасывают у себя соответствующие записи.
+# В обычном однопроцессном режиме publish() ничего не делает.
+PRODUCT = "product"
+PROFILE = "profile"
+QUOTA = "quota"
+
+POLL_INTERVAL = 0.5
+BATCH_SIZE = 1000
+RETENTION = timestamps.HOUR
+
+_handlers = defaultdict(list)
+_pending = set()
+_lock = threading.Lock()
+_origin = None
+_loop = None
+_wakeup = None
+_last_id = 0
+
+
+def subscribe(kind, handler):
+    """handler(keys) вызывается со списком ключей, изменённых другими воркерами"""
+    _handlers[kind].append(handler)
+
+
+def publish(kind, key):
+    """Сообщает другим воркерам об изменении; уходит после коммита транзакции"""
+    if _origin is None:
+        return
+    db.after_transaction(lambda: _add(kind, int(key)))
+
+
+def _add(kind, key):
+    with _lock:
+        _pending.add((kind, key))
+    _loop.call_soon_threadsafe(_wakeup.set)
+
+
+# ================== ТАБЛИЦА В БАЗЕ ==================
+def latest_id():
+    with db.connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_events").fetchone()[0]
+
+
+def write(origin, events):
+    with db.connection() as conn:
+        conn.executemany("INSERT INTO cache_events (origin, kind, key) VALUES (?, ?, ?)",
+                         [(origin, kind, key) for kind, key in events])
+
+
+def read(after, limit=BATCH_SIZE):
+    with db.connection() as conn:
+        return conn.execute(
+            "SELECT id, origin, kind, key FROM cache_events WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        ).fetchall()
+
+
+def prune(before):
+    with db.connection() as conn:
+        return conn.execute("DELETE FROM cache_events WHERE created_at < ?", (before,)).rowcount
+
+
+# ================== ПРИЁМ СОБЫТИЙ ==================
+async def enable(origin):
+    """Включает рассылку; вызывать до загрузки кэшей, чтобы не пропустить события"""
+    global _origin, _loop, _wakeup, _last_id
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    _last_id = await db.run(latest_id)
+    _origin = origin
+
+
+async def _apply(rows):
+    changed = defaultdict(set)
+    for _, origin, kind, key in rows:
+        if origin != _origin:
+            changed[kind].add(key)
+    for kind, keys in changed.items():
+        for handler in _handlers[kind]:
+            try:
+                result = handler(sorted(keys))
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"❌ Ошибка при сбросе кэша {kind}: {e}")
+
+
+async def run():
+    global _last_id
+    next_prune = timestamps.now() + RETENTION
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            with _lock:
+                events = list(_pending)
+                _pending.clear()
+            if events:
+                try:
+                    await db.run(write, _origin, events)
+                except Exception:
+                    with _lock:
+                        _pending.update(events)
+                    raise
+            rows = await db.run(read, _last_id)
+            while rows:
+                _last_id = rows[-1][0]
+                await _apply(rows)
+                rows = await db.run(read, _last_id) if len(rows) == BATCH_SIZE else []
+            if timestamps.now() >= next_prune:
+                next_prune = timestamps.now() + RETENTION
+                await db.run(prune, timestamps.now() - RETENTION)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обмена событиями кэша: {e}")
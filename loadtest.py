@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+# ================== НАГРУЗОЧНЫЙ ТЕСТ ==================
+# Запускает бота отдельным процессом против подставного Bot API на
+# localhost, заполняет временную базу товарами, пользователями и
+# отзывами и гоняет тысячи синтетических пользователей по сценариям.
+# Сеть не нужна:
+#
+#   python loadtest.py --users 2000 --duration 60
+#   python loadtest.py --users 2000 --workers 4
+#
+# Задержка шага - от отправки апдейта до последнего ожидаемого ответа
+# бота в этот чат.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_BASE = 10_000_000
+SELLER_BASE = 20_000_000
+STEP_TIMEOUT = 30
+WARMUP_TIMEOUT = 120
+# Сообщения, которые бот шлёт сам через очередь отправки, а не в ответ на шаг
+NOTIFICATIONS = ("🆕", "📢", "📊 Продавец", "❌ Ваш отзыв не прошёл", "⚠️ <b>", "❓")
+FLOWS = {"buyer": 70, "listing": 10, "review": 15, "moderation": 5}
+
+
+# ================== ПОДСТАВНОЙ BOT API ==================
+class FakeBotAPI:
+    """getUpdates/sendMessage/editMessageText/answerCallbackQuery в памяти.
+
+    Ответы бота раскладываются по входящим очередям пользователей.
+    """
+
+    def __init__(self):
+        self._updates = []
+        self._arrived = asyncio.Event()
+        self._ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callbacks = {}
+        self.inboxes = defaultdict(asyncio.Queue)
+        self.delivered = 0
+        self.calls = defaultdict(int)
+        # Параметры последнего вызова каждого метода, например setWebhook
+        self.params = {}
+
+    def push(self, update):
+        update["update_id"] = next(self._ids)
+        self._updates.append(update)
+        self._arrived.set()
+
+    def message(self, user_id, text):
+        self.push(self.message_update(user_id, text))
+
+    def message_update(self, user_id, text):
+        """Апдейт с текстовым сообщением без update_id"""
+        user = {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"}
+        update = {"message": {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": user, "text": text,
+        }}
+        if text.startswith("/"):
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return update
+
+    def callback(self, user_id, data, message_id):
+        callback_id = str(next(self._ids))
+        self._callbacks[callback_id] = user_id
+        user = {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"}
+        self.push({"callback_query": {
+            "id": callback_id, "from": user, "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "text": "-"},
+        }})
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), min(int(params.get("timeout") or 0), 5))
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:int(params.get("limit") or 100)]
+        self.delivered += len(batch)
+        return batch
+
+    def _reply(self, method, params):
+        if method == "answerCallbackQuery":
+            user_id = self._callbacks.pop(params.get("callback_query_id"), None)
+            if user_id is not None:
+                self.inboxes[user_id].put_nowait((time.perf_counter(), method, params))
+            return True
+        chat_id = int(params["chat_id"])
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        self.inboxes[chat_id].put_nowait((time.perf_counter(), method, params))
+        return {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"}}
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+        self.params[method] = params
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText", "answerCallbackQuery"):
+            result = self._reply(method, params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+# ================== ЗАПОЛНЕНИЕ БАЗЫ ==================
+def seed(path, users, sellers, products, reviews):
+    """Создаёт схему и тестовые данные; возвращает ADMIN_IDS бота"""
+    os.environ["BRAINROT_DB"] = path
+    # main читает BRAINROT_DB при импорте: база, лимит и админы берутся оттуда
+    import main
+    import activity
+    import db
+    import migrations
+    import timestamps
+
+    migrations.migrate(main.DAILY_LIMIT)
+    now = timestamps.now()
+    rnd = random.Random(42)
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, first_name, registered_at) VALUES (?, ?, ?, ?)",
+            [(user_id, f"u{user_id}", f"U{user_id}", now - rnd.randint(0, 30 * timestamps.DAY))
+             for user_id in itertools.chain(range(USER_BASE, USER_BASE + users),
+                                            range(SELLER_BASE, SELLER_BASE + sellers), main.ADMIN_IDS)]
+        )
+        # Сроки не ближе суток, чтобы за время теста не пошли уведомления об истечении
+        conn.executemany(
+            "INSERT INTO products (seller_id, title, description, price, contact, created_at, expires_at, "
+            "last_checked_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(SELLER_BASE + rnd.randrange(sellers), f"Brainrot #{n}", "Тестовый товар " * 5,
+              f"{rnd.randint(10, 5000)} Robux", f"seller{n}", now - rnd.randint(0, 2 * timestamps.DAY),
+              now + timestamps.DAY + rnd.randint(0, timestamps.DAY), now)
+             for n in range(products)]
+        )
+        conn.executemany(
+            "INSERT INTO reviews (seller_id, buyer_id, rating, comment, is_moderated, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(SELLER_BASE + rnd.randrange(sellers), USER_BASE + rnd.randrange(users), rnd.randint(1, 5),
+              rnd.choice((None, "Всё ок", "Быстро и честно", "Долго отвечал")), int(rnd.random() > 0.1),
+              now - rnd.randint(0, 30 * timestamps.DAY))
+             for _ in range(reviews)]
+        )
+        main.rebuild_seller_stats()
+        activity.backfill()
+    db.shutdown()
+    return main.ADMIN_IDS
+
+
+# ================== СИНТЕТИЧЕСКИЕ ПОЛЬЗОВАТЕЛИ ==================
+class StepTimeout(Exception):
+    pass
+
+
+def callbacks(reply):
+    """callback_data всех кнопок ответа"""
+    markup = reply[2].get("reply_markup")
+    if not markup:
+        return []
+    return [button.get("callback_data") for row in json.loads(markup).get("inline_keyboard", []) for button in row]
+
+
+def find_callback(replies, prefix):
+    for reply in reversed(replies):
+        for data in callbacks(reply):
+            if data and data.startswith(prefix):
+                return data, int(reply[2].get("message_id") or 0)
+    return None, None
+
+
+class Simulation:
+    def __init__(self, api, stats, think):
+        self.api = api
+        self.stats = stats
+        self.think = think
+        self.last_message = {}
+
+    async def _expect(self, user_id, expect, started):
+        inbox = self.api.inboxes[user_id]
+        replies = []
+        deadline = started + STEP_TIMEOUT
+        while len(replies) < expect:
+            try:
+                reply = await asyncio.wait_for(inbox.get(), max(deadline - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                raise StepTimeout()
+            if reply[2].get("text", "").startswith(NOTIFICATIONS):
+                continue
+            replies.append(reply)
+            if reply[1] == "sendMessage":
+                self.last_message[user_id] = reply
+        return replies
+
+    async def step(self, flow, user_id, action, expect=1):
+        inbox = self.api.inboxes[user_id]
+        while not inbox.empty():
+            inbox.get_nowait()
+        started = time.perf_counter()
+        action()
+        try:
+            replies = await self._expect(user_id, expect, started)
+        except StepTimeout:
+            self.stats[flow]["errors"] += 1
+            raise
+        self.stats[flow]["latencies"].append(replies[-1][0] - started)
+        if self.think:
+            await asyncio.sleep(random.uniform(0, self.think))
+        return replies
+
+    async def send(self, flow, user_id, text, expect=1):
+        return await self.step(flow, user_id, lambda: self.api.message(user_id, text), expect)
+
+    async def press(self, flow, user_id, data, message_id, expect=2):
+        return await self.step(flow, user_id, lambda: self.api.callback(user_id, data, message_id), expect)
+
+    # ---------- сценарии ----------
+    async def buyer(self, user_id, swipes):
+        await self.send("buyer", user_id, "🛍️ Покупатель", expect=2)
+        for _ in range(swipes):
+            await self.send("buyer", user_id, "⏭️ Следующий товар")
+
+    async def listing(self, user_id):
+        await self.send("listing", user_id, "💰 Продавец")
+        reply = await self.send("listing", user_id, "➕ Добавить товар")
+        if not reply[0][2].get("text", "").startswith("📝 Добавление"):
+            return  # лимит на сегодня исчерпан
+        for text in ("Brainrot из теста", "Описание из нагрузочного теста", "150 Robux", f"u{user_id}"):
+            await self.send("listing", user_id, text)
+
+    async def review(self, user_id):
+        replies = await self.send("review", user_id, "🛍️ Покупатель", expect=2)
+        data, message_id = find_callback(replies, "reviews:")
+        if data is None:
+            return
+        replies = await self.press("review", user_id, data, message_id)
+        data, _ = find_callback(replies, "rev_load:")
+        replies = await self.press("review", user_id, data, message_id)
+        data, _ = find_callback(replies, "leave_review:")
+        await self.press("review", user_id, data, message_id)
+        await self.send("review", user_id, str(random.randint(1, 5)))
+        await self.send("review", user_id, "Нагрузочный отзыв")
+
+    async def moderation(self, admin_id, decisions):
+        replies = await self.send("moderation", admin_id, "📝 Модерация отзывов")
+        for _ in range(decisions):
+            action = random.choice(("mod_approve:", "mod_reject:"))
+            data, message_id = find_callback(replies, action)
+            if data is None:
+                return
+            replies = await self.press("moderation", admin_id, data, message_id)
+
+
+# ================== ПРОГОН ==================
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(stats, updates, elapsed):
+    lines = [f"{'Сценарий':<12}{'шагов':>8}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"]
+    for flow in FLOWS:
+        latencies = stats[flow]["latencies"]
+        cells = [percentile(latencies, q) for q in (0.5, 0.95, 0.99)]
+        cells = "".join(f"{value * 1000:>10.1f}" if value is not None else f"{'-':>10}" for value in cells)
+        lines.append(f"{flow:<12}{len(latencies):>8}{stats[flow]['errors']:>8}{cells}")
+    lines.append(f"\nАпдейтов: {updates} за {elapsed:.1f} с ({updates / elapsed:.1f}/с)")
+    return "\n".join(lines)
+
+
+async def user_loop(sim, user_id, admin_id, args, stop_at):
+    weights = {flow: weight for flow, weight in FLOWS.items() if flow != "moderation"}
+    while time.monotonic() < stop_at:
+        flow = random.choices(list(weights), list(weights.values()))[0]
+        try:
+            if flow == "buyer":
+                await sim.buyer(user_id, args.swipes)
+            elif flow == "listing":
+                await sim.listing(user_id)
+            else:
+                await sim.review(user_id)
+        except StepTimeout:
+            pass
+
+
+async def admin_loop(sim, admin_id, args, stop_at):
+    # У админа один чат, поэтому модерация идёт одним «пользователем»
+    while time.monotonic() < stop_at:
+        try:
+            await sim.moderation(admin_id, args.decisions)
+        except StepTimeout:
+            pass
+        await asyncio.sleep(1)
+
+
+async def warm_up(sim, count):
+    """По одному /start в каждый воркер: дожидаемся, пока все поднимутся"""
+    for shard in range(count):
+        user_id = USER_BASE + shard
+        started = time.perf_counter()
+        sim.api.message(user_id, "/start")
+        await asyncio.wait_for(sim._expect(user_id, 1, started), WARMUP_TIMEOUT)
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="brainrot-load-")
+    path = os.path.join(workdir, "brainrot_shop.db")
+    print(f"🌱 Заполняю {path}: {args.users} пользователей, {args.products} товаров, {args.reviews} отзывов")
+    admin_ids = seed(path, args.users, args.sellers, args.products, args.reviews)
+
+    api = FakeBotAPI()
+    runner = await api.start(args.port)
+    env = dict(os.environ, BRAINROT_DB=path, BRAINROT_BOT_API=f"http://127.0.0.1:{args.port}",
+               BRAINROT_METRICS_PORT="0")
+    command = [sys.executable, os.path.join(BASE_DIR, "main.py")]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    log = open(os.path.join(workdir, "bot.log"), "w")
+    bot = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        stats = defaultdict(lambda: {"latencies": [], "errors": 0})
+        sim = Simulation(api, stats, args.think)
+        print("⏳ Жду запуска бота...")
+        await warm_up(sim, args.workers)
+        stats.clear()
+
+        print(f"🚀 {args.users} пользователей, {args.duration} с")
+        delivered = api.delivered
+        started = time.monotonic()
+        stop_at = started + args.duration
+        tasks = [asyncio.create_task(admin_loop(sim, admin_ids[0], args, stop_at))]
+        for n in range(args.users):
+            tasks.append(asyncio.create_task(user_loop(sim, USER_BASE + n, admin_ids[0], args, stop_at)))
+            # Плавный разгон, чтобы не начинать с пачки в тысячи апдейтов
+            await asyncio.sleep(args.ramp / args.users)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+        print()
+        print(report(stats, api.delivered - delivered, elapsed))
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        log.close()
+        await runner.cleanup()
+        if args.keep:
+            print(f"\n📁 База и лог бота: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Brainrot Shop Bot без сети")
+    parser.add_argument("--users", type=int, default=1000, help="синтетических пользователей")
+    parser.add_argument("--sellers", type=int, default=200, help="продавцов в базе")
+    parser.add_argument("--products", type=int, default=2000, help="товаров в базе")
+    parser.add_argument("--reviews", type=int, default=5000, help="отзывов в базе (10%% на модерации)")
+    parser.add_argument("--duration", type=float, default=60, help="длительность прогона, с")
+    parser.add_argument("--ramp", type=float, default=10, help="разгон до всех пользователей, с")
+    parser.add_argument("--swipes", type=int, default=10, help="листаний за один заход покупателя")
+    parser.add_argument("--decisions", type=int, default=10, help="решений админа за один заход")
+    parser.add_argument("--think", type=float, default=1.0, help="пауза пользователя между шагами до N с")
+    parser.add_argument("--workers", type=int, default=1, help="передаётся боту как --workers")
+    parser.add_argument("--port", type=int, default=8081, help="порт подставного Bot API")
+    parser.add_argument("--keep", action="store_true", help="не удалять базу и лог бота")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,40 @@
+import argparse
 import asyncio
 import logging
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
+import signal
+import time
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+
+import activity
+import archive
+import cards
+import db
+import digests
+import feed
+import fsm_storage
+import invalidation
+import metrics
+import middlewares
+import migrations
+import outbox
+import profiles
+import quota
+import scheduler
+import timestamps
+import webhook
+import workers
 
 # ==================== НАСТРОЙКА ЛОГИРОВАНИЯ ===================
 logging.basicConfig(
@@ -34,14 +57,26 @@ ADMIN_IDS = [1593674702]
 DAILY_LIMIT = 6
 
 # ==================== ИНИЦИАЛИЗАЦИЯ БОТА ===================
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-storage = MemoryStorage()
+# Свой сервер Bot API: локальный telegram-bot-api или подставной для тестов
+BOT_API = os.getenv("BRAINROT_BOT_API")
+session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API)) if BOT_API else None
+bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+storage = fsm_storage.SQLiteStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(middlewares.UserContextMiddleware(daily_limit=DAILY_LIMIT))
+dp.message.middleware(middlewares.HandlerMetricsMiddleware())
+dp.callback_query.middleware(middlewares.HandlerMetricsMiddleware())
+bot.session.middleware(middlewares.RequestMetricsMiddleware())
+outbox_sender = outbox.OutboxSender(bot)
 
 # ================== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ==================
-user_product_positions = {}
+# Позиции в ленте и страницы админа принадлежат одному пользователю; в
+# режиме воркеров все его апдейты идут в один процесс, так что общими
+# эти словари быть не должны
+user_feed_cursors = {}
 admin_pages = {}
-moderation_index = {}
+# Номер воркера для /health, если бот запущен несколькими процессами
+worker_label = None
 
 # ================== СОСТОЯНИЯ (FSM) ==================
 class ProductForm(StatesGroup):
@@ -68,155 +103,12 @@ class ReviewState(StatesGroup):
     waiting_for_comment = State()
     waiting_for_evidence = State()
 
-# ================== БАЗА ДАННЫХ ==================
-def init_database():
-    """Создаёт таблицы, если их нет"""
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-
-        c.execute('''CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            seller_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            price TEXT NOT NULL,
-            contact TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute(f'''CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            is_banned BOOLEAN DEFAULT 0,
-            ban_reason TEXT,
-            is_whitelisted BOOLEAN DEFAULT 0,
-            daily_limit INTEGER DEFAULT {DAILY_LIMIT},
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS admin_actions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            admin_id INTEGER NOT NULL,
-            action_type TEXT NOT NULL,
-            target_id INTEGER,
-            target_type TEXT,
-            reason TEXT,
-            details TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            seller_id INTEGER NOT NULL,
-            buyer_id INTEGER NOT NULL,
-            product_id INTEGER,
-            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
-            comment TEXT,
-            is_moderated BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (seller_id) REFERENCES users(user_id),
-            FOREIGN KEY (buyer_id) REFERENCES users(user_id),
-            FOREIGN KEY (product_id) REFERENCES products(id)
-        )''')
-
-        conn.commit()
-        conn.close()
-        logger.info("✅ База данных инициализирована")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка БД: {e}")
-        return False
-
-# ================== ИСПРАВЛЕННОЕ ДОБАВЛЕНИЕ КОЛОНОК ==================
-def add_missing_columns():
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(products)")
-        columns = [row[1] for row in c.fetchall()]
-
-        if 'expires_at' not in columns:
-            c.execute("ALTER TABLE products ADD COLUMN expires_at TIMESTAMP")
-            logger.info("✅ Добавлена колонка expires_at")
-
-        if 'last_extended_at' not in columns:
-            c.execute("ALTER TABLE products ADD COLUMN last_extended_at TIMESTAMP")
-            logger.info("✅ Добавлена колонка last_extended_at")
-
-        if 'last_checked_at' not in columns:
-            try:
-                c.execute("ALTER TABLE products ADD COLUMN last_checked_at TIMESTAMP")
-                logger.info("✅ Добавлена колонка last_checked_at (без DEFAULT)")
-                c.execute("UPDATE products SET last_checked_at = CURRENT_TIMESTAMP WHERE last_checked_at IS NULL")
-                logger.info("✅ Установлено значение last_checked_at для существующих записей")
-            except sqlite3.OperationalError as e:
-                logger.error(f"❌ Ошибка при добавлении last_checked_at: {e}")
-
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка при добавлении колонок: {e}")
-        return False
-
-# ================== ОБНОВЛЕНИЕ СТАРЫХ ТОВАРОВ ==================
-def update_old_products():
-    """Проставляет expires_at для старых товаров, у которых это поле NULL"""
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""
-            UPDATE products 
-            SET expires_at = datetime(created_at, '+3 days') 
-            WHERE expires_at IS NULL
-        """)
-        affected = c.rowcount
-        if affected > 0:
-            logger.info(f"✅ Обновлено {affected} старых товаров: проставлен expires_at")
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"❌ Ошибка при обновлении старых товаров: {e}")
-
 # ================== ФУНКЦИИ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ==================
-def get_or_create_user(user_id, username="", first_name="", last_name=""):
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        user = c.fetchone()
-        if not user:
-            c.execute(
-                """INSERT INTO users (user_id, username, first_name, last_name, daily_limit) 
-                   VALUES (?, ?, ?, ?, ?)""",
-                (user_id, username, first_name, last_name, DAILY_LIMIT)
-            )
-            logger.info(f"👤 Создан новый пользователь: {username} (ID: {user_id})")
-        else:
-            c.execute(
-                """UPDATE users SET username = ?, first_name = ?, last_name = ? 
-                   WHERE user_id = ?""",
-                (username, first_name, last_name, user_id)
-            )
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка в get_or_create_user: {e}")
-        return False
-
 def check_if_user_banned(user_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT is_banned, ban_reason FROM users WHERE user_id = ?", (user_id,))
-        result = c.fetchone()
-        conn.close()
-        if result and result[0] == 1:
-            return True, result[1]
+        profile = profiles.get(user_id)
+        if profile and profile.is_banned:
+            return True, profile.ban_reason
         return False, None
     except Exception as e:
         logger.error(f"❌ Ошибка при проверке бана: {e}")
@@ -224,12 +116,11 @@ def check_if_user_banned(user_id):
 
 def ban_user_in_db(user_id, reason, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("UPDATE users SET is_banned = 1, ban_reason = ? WHERE user_id = ?", (reason, user_id))
-        log_admin_action(admin_id=admin_id, action_type="ban_user", target_id=user_id, target_type="user", reason=reason, details=f"Забанен пользователь")
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE users SET is_banned = 1, ban_reason = ? WHERE user_id = ?", (reason, user_id))
+            profiles.invalidate(user_id)
+            log_admin_action(admin_id=admin_id, action_type="ban_user", target_id=user_id, target_type="user", reason=reason, details=f"Забанен пользователь")
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка при бане пользователя: {e}")
@@ -237,12 +128,11 @@ def ban_user_in_db(user_id, reason, admin_id):
 
 def unban_user_in_db(user_id, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("UPDATE users SET is_banned = 0, ban_reason = NULL WHERE user_id = ?", (user_id,))
-        log_admin_action(admin_id=admin_id, action_type="unban_user", target_id=user_id, target_type="user", reason="Разбан", details=f"Разбанен пользователь")
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE users SET is_banned = 0, ban_reason = NULL WHERE user_id = ?", (user_id,))
+            profiles.invalidate(user_id)
+            log_admin_action(admin_id=admin_id, action_type="unban_user", target_id=user_id, target_type="user", reason="Разбан", details=f"Разбанен пользователь")
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка при разбане пользователя: {e}")
@@ -250,12 +140,10 @@ def unban_user_in_db(user_id, admin_id):
 
 def log_admin_action(admin_id, action_type, target_id=None, target_type=None, reason=None, details=None):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, reason, details) VALUES (?, ?, ?, ?, ?, ?)""",
-                  (admin_id, action_type, target_id, target_type, reason, details))
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, reason, details) VALUES (?, ?, ?, ?, ?, ?)""",
+                      (admin_id, action_type, target_id, target_type, reason, details))
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка логирования действия админа: {e}")
@@ -263,14 +151,13 @@ def log_admin_action(admin_id, action_type, target_id=None, target_type=None, re
 
 def get_user_by_id_or_username(search_term):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        if search_term.isdigit():
-            c.execute("SELECT user_id, username, is_banned, ban_reason FROM users WHERE user_id = ?", (int(search_term),))
-        else:
-            c.execute("SELECT user_id, username, is_banned, ban_reason FROM users WHERE username = ?", (search_term,))
-        user = c.fetchone()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            if search_term.isdigit():
+                c.execute("SELECT user_id, username, is_banned, ban_reason FROM users WHERE user_id = ?", (int(search_term),))
+            else:
+                c.execute("SELECT user_id, username, is_banned, ban_reason FROM users WHERE username = ?", (search_term,))
+            user = c.fetchone()
         return user
     except Exception as e:
         logger.error(f"❌ Ошибка в get_user_by_id_or_username: {e}")
@@ -278,23 +165,18 @@ def get_user_by_id_or_username(search_term):
 
 def is_user_whitelisted(user_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT is_whitelisted FROM users WHERE user_id = ?", (user_id,))
-        result = c.fetchone()
-        conn.close()
-        return result and result[0] == 1
+        profile = profiles.get(user_id)
+        return bool(profile and profile.is_whitelisted)
     except Exception as e:
         logger.error(f"❌ Ошибка при проверке белого списка: {e}")
         return False
 
 def get_whitelist():
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""SELECT user_id, username, first_name, last_name FROM users WHERE is_whitelisted = 1 ORDER BY user_id""")
-        users = c.fetchall()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("""SELECT user_id, username, first_name, last_name FROM users WHERE is_whitelisted = 1 ORDER BY user_id""")
+            users = c.fetchall()
         return users
     except Exception as e:
         logger.error(f"❌ Ошибка при получении белого списка: {e}")
@@ -302,13 +184,12 @@ def get_whitelist():
 
 def add_to_whitelist(user_id, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("UPDATE users SET is_whitelisted = 1 WHERE user_id = ?", (user_id,))
-        c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, details) VALUES (?, ?, ?, ?, ?)""",
-                  (admin_id, "add_to_whitelist", user_id, "user", f"Добавлен в белый список"))
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE users SET is_whitelisted = 1 WHERE user_id = ?", (user_id,))
+            profiles.invalidate(user_id)
+            c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, details) VALUES (?, ?, ?, ?, ?)""",
+                      (admin_id, "add_to_whitelist", user_id, "user", f"Добавлен в белый список"))
         return True, "✅ Пользователь добавлен в белый список."
     except Exception as e:
         logger.error(f"❌ Ошибка при добавлении в белый список: {e}")
@@ -316,43 +197,78 @@ def add_to_whitelist(user_id, admin_id):
 
 def remove_from_whitelist(user_id, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("UPDATE users SET is_whitelisted = 0 WHERE user_id = ?", (user_id,))
-        c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, details) VALUES (?, ?, ?, ?, ?)""",
-                  (admin_id, "remove_from_whitelist", user_id, "user", f"Удален из белого списка"))
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE users SET is_whitelisted = 0 WHERE user_id = ?", (user_id,))
+            profiles.invalidate(user_id)
+            c.execute("""INSERT INTO admin_actions (admin_id, action_type, target_id, target_type, details) VALUES (?, ?, ?, ?, ?)""",
+                      (admin_id, "remove_from_whitelist", user_id, "user", f"Удален из белого списка"))
         return True, "✅ Пользователь удален из белого списка."
     except Exception as e:
         logger.error(f"❌ Ошибка при удалении из белого списка: {e}")
         return False, f"❌ Ошибка: {e}"
 
-def get_all_products():
+CATALOGUE_PAGE_SIZE = 10
+CATALOGUE_STATUSES = {"all": "все", "active": "активные", "expired": "истёкшие"}
+
+def get_catalogue_page(filters, cursor=None, direction="older", per_page=CATALOGUE_PAGE_SIZE):
+    """Страница админского каталога от новых товаров к старым.
+
+    cursor - (created_at, id) крайнего товара соседней страницы;
+    direction "older" берёт товары после него, "newer" - перед ним,
+    "current" - начиная с него самого. Возвращает (товары, есть ли ещё).
+    """
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""
-            SELECT p.id, p.title, p.price, p.contact, p.seller_id,
-                   (SELECT username FROM users WHERE user_id = p.seller_id LIMIT 1) as username,
-                   p.expires_at
-            FROM products p 
-            ORDER BY p.id DESC
-        """)
-        products = c.fetchall()
-        conn.close()
-        return products
+        now = timestamps.now()
+        where, params = [], []
+        if filters.get("status") == "active":
+            where.append("p.expires_at > ?")
+            params.append(now)
+        elif filters.get("status") == "expired":
+            where.append("p.expires_at <= ?")
+            params.append(now)
+        if filters.get("seller_id") is not None:
+            where.append("p.seller_id = ?")
+            params.append(filters["seller_id"])
+        if filters.get("created_from") is not None:
+            where.append("p.created_at >= ?")
+            params.append(filters["created_from"])
+        if filters.get("created_to") is not None:
+            where.append("p.created_at < ?")
+            params.append(filters["created_to"])
+        order = "DESC"
+        if cursor is not None:
+            comparison = {"older": "<", "newer": ">", "current": "<="}[direction]
+            where.append(f"(p.created_at, p.id) {comparison} (?, ?)")
+            params.extend(cursor)
+            if direction == "newer":
+                order = "ASC"
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute(f"""
+                SELECT p.id, p.title, p.price, p.contact, p.seller_id, u.username, p.expires_at, p.created_at
+                FROM products p
+                LEFT JOIN users u ON u.user_id = p.seller_id
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY p.created_at {order}, p.id {order}
+                LIMIT ?
+            """, (*params, per_page + 1))
+            products = c.fetchall()
+        has_more = len(products) > per_page
+        products = products[:per_page]
+        if order == "ASC":
+            products.reverse()
+        return products, has_more
     except Exception as e:
-        logger.error(f"❌ Ошибка в get_all_products: {e}")
-        return []
+        logger.error(f"❌ Ошибка в get_catalogue_page: {e}")
+        return [], False
 
 def get_product_by_id(product_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-        product = c.fetchone()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+            product = c.fetchone()
         return product
     except Exception as e:
         logger.error(f"❌ Ошибка в get_product_by_id: {e}")
@@ -360,11 +276,10 @@ def get_product_by_id(product_id):
 
 def get_all_products_count():
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM products")
-        count = c.fetchone()[0]
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT COUNT(*) FROM products")
+            count = c.fetchone()[0]
         return count
     except Exception as e:
         logger.error(f"❌ Ошибка в get_all_products_count: {e}")
@@ -372,24 +287,15 @@ def get_all_products_count():
 
 def can_user_add_product(user_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT is_banned, is_whitelisted, daily_limit FROM users WHERE user_id = ?", (user_id,))
-        user_info = c.fetchone()
-        if not user_info:
+        profile = profiles.get(user_id)
+        if not profile:
             return False, "❌ Ошибка: пользователь не найден в системе."
-        is_banned, is_whitelisted, daily_limit = user_info
-        if is_banned:
-            c.execute("SELECT ban_reason FROM users WHERE user_id = ?", (user_id,))
-            ban_reason = c.fetchone()[0]
-            return False, f"⛔ Вы забанены! Причина: {ban_reason}"
-        if is_whitelisted:
-            conn.close()
+        if profile.is_banned:
+            return False, f"⛔ Вы забанены! Причина: {profile.ban_reason}"
+        if profile.is_whitelisted:
             return True, "✅ Вы в белом списке! Лимитов нет."
-        time_24h_ago = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-        c.execute("SELECT COUNT(*) FROM products WHERE seller_id = ? AND created_at >= ?", (user_id, time_24h_ago))
-        products_last_24h = c.fetchone()[0]
-        conn.close()
+        daily_limit = profile.daily_limit
+        products_last_24h = quota.engine.used(user_id, daily_limit)
         if products_last_24h >= daily_limit:
             return False, (f"❌ **Лимит исчерпан!**\n\nВы можете добавить только {daily_limit} товаров в сутки.\nВы уже добавили {products_last_24h} товаров за последние 24 часа.\nПопробуйте позже или свяжитесь с администратором.")
         remaining = daily_limit - products_last_24h
@@ -398,89 +304,146 @@ def can_user_add_product(user_id):
         logger.error(f"❌ Ошибка в can_user_add_product: {e}")
         return False, "❌ Произошла ошибка при проверке лимита."
 
+# Лента покупателя идёт по id: курсор хранит id последнего показанного товара,
+# поэтому добавление и удаление товаров не сдвигает позицию пользователя
+FEED_QUERY = "SELECT * FROM products WHERE id > ? AND expires_at > ? ORDER BY id ASC LIMIT 1"
+
+def fetch_feed_product(after_id):
+    """Первый активный товар после after_id; в конце ленты - снова с начала"""
+    now = timestamps.now()
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute(FEED_QUERY, (after_id, now))
+        product = c.fetchone()
+        if product is None and after_id:
+            c.execute(FEED_QUERY, (0, now))
+            product = c.fetchone()
+    return product
+
 async def get_next_product_for_user(user_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM products WHERE expires_at > ? ORDER BY id ASC", (datetime.now(),))
-        all_products = c.fetchall()
-        if not all_products:
-            conn.close()
-            return None
-        current_position = user_product_positions.get(user_id, 0)
-        if current_position >= len(all_products):
-            current_position = 0
-        product = all_products[current_position]
-        next_position = current_position + 1
-        if next_position >= len(all_products):
-            next_position = 0
-        user_product_positions[user_id] = next_position
-        conn.close()
+        after_id = user_feed_cursors.get(user_id, 0)
+        if feed.index.loaded:
+            product = feed.index.next_after(after_id)
+        else:
+            product = await db.run(fetch_feed_product, after_id)
+        if product:
+            user_feed_cursors[user_id] = product[0]
         return product
     except Exception as e:
         logger.error(f"❌ Ошибка при получении товара: {e}")
         return None
 
-async def get_first_product():
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM products WHERE expires_at > ? ORDER BY id ASC LIMIT 1", (datetime.now(),))
-        product = c.fetchone()
-        conn.close()
-        return product
-    except Exception as e:
-        logger.error(f"❌ Ошибка при получении первого товара: {e}")
-        return None
+async def get_first_product(user_id):
+    user_feed_cursors[user_id] = 0
+    return await get_next_product_for_user(user_id)
 
 # ================== ФУНКЦИИ ДЛЯ ОТЗЫВОВ ==================
+# seller_stats хранит сумму, число и распределение одобренных оценок;
+# его меняют только approve_review и reject_review в своей транзакции.
+def update_seller_stats(c, seller_id, rating, delta):
+    c.execute("INSERT OR IGNORE INTO seller_stats (seller_id) VALUES (?)", (seller_id,))
+    c.execute(f"""
+        UPDATE seller_stats
+        SET rating_sum = rating_sum + ?, rating_count = rating_count + ?, stars_{int(rating)} = stars_{int(rating)} + ?
+        WHERE seller_id = ?
+    """, (rating * delta, delta, delta, seller_id))
+
+def rebuild_seller_stats():
+    """Пересчитывает seller_stats по таблице reviews; возвращает число продавцов"""
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM seller_stats")
+        c.execute("""
+            INSERT INTO seller_stats
+            SELECT seller_id, SUM(rating), COUNT(*),
+                   SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+            FROM reviews WHERE is_moderated = 1 GROUP BY seller_id
+        """)
+        return c.rowcount
+
+def get_seller_stats(seller_id):
+    """(сумма, число, [число оценок 1..5]) одобренных отзывов продавца"""
+    with db.connection() as conn:
+        row = conn.execute(
+            "SELECT rating_sum, rating_count, stars_1, stars_2, stars_3, stars_4, stars_5 "
+            "FROM seller_stats WHERE seller_id = ?", (seller_id,)
+        ).fetchone()
+    if not row:
+        return 0, 0, [0] * 5
+    return row[0], row[1], list(row[2:])
+
 def get_seller_rating(seller_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT AVG(rating), COUNT(*) FROM reviews WHERE seller_id = ? AND is_moderated = 1", (seller_id,))
-        avg, count = c.fetchone()
-        conn.close()
-        if avg:
-            return round(avg, 1), count
+        rating_sum, count, _ = get_seller_stats(seller_id)
+        if count:
+            return round(rating_sum / count, 1), count
         return None, 0
     except Exception as e:
         logger.error(f"❌ Ошибка в get_seller_rating: {e}")
         return None, 0
 
-def get_seller_reviews(seller_id, page=0, per_page=5):
+# Курсор страницы отзывов: направление ("a" - старше, "b" - новее) и
+# позиция (created_at, id) крайнего отзыва в base36, например "a1k2j3l.2s"
+def to_base36(value):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        value, rest = divmod(value, 36)
+        text = digits[rest] + text
+        if not value:
+            return text
+
+def encode_review_cursor(direction, created_at, review_id):
+    return f"{direction}{to_base36(created_at)}.{to_base36(review_id)}"
+
+def decode_review_cursor(cursor):
+    if not cursor:
+        return None
+    created_at, review_id = cursor[1:].split(".")
+    return cursor[0], int(created_at, 36), int(review_id, 36)
+
+def get_seller_reviews(seller_id, cursor=None, per_page=5):
+    """Страница одобренных отзывов, от новых к старым.
+
+    Страница берётся по индексу от позиции курсора, поэтому дальние
+    страницы стоят столько же, сколько первая.
+    """
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        offset = page * per_page
-        c.execute("""
-            SELECT r.rating, r.comment, r.created_at, u.username 
-            FROM reviews r
-            LEFT JOIN users u ON r.buyer_id = u.user_id
-            WHERE r.seller_id = ? AND r.is_moderated = 1
-            ORDER BY r.created_at DESC
-            LIMIT ? OFFSET ?
-        """, (seller_id, per_page, offset))
-        reviews = c.fetchall()
-        c.execute("SELECT COUNT(*) FROM reviews WHERE seller_id = ? AND is_moderated = 1", (seller_id,))
-        total = c.fetchone()[0]
-        conn.close()
-        return reviews, total
+        position = decode_review_cursor(cursor)
+        with db.connection() as conn:
+            c = conn.cursor()
+            sql = """
+                SELECT r.id, r.rating, r.comment, r.created_at, u.username 
+                FROM reviews r
+                LEFT JOIN users u ON r.buyer_id = u.user_id
+                WHERE r.seller_id = ? AND r.is_moderated = 1
+            """
+            if position is None:
+                c.execute(sql + " ORDER BY r.created_at DESC, r.id DESC LIMIT ?", (seller_id, per_page))
+                return c.fetchall()
+            direction, created_at, review_id = position
+            if direction == "a":
+                c.execute(sql + " AND (r.created_at, r.id) < (?, ?) ORDER BY r.created_at DESC, r.id DESC LIMIT ?",
+                          (seller_id, created_at, review_id, per_page))
+                return c.fetchall()
+            c.execute(sql + " AND (r.created_at, r.id) > (?, ?) ORDER BY r.created_at ASC, r.id ASC LIMIT ?",
+                      (seller_id, created_at, review_id, per_page))
+            return c.fetchall()[::-1]
     except Exception as e:
         logger.error(f"❌ Ошибка в get_seller_reviews: {e}")
-        return [], 0
+        return []
 
 def add_review(seller_id, buyer_id, product_id, rating, comment):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO reviews (seller_id, buyer_id, product_id, rating, comment, is_moderated)
-            VALUES (?, ?, ?, ?, ?, 0)
-        """, (seller_id, buyer_id, product_id, rating, comment))
-        review_id = c.lastrowid
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO reviews (seller_id, buyer_id, product_id, rating, comment, is_moderated)
+                VALUES (?, ?, ?, ?, ?, 0)
+            """, (seller_id, buyer_id, product_id, rating, comment))
+            review_id = c.lastrowid
+            activity.record(activity.REVIEW_SUBMITTED)
         return review_id
     except Exception as e:
         logger.error(f"❌ Ошибка в add_review: {e}")
@@ -488,33 +451,41 @@ def add_review(seller_id, buyer_id, product_id, rating, comment):
 
 def get_review_by_id(review_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("""
-            SELECT r.id, r.rating, r.comment, r.created_at, 
-                   u_buyer.user_id, u_buyer.username, 
-                   u_seller.user_id, u_seller.username
-            FROM reviews r
-            LEFT JOIN users u_buyer ON r.buyer_id = u_buyer.user_id
-            LEFT JOIN users u_seller ON r.seller_id = u_seller.user_id
-            WHERE r.id = ?
-        """, (review_id,))
-        rev = c.fetchone()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT r.id, r.rating, r.comment, r.created_at, 
+                       u_buyer.user_id, u_buyer.username, 
+                       u_seller.user_id, u_seller.username
+                FROM reviews r
+                LEFT JOIN users u_buyer ON r.buyer_id = u_buyer.user_id
+                LEFT JOIN users u_seller ON r.seller_id = u_seller.user_id
+                WHERE r.id = ?
+            """, (review_id,))
+            rev = c.fetchone()
         return rev
     except Exception as e:
         logger.error(f"❌ Ошибка в get_review_by_id: {e}")
         return None
 
+# Отзыв на модерации можно обработать, если он ничей, аренда истекла
+# или принадлежит этому админу
+MODERATION_LEASE = 10 * timestamps.MINUTE
+LEASE_FREE = "(lease_owner IS NULL OR lease_until <= ? OR lease_owner = ?)"
+
 def approve_review(review_id, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("UPDATE reviews SET is_moderated = 1 WHERE id = ?", (review_id,))
-        c.execute("SELECT seller_id, rating, comment FROM reviews WHERE id = ?", (review_id,))
-        seller_id, rating, comment = c.fetchone()
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute(f"""
+                UPDATE reviews SET is_moderated = 1, lease_owner = NULL, lease_until = NULL
+                WHERE id = ? AND is_moderated = 0 AND {LEASE_FREE}
+            """, (review_id, timestamps.now(), admin_id))
+            if c.rowcount == 0:
+                return None
+            c.execute("SELECT seller_id, rating, comment FROM reviews WHERE id = ?", (review_id,))
+            seller_id, rating, comment = c.fetchone()
+            update_seller_stats(c, seller_id, rating, 1)
         return seller_id, rating, comment
     except Exception as e:
         logger.error(f"❌ Ошибка в approve_review: {e}")
@@ -522,31 +493,76 @@ def approve_review(review_id, admin_id):
 
 def reject_review(review_id, admin_id):
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT buyer_id FROM reviews WHERE id = ?", (review_id,))
-        buyer_id = c.fetchone()
-        if buyer_id:
-            buyer_id = buyer_id[0]
-        c.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
-        conn.commit()
-        conn.close()
-        return buyer_id
+        with db.connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT buyer_id FROM reviews WHERE id = ?", (review_id,))
+            review = c.fetchone()
+            c.execute(f"DELETE FROM reviews WHERE id = ? AND is_moderated = 0 AND {LEASE_FREE}",
+                      (review_id, timestamps.now(), admin_id))
+            if c.rowcount == 0:
+                return None
+        return review[0]
     except Exception as e:
         logger.error(f"❌ Ошибка в reject_review: {e}")
         return None
 
-def get_unmoderated_reviews():
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def claim_next_review(admin_id, after=None):
+    """Берёт в аренду следующий отзыв из очереди и возвращает его id.
+
+    Сначала возвращается отзыв, который уже арендован этим админом, затем
+    самый старый свободный. after=(created_at, id) - взять свободный отзыв
+    после указанного (кнопка «Пропустить»).
+    """
+    now = timestamps.now()
+    with db.connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT id FROM reviews WHERE is_moderated = 0 ORDER BY created_at ASC")
-        ids = [row[0] for row in c.fetchall()]
-        conn.close()
-        return ids
-    except Exception as e:
-        logger.error(f"❌ Ошибка в get_unmoderated_reviews: {e}")
-        return []
+        position, params = "", [now, admin_id]
+        if after is not None:
+            position = "AND (created_at, id) > (?, ?)"
+            params.extend(after)
+        target = f"""(
+            SELECT id FROM reviews
+            WHERE is_moderated = 0 AND {LEASE_FREE} {position}
+            ORDER BY created_at, id
+            LIMIT 1
+        )"""
+        if after is None:
+            target = f"""COALESCE((
+                SELECT id FROM reviews WHERE is_moderated = 0 AND lease_owner = ? AND lease_until > ? LIMIT 1
+            ), {target})"""
+            params = [admin_id, now, *params]
+        c.execute(f"UPDATE reviews SET lease_owner = ?, lease_until = ? WHERE id = {target} RETURNING id",
+                  (admin_id, now + MODERATION_LEASE, *params))
+        row = c.fetchone()
+    return row[0] if row else None
+
+def release_review(review_id, admin_id):
+    with db.connection() as conn:
+        conn.execute("UPDATE reviews SET lease_owner = NULL, lease_until = NULL WHERE id = ? AND lease_owner = ?",
+                     (review_id, admin_id))
+
+def moderation_queue_stats():
+    """(ожидают, в работе, возраст самого старого в секундах)"""
+    now = timestamps.now()
+    with db.connection() as conn:
+        pending, leased, oldest = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(lease_until > ?), 0), MIN(created_at)
+            FROM reviews WHERE is_moderated = 0
+        """, (now,)).fetchone()
+    return pending, leased, now - oldest if oldest else 0
+
+def format_age(seconds):
+    if seconds >= timestamps.DAY:
+        return f"{seconds // timestamps.DAY} д"
+    if seconds >= timestamps.HOUR:
+        return f"{seconds // timestamps.HOUR} ч"
+    return f"{seconds // timestamps.MINUTE} мин"
+
+def moderation_stats_text():
+    pending, leased, oldest = moderation_queue_stats()
+    if not pending:
+        return "очередь пуста"
+    return f"ожидают {pending}, в работе {leased}, самому старому {format_age(oldest)}"
 
 # ================== КЛАВИАТУРЫ ==================
 def get_main_menu_keyboard():
@@ -622,13 +638,7 @@ def get_whitelist_keyboard():
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.clear()
-    get_or_create_user(
-        user_id=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    user_product_positions[message.from_user.id] = 0
+    user_feed_cursors[message.from_user.id] = 0
     await message.answer("🎮 Steal A Brainrot Shop\n\nВыберите свою роль:", reply_markup=get_main_menu_keyboard())
 
 @dp.message(Command("help"))
@@ -641,33 +651,45 @@ async def cmd_help(message: types.Message, state: FSMContext):
         "/mylimit - узнать свой лимит\n"
         "/status - состояние бота\n"
         "/ids - список ID товаров (админ)\n"
-        "/health - диагностика (админ)\n\n"
+        "/catalog - каталог товаров с фильтрами (админ)\n"
+        "/health - диагностика (админ)\n"
+        "/rebuild_stats - пересчитать рейтинги продавцов (админ)\n"
+        "/backfill_activity - заполнить счётчики активности по истории (админ)\n\n"
         "Используйте кнопки меню для навигации."
     )
 
+def load_user_limits(user_id):
+    """Собирает всё для /mylimit за одно обращение к базе"""
+    is_banned, ban_reason = check_if_user_banned(user_id)
+    if is_banned:
+        return (True, ban_reason), None, None, 0
+    limit_check = can_user_add_product(user_id)
+    profile = profiles.get(user_id)
+    user_info = (profile.is_whitelisted, profile.daily_limit) if profile else None
+    products_last_24h = 0
+    if profile and profile.is_whitelisted:
+        # Для белого списка окно лимита не ведётся, считаем честно
+        with db.connection() as conn:
+            products_last_24h = conn.execute(
+                "SELECT COUNT(*) FROM products WHERE seller_id = ? AND created_at >= ?",
+                (user_id, timestamps.now() - timestamps.DAY)
+            ).fetchone()[0]
+    elif profile:
+        products_last_24h = quota.engine.used(user_id, profile.daily_limit)
+    return (False, None), limit_check, user_info, products_last_24h
+
 @dp.message(Command("mylimit"))
 async def cmd_mylimit(message: types.Message, state: FSMContext):
     await state.clear()
     user_id = message.from_user.id
-    is_banned, ban_reason = check_if_user_banned(user_id)
-    if is_banned:
-        await message.answer(f"⛔ **Вы забанены!**\n\n📝 Причина: {ban_reason}\n\nВы не можете добавлять товары.\nДля разблока свяжитесь с администратором.", parse_mode="Markdown")
-        return
-    can_add, limit_message = can_user_add_product(user_id)
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT is_whitelisted, daily_limit FROM users WHERE user_id = ?", (user_id,))
-        user_info = c.fetchone()
-        conn.close()
+        (is_banned, ban_reason), limit_check, user_info, products_last_24h = await db.run(load_user_limits, user_id)
+        if is_banned:
+            await message.answer(f"⛔ **Вы забанены!**\n\n📝 Причина: {ban_reason}\n\nВы не можете добавлять товары.\nДля разблока свяжитесь с администратором.", parse_mode="Markdown")
+            return
+        can_add, limit_message = limit_check
         if user_info:
             is_whitelisted, daily_limit = user_info
-            time_24h_ago = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-            conn = sqlite3.connect('brainrot_shop.db')
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM products WHERE seller_id = ? AND created_at >= ?", (user_id, time_24h_ago))
-            products_last_24h = c.fetchone()[0]
-            conn.close()
             status = "⚪ **В белом списке**" if is_whitelisted else "🔵 **Обычный пользователь**"
             limit_text = "∞ (без лимитов)" if is_whitelisted else f"{daily_limit} товаров/сутки"
             response = f"📊 **Ваши лимиты**\n\n{status}\n📈 Дневной лимит: {limit_text}\n📦 Добавлено за 24 часа: {products_last_24h}\n\n"
@@ -685,20 +707,16 @@ async def cmd_mylimit(message: types.Message, state: FSMContext):
 @dp.message(Command("status"))
 async def cmd_status(message: types.Message, state: FSMContext):
     await state.clear()
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM products")
-    total_products = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM users WHERE is_whitelisted = 1")
-    whitelisted_users = c.fetchone()[0]
-    conn.close()
+    total_products, whitelisted_users = await db.fetchone(
+        "SELECT (SELECT COUNT(*) FROM products), (SELECT COUNT(*) FROM users WHERE is_whitelisted = 1)"
+    )
     await message.answer(
         f"🤖 Статус бота:\n\n"
         f"✅ Онлайн и работает\n"
         f"🕒 Время сервера: {datetime.now().strftime('%H:%M:%S')}\n"
         f"📊 Товаров в базе: {total_products}\n"
         f"⚪ Пользователей в белом списке: {whitelisted_users}\n"
-        f"👥 Пользователей в памяти: {len(user_product_positions)}"
+        f"👥 Пользователей в памяти: {len(user_feed_cursors)}"
     )
 
 # ================== АДМИН КОМАНДЫ ==================
@@ -708,9 +726,41 @@ async def cmd_admin(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         await message.answer("⛔ У вас нет доступа к этой команде.")
         return
-    user_product_positions[message.from_user.id] = 0
+    user_feed_cursors[message.from_user.id] = 0
     await message.answer("👨‍💻 **Панель администратора**\n\nВыберите действие на клавиатуре ниже:", reply_markup=get_admin_keyboard(), parse_mode="Markdown")
 
+def parse_catalogue_filters(args):
+    """Фильтры из аргументов /catalog: active|expired, seller=<id>, from=<дата>, to=<дата>"""
+    filters = {"status": "all", "seller_id": None, "created_from": None, "created_to": None}
+    for arg in (args or "").split():
+        key, _, value = arg.partition("=")
+        if key in CATALOGUE_STATUSES and not value:
+            filters["status"] = key
+        elif key == "seller":
+            filters["seller_id"] = int(value)
+        elif key == "from":
+            filters["created_from"] = timestamps.parse_date(value)
+        elif key == "to":
+            filters["created_to"] = timestamps.parse_date(value) + timestamps.DAY
+        else:
+            raise ValueError(arg)
+    return filters
+
+def describe_catalogue_filters(filters):
+    parts = [f"статус: {CATALOGUE_STATUSES[filters['status']]}"]
+    if filters["seller_id"] is not None:
+        parts.append(f"продавец: {filters['seller_id']}")
+    if filters["created_from"] is not None:
+        parts.append(f"с {timestamps.format_date(filters['created_from'])}")
+    if filters["created_to"] is not None:
+        parts.append(f"по {timestamps.format_date(filters['created_to'] - timestamps.DAY)}")
+    return ", ".join(parts)
+
+async def open_catalogue(message: types.Message, filters):
+    # Для админа хранятся только фильтры и границы текущей страницы
+    admin_pages[message.from_user.id] = {"filters": filters, "page": 0, "first": None, "last": None}
+    await send_products_page(message.from_user.id, message)
+
 @dp.message(F.text == "👁 Просмотреть все товары")
 async def admin_show_all_products(message: types.Message, state: FSMContext):
     await state.clear()
@@ -718,83 +768,70 @@ async def admin_show_all_products(message: types.Message, state: FSMContext):
         await message.answer("⛔ У вас нет доступа.")
         return
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM products")
-        total_count = c.fetchone()[0]
-        if total_count == 0:
-            await message.answer("📭 В базе данных пока нет товаров.")
-            conn.close()
-            return
-        c.execute("""
-            SELECT 
-                p.id, 
-                p.title, 
-                p.price, 
-                p.contact, 
-                p.seller_id,
-                (SELECT username FROM users WHERE user_id = p.seller_id LIMIT 1) as username,
-                p.expires_at
-            FROM products p 
-            ORDER BY p.id DESC
-        """)
-        all_products = c.fetchall()
-        conn.close()
-        admin_pages[message.from_user.id] = {
-            'products': all_products,
-            'page': 0,
-            'total': total_count
-        }
-        await send_products_page(message.from_user.id, message)
+        await open_catalogue(message, parse_catalogue_filters(""))
     except Exception as e:
         logger.error(f"❌ Ошибка в admin_show_all_products: {e}", exc_info=True)
         await message.answer("❌ Произошла ошибка при загрузке товаров.")
 
-async def send_products_page(user_id, target_message_or_callback):
+@dp.message(Command("catalog"))
+async def cmd_catalog(message: types.Message, state: FSMContext, command: CommandObject):
+    await state.clear()
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        filters = parse_catalogue_filters(command.args)
+    except ValueError:
+        await message.answer(
+            "❌ Неверный фильтр.\n\n"
+            "Формат: /catalog [active|expired] [seller=ID] [from=ДД.ММ.ГГГГ] [to=ДД.ММ.ГГГГ]"
+        )
+        return
+    try:
+        await open_catalogue(message, filters)
+    except Exception as e:
+        logger.error(f"❌ Ошибка в cmd_catalog: {e}", exc_info=True)
+        await message.answer("❌ Произошла ошибка при загрузке товаров.")
+
+async def send_products_page(user_id, target_message_or_callback, direction="current"):
     data = admin_pages.get(user_id)
     if not data:
         return
-    products = data['products']
-    page = data['page']
-    total = data['total']
-    per_page = 10
-    start = page * per_page
-    end = start + per_page
-    page_products = products[start:end]
-    total_pages = (total + per_page - 1) // per_page
-
-    text = f"📋 <b>Все товары в базе (всего: {total})</b>\n"
-    text += f"📄 Страница {page + 1} из {total_pages}\n\n"
-
-    for product in page_products:
-        product_id, title, price, contact, seller_id, username, expires_at = product
-        safe_title = title[:35] + "..." if len(title) > 35 else title
-        seller_info = f"@{username}" if username else f"ID: {seller_id}"
-        if expires_at:
-            expires_clean = expires_at.split('.')[0]
-            expires_dt = datetime.strptime(expires_clean, '%Y-%m-%d %H:%M:%S')
-            expires_str = expires_dt.strftime('%d.%m.%Y %H:%M')
-        else:
-            expires_str = 'не указано'
-        text += (
-            f"<b>🔢 ID: {product_id}</b>\n"
-            f"📌 {safe_title}\n"
-            f"💰 {price} | 👤 {seller_info}\n"
-            f"📞 @{contact}\n"
-            f"⏳ Истекает: {expires_str}\n"
-            f"────────────────────\n"
-        )
+    cursor = {"older": data["last"], "newer": data["first"], "current": data["first"]}[direction]
+    products, has_more = await db.run(get_catalogue_page, data["filters"], cursor, direction)
+    if direction == "newer" and (len(products) < CATALOGUE_PAGE_SIZE or (data["page"] == 0 and has_more)):
+        # Первая страница сдвинулась из-за новых или удалённых товаров - начинаем с начала
+        data["page"] = 0
+        products, has_more = await db.run(get_catalogue_page, data["filters"])
+    if products:
+        data["first"] = (products[0][7], products[0][0])
+        data["last"] = (products[-1][7], products[-1][0])
+    page = data["page"]
+    has_next = has_more if direction != "newer" else True
+
+    text = f"📋 <b>Товары в базе</b> ({describe_catalogue_filters(data['filters'])})\n"
+    text += f"📄 Страница {page + 1}\n\n"
+    if not products:
+        text += "📭 Товаров не найдено.\n"
+    for product in products:
+        text += cards.admin_line(product[:7])
 
     builder = InlineKeyboardBuilder()
     if page > 0:
         builder.button(text="⬅️ Назад", callback_data="admin_page_prev")
-    if end < total:
+    if products and has_next:
         builder.button(text="➡️ Вперёд", callback_data="admin_page_next")
     builder.button(text="🔄 Обновить", callback_data="admin_page_refresh")
+    next_status = {"all": "active", "active": "expired", "expired": "all"}[data["filters"]["status"]]
+    builder.button(text=f"🔎 Показать: {CATALOGUE_STATUSES[next_status]}", callback_data="admin_page_status")
     builder.adjust(2)
 
     if isinstance(target_message_or_callback, types.CallbackQuery):
-        await target_message_or_callback.message.edit_text(text, parse_mode="HTML", reply_markup=builder.as_markup())
+        try:
+            await target_message_or_callback.message.edit_text(text, parse_mode="HTML", reply_markup=builder.as_markup())
+        except TelegramBadRequest:
+            # Страница не изменилась
+            pass
         await target_message_or_callback.answer()
     else:
         await target_message_or_callback.answer(text, parse_mode="HTML", reply_markup=builder.as_markup())
@@ -808,13 +845,18 @@ async def admin_page_callback(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Сессия истекла, начните заново.")
         return
     action = callback.data.split("_")[2]
+    direction = "current"
     if action == "prev":
-        data['page'] -= 1
+        data["page"] = max(data["page"] - 1, 0)
+        direction = "newer"
     elif action == "next":
-        data['page'] += 1
-    elif action == "refresh":
-        pass
-    await send_products_page(user_id, callback)
+        data["page"] += 1
+        direction = "older"
+    elif action == "status":
+        statuses = list(CATALOGUE_STATUSES)
+        data["filters"]["status"] = statuses[(statuses.index(data["filters"]["status"]) + 1) % len(statuses)]
+        data.update(page=0, first=None, last=None)
+    await send_products_page(user_id, callback, direction)
 
 @dp.message(Command("ids"))
 async def cmd_ids(message: types.Message, state: FSMContext):
@@ -823,11 +865,7 @@ async def cmd_ids(message: types.Message, state: FSMContext):
         await message.answer("⛔ У вас нет доступа.")
         return
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT id, title FROM products ORDER BY id DESC")
-        products = c.fetchall()
-        conn.close()
+        products = await db.fetchall("SELECT id, title FROM products ORDER BY id DESC")
         if not products:
             await message.answer("📭 Товаров нет в базе.")
             return
@@ -843,6 +881,37 @@ async def cmd_ids(message: types.Message, state: FSMContext):
         logger.error(f"❌ Ошибка в cmd_ids: {e}")
         await message.answer("❌ Ошибка при получении ID товаров.")
 
+@dp.message(Command("backfill_activity"))
+async def cmd_backfill_activity(message: types.Message, state: FSMContext):
+    await state.clear()
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        totals = await db.run(activity.backfill)
+        logger.info(f"✅ Счётчики активности пересчитаны администратором {message.from_user.id}: {totals}")
+        await message.answer(
+            "✅ Счётчики активности пересчитаны по истории:\n"
+            + "".join(f"• {event}: {count}\n" for event, count in totals.items())
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка при пересчёте счётчиков активности: {e}")
+        await message.answer("❌ Не удалось пересчитать счётчики.")
+
+@dp.message(Command("rebuild_stats"))
+async def cmd_rebuild_stats(message: types.Message, state: FSMContext):
+    await state.clear()
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        sellers = await db.run(rebuild_seller_stats)
+        logger.info(f"✅ Рейтинги пересчитаны администратором {message.from_user.id}: {sellers} продавцов")
+        await message.answer(f"✅ Рейтинги пересчитаны: {sellers} продавцов.")
+    except Exception as e:
+        logger.error(f"❌ Ошибка при пересчёте рейтингов: {e}")
+        await message.answer("❌ Не удалось пересчитать рейтинги.")
+
 @dp.message(Command("health"))
 async def cmd_health(message: types.Message, state: FSMContext):
     await state.clear()
@@ -850,9 +919,6 @@ async def cmd_health(message: types.Message, state: FSMContext):
         await message.answer("⛔ У вас нет доступа.")
         return
     try:
-        import os
-        import sqlite3
-        from datetime import datetime
         memory_mb = 0
         try:
             with open('/proc/self/status') as f:
@@ -863,23 +929,27 @@ async def cmd_health(message: types.Message, state: FSMContext):
         except:
             memory_mb = 0
         db_size = 0
-        if os.path.exists('brainrot_shop.db'):
-            db_size = os.path.getsize('brainrot_shop.db') / (1024 * 1024)
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM users")
-        total_users = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM products")
-        total_products = c.fetchone()[0]
-        conn.close()
+        if os.path.exists(db.DB_PATH):
+            db_size = os.path.getsize(db.DB_PATH) / (1024 * 1024)
+        total_users, total_products = await db.fetchone(
+            "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM products)"
+        )
         text = (
             f"🏥 <b>Диагностика бота</b>\n\n"
             f"<b>Пользователи в базе:</b> {total_users}\n"
             f"<b>Товаров в базе:</b> {total_products}\n"
             f"<b>Размер базы данных:</b> {db_size:.2f} MB\n\n"
             f"<b>Память бота (приблизительно):</b> {memory_mb:.1f} MB\n"
+            f"<b>Кэш карточек:</b> {cards.cache.stats_text()}\n"
+            f"<b>Состояния диалогов:</b> {storage.stats_text()}\n"
+            f"<b>Очередь сообщений:</b> отправлено {outbox_sender.sent}, не доставлено {outbox_sender.failed}\n"
+            f"<b>Проверка актуальности:</b> {relevance_stats_text()}\n"
+            f"<b>Модерация отзывов:</b> {await db.run(moderation_stats_text)}\n"
+            f"<b>Нагрузка:</b>\n{metrics.summary_text()}\n"
             f"<b>Время:</b> {datetime.now().strftime('%H:%M:%S')}"
         )
+        if worker_label:
+            text += f"\n<b>Воркер:</b> {worker_label}"
         await message.answer(text, parse_mode="HTML")
     except Exception as e:
         logger.error(f"❌ Ошибка в health: {e}")
@@ -905,15 +975,12 @@ async def admin_find_user_products(message: types.Message, state: FSMContext):
         )
     )
 
-@dp.message(AdminActionForm.waiting_for_user_id)
-async def process_user_id_for_search(message: types.Message, state: FSMContext):
-    if message.text == "❌ Отмена поиска":
-        await state.clear()
-        await message.answer("❌ Поиск отменен.", reply_markup=get_admin_keyboard())
-        return
-    search_term = message.text.strip()
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def find_user_products(search_term):
+    """Ищет пользователя по ID или username и возвращает его товары"""
+    user_id = None
+    username = None
+    products = []
+    with db.connection() as conn:
         c = conn.cursor()
         if search_term.isdigit():
             user_id = int(search_term)
@@ -929,19 +996,31 @@ async def process_user_id_for_search(message: types.Message, state: FSMContext):
             else:
                 try:
                     user_id = int(search_term)
-                    username = None
                 except:
-                    await message.answer("❌ Пользователь не найден. Проверьте ID или username.")
-                    await state.clear()
-                    return
-        c.execute("""
-            SELECT id, title, price, contact, created_at 
-            FROM products 
-            WHERE seller_id = ? 
-            ORDER BY id DESC
-        """, (user_id,))
-        products = c.fetchall()
-        conn.close()
+                    pass
+        if user_id is not None:
+            c.execute("""
+                SELECT id, title, price, contact, created_at 
+                FROM products 
+                WHERE seller_id = ? 
+                ORDER BY id DESC
+            """, (user_id,))
+            products = c.fetchall()
+    return user_id, username, products
+
+@dp.message(AdminActionForm.waiting_for_user_id)
+async def process_user_id_for_search(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена поиска":
+        await state.clear()
+        await message.answer("❌ Поиск отменен.", reply_markup=get_admin_keyboard())
+        return
+    search_term = message.text.strip()
+    try:
+        user_id, username, products = await db.run(find_user_products, search_term)
+        if user_id is None:
+            await message.answer("❌ Пользователь не найден. Проверьте ID или username.")
+            await state.clear()
+            return
         await state.clear()
         if not products:
             user_info = f"@{username}" if username else f"ID: {user_id}"
@@ -955,7 +1034,7 @@ async def process_user_id_for_search(message: types.Message, state: FSMContext):
             text += f"<b>@{username}</b> "
         text += f"(ID: <code>{user_id}</code>)\n\n"
         for product in products[:10]:
-            created_date = datetime.strptime(product[4], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y")
+            created_date = timestamps.format_date(product[4])
             text += (
                 f"<b>🔢 ID: {product[0]}</b>\n"
                 f"📌 Название: {product[1]}\n"
@@ -1003,7 +1082,7 @@ async def process_product_id_for_delete(message: types.Message, state: FSMContex
         return
     product_id = int(message.text)
     try:
-        product = get_product_by_id(product_id)
+        product = await db.run(get_product_by_id, product_id)
         if not product:
             await message.answer("❌ Товар с таким ID не найден.")
             return
@@ -1027,27 +1106,33 @@ async def process_product_id_for_delete(message: types.Message, state: FSMContex
         await message.answer("❌ Произошла ошибка при поиске товара.")
         await state.clear()
 
-@dp.message(AdminActionForm.waiting_for_delete_reason)
-async def process_delete_reason(message: types.Message, state: FSMContext):
-    reason = message.text.strip()
-    data = await state.get_data()
-    product_id = data['delete_product_id']
-    product_title = data['delete_product_title']
-    seller_id = data['delete_seller_id']
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def delete_product_by_admin(product_id, admin_id, reason, product_title):
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        activity.record(activity.LISTING_DELETED)
         log_admin_action(
-            admin_id=message.from_user.id,
+            admin_id=admin_id,
             action_type="delete_product",
             target_id=product_id,
             target_type="product",
             reason=reason,
             details=f"Удален товар: {product_title}"
         )
-        conn.commit()
-        conn.close()
+
+@dp.message(AdminActionForm.waiting_for_delete_reason)
+async def process_delete_reason(message: types.Message, state: FSMContext):
+    reason = message.text.strip()
+    data = await state.get_data()
+    product_id = data['delete_product_id']
+    product_title = data['delete_product_title']
+    seller_id = data['delete_seller_id']
+    try:
+        await db.run(delete_product_by_admin, product_id, message.from_user.id, reason, product_title)
+        quota.engine.forget(seller_id)
+        cards.invalidate(product_id)
+        feed.index.discard(int(product_id))
+        expiry_scheduler.cancel(product_id)
         await state.clear()
         await message.answer(
             f"✅ Товар <b>ID: {product_id} - {product_title}</b> успешно удален.\n"
@@ -1056,15 +1141,13 @@ async def process_delete_reason(message: types.Message, state: FSMContext):
             reply_markup=get_admin_keyboard()
         )
         try:
-            asyncio.create_task(
-                bot.send_message(
-                    seller_id,
-                    f"⚠️ <b>Ваш товар был удален администратором</b>\n\n"
-                    f"📌 Товар: <b>{product_title}</b> (ID: #{product_id})\n"
-                    f"📝 Причина: {reason}\n\n"
-                    f"Если вы не согласны с решением, свяжитесь с администрацией.",
-                    parse_mode="HTML"
-                )
+            await outbox.send(
+                seller_id,
+                f"⚠️ <b>Ваш товар был удален администратором</b>\n\n"
+                f"📌 Товар: <b>{product_title}</b> (ID: #{product_id})\n"
+                f"📝 Причина: {reason}\n\n"
+                f"Если вы не согласны с решением, свяжитесь с администрацией.",
+                parse_mode="HTML"
             )
         except Exception as e:
             logger.error(f"❌ Ошибка при отправке уведомления продавцу: {e}")
@@ -1122,7 +1205,7 @@ async def process_ban_user_id(message: types.Message, state: FSMContext):
         return
     search_term = message.text.strip()
     admin_id = message.from_user.id
-    user = get_user_by_id_or_username(search_term)
+    user = await db.run(get_user_by_id_or_username, search_term)
     if not user:
         await message.answer("❌ Пользователь не найден. Проверьте ID или username и попробуйте снова:")
         return
@@ -1176,7 +1259,7 @@ async def process_ban_reason(message: types.Message, state: FSMContext):
     user_info = f"@{username}" if username else f"ID: {user_id}"
     if is_banned_current:
         if message.text.upper() == "ДА":
-            if unban_user_in_db(user_id, admin_id):
+            if await db.run(unban_user_in_db, user_id, admin_id):
                 await state.clear()
                 await message.answer(
                     f"✅ <b>Пользователь {user_info} успешно разбанен!</b>\n\n"
@@ -1184,15 +1267,12 @@ async def process_ban_reason(message: types.Message, state: FSMContext):
                     parse_mode="HTML",
                     reply_markup=get_admin_keyboard()
                 )
-                try:
-                    await bot.send_message(
-                        user_id,
-                        "🎉 <b>Вас разбанили!</b>\n\n"
-                        "Теперь вы снова можете добавлять товары в боте.",
-                        parse_mode="HTML"
-                    )
-                except:
-                    pass
+                await outbox.send(
+                    user_id,
+                    "🎉 <b>Вас разбанили!</b>\n\n"
+                    "Теперь вы снова можете добавлять товары в боте.",
+                    parse_mode="HTML"
+                )
             else:
                 await message.answer("❌ Произошла ошибка при разбане пользователя.")
         elif message.text.upper() == "НЕТ":
@@ -1205,7 +1285,7 @@ async def process_ban_reason(message: types.Message, state: FSMContext):
         if len(reason) < 3:
             await message.answer("❌ Причина бана должна содержать не менее 3 символов. Введите причину:")
             return
-        if ban_user_in_db(user_id, reason, admin_id):
+        if await db.run(ban_user_in_db, user_id, reason, admin_id):
             await state.clear()
             await message.answer(
                 f"✅ <b>Пользователь {user_info} успешно забанен!</b>\n\n"
@@ -1214,28 +1294,19 @@ async def process_ban_reason(message: types.Message, state: FSMContext):
                 parse_mode="HTML",
                 reply_markup=get_admin_keyboard()
             )
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"⛔ <b>Вас заблокировали в боте!</b>\n\n"
-                    f"📝 Причина: {reason}\n\n"
-                    f"Вы больше не можете добавлять товары.\n"
-                    f"Если вы считаете, что это ошибка, свяжитесь с администратором.",
-                    parse_mode="HTML"
-                )
-            except:
-                pass
+            await outbox.send(
+                user_id,
+                f"⛔ <b>Вас заблокировали в боте!</b>\n\n"
+                f"📝 Причина: {reason}\n\n"
+                f"Вы больше не можете добавлять товары.\n"
+                f"Если вы считаете, что это ошибка, свяжитесь с администратором.",
+                parse_mode="HTML"
+            )
         else:
             await message.answer("❌ Произошла ошибка при бане пользователя.")
 
-@dp.message(F.text == "📊 Статистика")
-async def admin_stats(message: types.Message, state: FSMContext):
-    await state.clear()
-    if message.from_user.id not in ADMIN_IDS:
-        await message.answer("⛔ У вас нет доступа.")
-        return
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def load_admin_stats():
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM products")
         total_products = c.fetchone()[0]
@@ -1243,26 +1314,35 @@ async def admin_stats(message: types.Message, state: FSMContext):
         total_users = c.fetchone()[0]
         c.execute("SELECT COUNT(*) FROM users WHERE is_banned = 1")
         banned_users = c.fetchone()[0]
-        c.execute("""
-            SELECT DATE(created_at), COUNT(*) 
-            FROM products 
-            WHERE created_at >= date('now', '-7 days')
-            GROUP BY DATE(created_at)
-            ORDER BY DATE(created_at) DESC
-        """)
-        last_7_days = c.fetchall()
-        conn.close()
+        last_7_days = [(timestamps.format_ts(day, '%d.%m'), count)
+                       for day, count in activity.daily(activity.LISTING_CREATED, 7)]
+        last_24h = activity.last_24h()
+    return total_products, total_users, banned_users, last_7_days, last_24h
+
+@dp.message(F.text == "📊 Статистика")
+async def admin_stats(message: types.Message, state: FSMContext):
+    await state.clear()
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        total_products, total_users, banned_users, last_7_days, last_24h = await db.run(load_admin_stats)
         text = (
             "📊 <b>Статистика бота</b>\n\n"
             f"<b>👥 Пользователи:</b> {total_users}\n"
             f"<b>⛔ Забанено:</b> {banned_users}\n"
             f"<b>🛍️ Товаров всего:</b> {total_products}\n\n"
+            "<b>🕐 За 24 часа:</b>\n"
+            f"• Новых товаров: {last_24h[activity.LISTING_CREATED]}\n"
+            f"• Продано: {last_24h[activity.LISTING_SOLD]}\n"
+            f"• Удалено: {last_24h[activity.LISTING_DELETED]}\n"
+            f"• Отзывов: {last_24h[activity.REVIEW_SUBMITTED]}\n"
+            f"• Новых пользователей: {last_24h[activity.NEW_USER]}\n\n"
         )
         if last_7_days:
             text += "<b>📈 Активность за 7 дней:</b>\n"
-            for day_data in last_7_days:
-                day = datetime.strptime(day_data[0], "%Y-%m-%d").strftime("%d.%m")
-                text += f"• {day}: {day_data[1]} товаров\n"
+            for day, count in last_7_days:
+                text += f"• {day}: {count} товаров\n"
         await message.answer(text, parse_mode="HTML", reply_markup=get_admin_keyboard())
     except Exception as e:
         logger.error(f"❌ Ошибка в admin_stats: {e}")
@@ -1310,16 +1390,12 @@ async def admin_add_to_whitelist_start(message: types.Message, state: FSMContext
         )
     )
 
-@dp.message(AdminActionForm.waiting_for_whitelist_user)
-async def process_add_to_whitelist(message: types.Message, state: FSMContext):
-    if message.text == "❌ Отмена":
-        await state.clear()
-        await message.answer("❌ Добавление отменено.", reply_markup=get_whitelist_keyboard())
-        return
-    search_term = message.text.strip()
-    admin_id = message.from_user.id
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def whitelist_user_by_search(search_term, admin_id):
+    """Находит пользователя и добавляет его в белый список"""
+    user_id = None
+    username = None
+    already_whitelisted = False
+    with db.connection() as conn:
         c = conn.cursor()
         if search_term.isdigit():
             user_id = int(search_term)
@@ -1332,13 +1408,40 @@ async def process_add_to_whitelist(message: types.Message, state: FSMContext):
             if user:
                 user_id = user[0]
                 username = search_term
+        if user_id is not None:
+            c.execute("SELECT is_whitelisted FROM users WHERE user_id = ?", (user_id,))
+            current_status = c.fetchone()
+            already_whitelisted = bool(current_status and current_status[0] == 1)
+        if user_id is not None and not already_whitelisted:
+            profiles.invalidate(user_id)
+            if not username:
+                c.execute("INSERT INTO users (user_id, is_whitelisted) VALUES (?, 1)", (user_id,))
             else:
-                await message.answer("❌ Пользователь не найден в базе.")
-                await state.clear()
-                return
-        c.execute("SELECT is_whitelisted FROM users WHERE user_id = ?", (user_id,))
-        current_status = c.fetchone()
-        if current_status and current_status[0] == 1:
+                c.execute("UPDATE users SET is_whitelisted = 1 WHERE user_id = ?", (user_id,))
+            c.execute(
+                """INSERT INTO admin_actions 
+                   (admin_id, action_type, target_id, target_type, details) 
+                   VALUES (?, ?, ?, ?, ?)""",
+                (admin_id, "add_to_whitelist", user_id, "user",
+                 f"Добавлен в белый список. Username: {username or 'неизвестен'}")
+            )
+    return user_id, username, already_whitelisted
+
+@dp.message(AdminActionForm.waiting_for_whitelist_user)
+async def process_add_to_whitelist(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("❌ Добавление отменено.", reply_markup=get_whitelist_keyboard())
+        return
+    search_term = message.text.strip()
+    admin_id = message.from_user.id
+    try:
+        user_id, username, already_whitelisted = await db.run(whitelist_user_by_search, search_term, admin_id)
+        if user_id is None:
+            await message.answer("❌ Пользователь не найден в базе.")
+            await state.clear()
+            return
+        if already_whitelisted:
             user_info = f"@{username}" if username else f"ID: {user_id}"
             await message.answer(
                 f"ℹ️ Пользователь {user_info} уже в белом списке.",
@@ -1346,19 +1449,6 @@ async def process_add_to_whitelist(message: types.Message, state: FSMContext):
             )
             await state.clear()
             return
-        if not username:
-            c.execute("INSERT INTO users (user_id, is_whitelisted) VALUES (?, 1)", (user_id,))
-        else:
-            c.execute("UPDATE users SET is_whitelisted = 1 WHERE user_id = ?", (user_id,))
-        c.execute(
-            """INSERT INTO admin_actions 
-               (admin_id, action_type, target_id, target_type, details) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (admin_id, "add_to_whitelist", user_id, "user",
-             f"Добавлен в белый список. Username: {username or 'неизвестен'}")
-        )
-        conn.commit()
-        conn.close()
         await state.clear()
         user_info = f"@{username}" if username else f"ID: {user_id}"
         await message.answer(
@@ -1366,17 +1456,14 @@ async def process_add_to_whitelist(message: types.Message, state: FSMContext):
             f"Теперь он может добавлять неограниченное количество товаров.",
             reply_markup=get_whitelist_keyboard()
         )
-        try:
-            await bot.send_message(
-                user_id,
-                "🎉 **Вас добавили в белый список!**\n\n"
-                "Теперь вы можете добавлять неограниченное количество товаров "
-                "без каких-либо лимитов.\n\n"
-                "Спасибо за вашу активность! 🚀",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
+        await outbox.send(
+            user_id,
+            "🎉 **Вас добавили в белый список!**\n\n"
+            "Теперь вы можете добавлять неограниченное количество товаров "
+            "без каких-либо лимитов.\n\n"
+            "Спасибо за вашу активность! 🚀",
+            parse_mode="Markdown"
+        )
     except Exception as e:
         logger.error(f"❌ Ошибка в process_add_to_whitelist: {e}")
         await message.answer("❌ Произошла ошибка при добавлении в белый список.")
@@ -1402,6 +1489,27 @@ async def admin_remove_from_whitelist_start(message: types.Message, state: FSMCo
         )
     )
 
+def unwhitelist_user_by_search(search_term, admin_id):
+    """Находит пользователя и убирает его из белого списка"""
+    with db.connection() as conn:
+        c = conn.cursor()
+        if search_term.isdigit():
+            c.execute("SELECT user_id, username, is_whitelisted FROM users WHERE user_id = ?", (int(search_term),))
+        else:
+            c.execute("SELECT user_id, username, is_whitelisted FROM users WHERE username = ?", (search_term,))
+        result = c.fetchone()
+        if result and result[2]:
+            c.execute("UPDATE users SET is_whitelisted = 0 WHERE user_id = ?", (result[0],))
+            profiles.invalidate(result[0])
+            c.execute(
+                """INSERT INTO admin_actions 
+                   (admin_id, action_type, target_id, target_type, details) 
+                   VALUES (?, ?, ?, ?, ?)""",
+                (admin_id, "remove_from_whitelist", result[0], "user",
+                 f"Удален из белого списка. Username: {result[1] or 'неизвестен'}")
+            )
+    return result
+
 @dp.message(AdminActionForm.waiting_for_unwhitelist_user)
 async def process_remove_from_whitelist(message: types.Message, state: FSMContext):
     if message.text == "❌ Отмена":
@@ -1411,25 +1519,12 @@ async def process_remove_from_whitelist(message: types.Message, state: FSMContex
     search_term = message.text.strip()
     admin_id = message.from_user.id
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        if search_term.isdigit():
-            user_id = int(search_term)
-            c.execute("SELECT username, is_whitelisted FROM users WHERE user_id = ?", (user_id,))
-            result = c.fetchone()
-            username = result[0] if result else None
-        else:
-            c.execute("SELECT user_id, username, is_whitelisted FROM users WHERE username = ?", (search_term,))
-            result = c.fetchone()
+        result = await db.run(unwhitelist_user_by_search, search_term, admin_id)
         if not result:
             await message.answer("❌ Пользователь не найден в базе.")
             await state.clear()
             return
-        if len(result) == 3:
-            user_id, username, is_whitelisted = result
-        else:
-            user_id, is_whitelisted = result[0], result[1]
-            username = search_term if not search_term.isdigit() else None
+        user_id, username, is_whitelisted = result
         if not is_whitelisted:
             user_info = f"@{username}" if username else f"ID: {user_id}"
             await message.answer(
@@ -1438,16 +1533,6 @@ async def process_remove_from_whitelist(message: types.Message, state: FSMContex
             )
             await state.clear()
             return
-        c.execute("UPDATE users SET is_whitelisted = 0 WHERE user_id = ?", (user_id,))
-        c.execute(
-            """INSERT INTO admin_actions 
-               (admin_id, action_type, target_id, target_type, details) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (admin_id, "remove_from_whitelist", user_id, "user",
-             f"Удален из белого списка. Username: {username or 'неизвестен'}")
-        )
-        conn.commit()
-        conn.close()
         await state.clear()
         user_info = f"@{username}" if username else f"ID: {user_id}"
         await message.answer(
@@ -1455,17 +1540,14 @@ async def process_remove_from_whitelist(message: types.Message, state: FSMContex
             f"Теперь на него будут распространяться обычные лимиты ({DAILY_LIMIT} товаров/сутки).",
             reply_markup=get_whitelist_keyboard()
         )
-        try:
-            await bot.send_message(
-                user_id,
-                f"⚠️ **Вас удалили из белого списка**\n\n"
-                f"Теперь на вас распространяются обычные лимиты:\n"
-                f"• {DAILY_LIMIT} товаров в сутки\n\n"
-                f"Если вы считаете, что это ошибка, свяжитесь с администратором.",
-                parse_mode="Markdown"
-            )
-        except:
-            pass
+        await outbox.send(
+            user_id,
+            f"⚠️ **Вас удалили из белого списка**\n\n"
+            f"Теперь на вас распространяются обычные лимиты:\n"
+            f"• {DAILY_LIMIT} товаров в сутки\n\n"
+            f"Если вы считаете, что это ошибка, свяжитесь с администратором.",
+            parse_mode="Markdown"
+        )
     except Exception as e:
         logger.error(f"❌ Ошибка в process_remove_from_whitelist: {e}")
         await message.answer("❌ Произошла ошибка при удалении из белого списка.")
@@ -1477,7 +1559,7 @@ async def admin_show_whitelist(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         await message.answer("⛔ У вас нет доступа.")
         return
-    users = get_whitelist()
+    users = await db.run(get_whitelist)
     if not users:
         await message.answer("📭 Белый список пуст.", reply_markup=get_whitelist_keyboard())
         return
@@ -1495,14 +1577,8 @@ async def admin_show_whitelist(message: types.Message, state: FSMContext):
     text += f"\nВсего: **{len(users)}** пользователей"
     await message.answer(text, parse_mode="Markdown", reply_markup=get_whitelist_keyboard())
 
-@dp.message(F.text == "📊 Статистика лимитов")
-async def admin_limits_stats(message: types.Message, state: FSMContext):
-    await state.clear()
-    if message.from_user.id not in ADMIN_IDS:
-        await message.answer("⛔ У вас нет доступа.")
-        return
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def build_limits_stats_text():
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM users")
         total_users = c.fetchone()[0]
@@ -1510,28 +1586,19 @@ async def admin_limits_stats(message: types.Message, state: FSMContext):
         whitelisted = c.fetchone()[0]
         c.execute("SELECT COUNT(*) FROM users WHERE is_banned = 1")
         banned = c.fetchone()[0]
-        time_24h_ago = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-        c.execute("""
-            SELECT u.user_id, u.username, COUNT(p.id) as product_count
-            FROM users u
-            LEFT JOIN products p ON u.user_id = p.seller_id AND p.created_at >= ?
-            WHERE u.is_whitelisted = 0 AND u.is_banned = 0
-            GROUP BY u.user_id
-            HAVING product_count >= ?
-            ORDER BY product_count DESC
-        """, (time_24h_ago, DAILY_LIMIT))
-        users_at_limit = c.fetchall()
-        c.execute("""
-            SELECT u.user_id, u.username, COUNT(p.id) as product_count
-            FROM users u
-            LEFT JOIN products p ON u.user_id = p.seller_id AND p.created_at >= ?
-            WHERE u.is_banned = 0
-            GROUP BY u.user_id
-            ORDER BY product_count DESC
-            LIMIT 10
-        """, (time_24h_ago,))
-        top_active = c.fetchall()
-        conn.close()
+        # Обе выборки идут по счётчикам за 24 часа и затрагивают только
+        # продавцов, которые что-то добавляли
+        users_at_limit, top_active = [], []
+        for seller_id, count in activity.leaderboard():
+            if len(top_active) >= 10 and count < DAILY_LIMIT:
+                break
+            profile = profiles.get(seller_id)
+            if profile is None or profile.is_banned:
+                continue
+            if len(top_active) < 10:
+                top_active.append((seller_id, profile.username, profile.is_whitelisted, count))
+            if not profile.is_whitelisted and count >= DAILY_LIMIT:
+                users_at_limit.append((seller_id, profile.username, count))
         text = (
             f"📊 **Статистика лимитов**\n\n"
             f"👥 Всего пользователей: {total_users}\n"
@@ -1552,10 +1619,20 @@ async def admin_limits_stats(message: types.Message, state: FSMContext):
         if top_active:
             text += "**🏆 Самые активные (за 24ч):**\n"
             for i, user in enumerate(top_active, 1):
-                user_id, username, count = user
+                user_id, username, is_whitelisted, count = user
                 user_ident = f"@{username}" if username else f"ID: {user_id}"
-                status = "⚪" if is_user_whitelisted(user_id) else "🔵"
+                status = "⚪" if is_whitelisted else "🔵"
                 text += f"{i}. {status} {user_ident}: {count} товаров\n"
+    return text
+
+@dp.message(F.text == "📊 Статистика лимитов")
+async def admin_limits_stats(message: types.Message, state: FSMContext):
+    await state.clear()
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        text = await db.run(build_limits_stats_text)
         await message.answer(text, parse_mode="Markdown", reply_markup=get_whitelist_keyboard())
     except Exception as e:
         logger.error(f"❌ Ошибка в admin_limits_stats: {e}")
@@ -1573,9 +1650,8 @@ async def back_to_admin(message: types.Message, state: FSMContext):
 @dp.message(F.text == "🛍️ Покупатель")
 async def buyer_mode(message: types.Message, state: FSMContext):
     await state.clear()
-    user_product_positions[message.from_user.id] = 0
     await message.answer("🛍️ Режим покупателя", reply_markup=get_buyer_keyboard())
-    product = await get_first_product()
+    product = await get_first_product(message.from_user.id)
     if product:
         await show_product_with_review_button(message, product)
     else:
@@ -1591,33 +1667,8 @@ async def next_product(message: types.Message, state: FSMContext):
         await message.answer("😔 Товаров больше нет")
 
 async def show_product_with_review_button(message: types.Message, product):
-    product_id = product[0]
-    seller_id = product[1]
-    title = product[2]
-    description = product[3]
-    price = product[4]
-    contact = product[5]
-    expires_at = product[7]
-    if expires_at:
-        expires_clean = expires_at.split('.')[0]
-        expires_dt = datetime.strptime(expires_clean, '%Y-%m-%d %H:%M:%S')
-        expires_str = expires_dt.strftime('%d.%m.%Y %H:%M')
-    else:
-        expires_str = 'не указано'
-    text = (
-        f"🛒 Товар #{product_id}\n\n"
-        f"📌 Название: {title}\n"
-        f"📝 Описание: {description}\n"
-        f"💰 Цена: {price}\n"
-        f"👤 Контакты: @{contact}\n"
-        f"⏳ Истекает: {expires_str}"
-    )
-    builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Купить", callback_data=f"buy_{product_id}")
-    builder.button(text="⭐ Отзывы о продавце", callback_data=f"reviews:{seller_id}:{product_id}")
-    builder.button(text="🏠 Главное меню", callback_data="back_to_main")
-    builder.adjust(2)
-    await message.answer(text, reply_markup=builder.as_markup())
+    text, reply_markup = cards.product_card(product)
+    await message.answer(text, reply_markup=reply_markup)
 
 @dp.callback_query(F.data == "back_to_main")
 async def back_to_main_callback(callback: types.CallbackQuery, state: FSMContext):
@@ -1626,21 +1677,34 @@ async def back_to_main_callback(callback: types.CallbackQuery, state: FSMContext
     await cmd_start(callback.message, state)
 
 # ================== ОТЗЫВЫ ==================
+def get_username(user_id):
+    profile = profiles.get(user_id)
+    return profile.username if profile else None
+
+def load_seller_summary(seller_id):
+    avg_rating, total = get_seller_rating(seller_id)
+    _, _, stars = get_seller_stats(seller_id)
+    return avg_rating, total, stars, get_username(seller_id)
+
+def load_reviews_page_data(seller_id, cursor):
+    reviews = get_seller_reviews(seller_id, cursor)
+    avg, total = get_seller_rating(seller_id)
+    return reviews, total, avg, get_username(seller_id)
+
 @dp.callback_query(F.data.startswith("reviews:"))
 async def show_seller_reviews(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     _, seller_id, product_id = callback.data.split(":")
     seller_id = int(seller_id)
-    avg_rating, total = get_seller_rating(seller_id)
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("SELECT username FROM users WHERE user_id = ?", (seller_id,))
-    res = c.fetchone()
-    seller_username = res[0] if res else str(seller_id)
-    conn.close()
+    avg_rating, total, stars, seller_username = await db.run(load_seller_summary, seller_id)
+    seller_username = seller_username or str(seller_id)
+    distribution = ""
+    if total:
+        distribution = "".join(f"{star}⭐ — {stars[star - 1]}\n" for star in range(5, 0, -1)) + "\n"
     await callback.message.edit_text(
         f"👤 Продавец: @{seller_username}\n"
         f"⭐ Рейтинг: {avg_rating if avg_rating else 'нет'} (на основе {total} отзывов)\n\n"
+        f"{distribution}"
         f"📝 Загружаю отзывы...",
         reply_markup=InlineKeyboardBuilder().button(text="🔄 Загрузить", callback_data=f"rev_load:{seller_id}:0").as_markup()
     )
@@ -1649,36 +1713,37 @@ async def show_seller_reviews(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("rev_load:"))
 async def load_reviews_page(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    _, seller_id, page_str = callback.data.split(":")
+    # rev_load:<продавец>:<страница>[:<курсор>]; без курсора - первая страница
+    _, seller_id, page_str, *cursor = callback.data.split(":")
     seller_id = int(seller_id)
-    page = int(page_str)
-    reviews, total = get_seller_reviews(seller_id, page)
+    page = int(page_str) if cursor else 0
+    cursor = cursor[0] if cursor else None
+    reviews, total, avg, seller_username = await db.run(load_reviews_page_data, seller_id, cursor)
     total_pages = (total + 4) // 5 if total else 1
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("SELECT username FROM users WHERE user_id = ?", (seller_id,))
-    res = c.fetchone()
-    seller_username = res[0] if res else str(seller_id)
-    conn.close()
-    avg, total_rating = get_seller_rating(seller_id)
+    page = min(page, total_pages - 1)
+    seller_username = seller_username or str(seller_id)
     rating_text = f"{avg}/5" if avg else "нет"
-    text = f"👤 Продавец: @{seller_username}\n⭐ Рейтинг: {rating_text} (на основе {total_rating} отзывов)\n\n"
+    text = f"👤 Продавец: @{seller_username}\n⭐ Рейтинг: {rating_text} (на основе {total} отзывов)\n\n"
     text += "📝 **Отзывы:**\n\n"
     if not reviews:
         text += "Пока нет отзывов.\n"
     else:
         for r in reviews:
-            rating, comment, created_at, username = r
-            date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y")
+            _, rating, comment, created_at, username = r
+            date = timestamps.format_date(created_at)
             stars = "⭐" * rating
             text += f"{stars} {rating}/5 — {comment if comment else 'без комментария'}\n"
             text += f"👤 @{username or 'Аноним'} | 📅 {date}\n\n"
     text += f"\nСтраница {page+1} из {total_pages}"
     builder = InlineKeyboardBuilder()
-    if page > 0:
-        builder.button(text="⬅️ Назад", callback_data=f"rev_load:{seller_id}:{page-1}")
-    if page < total_pages - 1:
-        builder.button(text="➡️ Вперёд", callback_data=f"rev_load:{seller_id}:{page+1}")
+    if page > 0 and reviews:
+        first_id, _, _, first_created_at, _ = reviews[0]
+        before = encode_review_cursor("b", first_created_at, first_id)
+        builder.button(text="⬅️ Назад", callback_data=f"rev_load:{seller_id}:{page-1}:{before}")
+    if page < total_pages - 1 and reviews:
+        last_id, _, _, last_created_at, _ = reviews[-1]
+        after = encode_review_cursor("a", last_created_at, last_id)
+        builder.button(text="➡️ Вперёд", callback_data=f"rev_load:{seller_id}:{page+1}:{after}")
     builder.button(text="✍️ Оставить отзыв", callback_data=f"leave_review:{seller_id}")
     builder.button(text="🔙 Назад к товару", callback_data="back_to_product")
     builder.adjust(2)
@@ -1727,24 +1792,21 @@ async def process_review_comment(message: types.Message, state: FSMContext):
     seller_id = data['seller_id']
     rating = data['rating']
     buyer_id = message.from_user.id
-    review_id = add_review(seller_id, buyer_id, None, rating, comment)
+    review_id = await db.run(add_review, seller_id, buyer_id, None, rating, comment)
     if review_id:
         await message.answer(
             "✅ Ваш отзыв отправлен на модерацию. После проверки он появится в профиле продавца.",
             reply_markup=get_main_menu_keyboard()
         )
         for admin_id in ADMIN_IDS:
-            try:
-                await bot.send_message(
-                    admin_id,
-                    f"🆕 Новый отзыв на модерации!\n"
-                    f"От: @{message.from_user.username or message.from_user.first_name}\n"
-                    f"Оценка: {rating}⭐\n"
-                    f"Комментарий: {comment if comment else 'нет'}\n"
-                    f"ID отзыва: {review_id}"
-                )
-            except:
-                pass
+            await outbox.send(
+                admin_id,
+                f"🆕 Новый отзыв на модерации!\n"
+                f"От: @{message.from_user.username or message.from_user.first_name}\n"
+                f"Оценка: {rating}⭐\n"
+                f"Комментарий: {comment if comment else 'нет'}\n"
+                f"ID отзыва: {review_id}"
+            )
     else:
         await message.answer("❌ Ошибка при сохранении отзыва. Попробуйте позже.", reply_markup=get_main_menu_keyboard())
     await state.clear()
@@ -1767,24 +1829,35 @@ async def back_to_product(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # ================== МОДЕРАЦИЯ ОТЗЫВОВ (АДМИНКА) ==================
+# Очередь живёт в базе: каждый админ берёт следующий свободный отзыв в
+# аренду, поэтому несколько модераторов не видят одни и те же отзывы.
+async def show_next_review(target, admin_id, after=None):
+    review_id = await db.run(claim_next_review, admin_id, after)
+    if review_id is None and after is not None:
+        # Дошли до конца очереди - начинаем сначала
+        review_id = await db.run(claim_next_review, admin_id)
+    if review_id is None:
+        text = "📭 Нет отзывов на модерации."
+        if isinstance(target, types.Message):
+            await target.answer(text)
+        else:
+            await target.message.edit_text(text)
+        return
+    await show_moderation_review(target, review_id)
+
 @dp.message(F.text == "📝 Модерация отзывов")
 async def moderation_start(message: types.Message, state: FSMContext):
     await state.clear()
     if message.from_user.id not in ADMIN_IDS:
         await message.answer("⛔ У вас нет доступа.")
         return
-    review_ids = get_unmoderated_reviews()
-    if not review_ids:
-        await message.answer("📭 Нет отзывов на модерации.")
-        return
-    moderation_index[message.from_user.id] = {
-        'review_ids': review_ids,
-        'current': 0
-    }
-    await show_moderation_review(message, review_ids[0])
+    await show_next_review(message, message.from_user.id)
+
+def load_moderation_review(review_id):
+    return get_review_by_id(review_id), moderation_stats_text()
 
 async def show_moderation_review(target, review_id):
-    review = get_review_by_id(review_id)
+    review, stats = await db.run(load_moderation_review, review_id)
     if not review:
         if isinstance(target, types.Message):
             await target.answer("❌ Отзыв не найден.")
@@ -1792,126 +1865,74 @@ async def show_moderation_review(target, review_id):
             await target.message.edit_text("❌ Отзыв не найден.")
         return
     r_id, rating, comment, created_at, buyer_id, buyer_username, seller_id, seller_username = review
-    date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+    date = timestamps.format_ts(created_at)
     text = (
         f"📝 **Отзыв #{r_id}**\n\n"
         f"👤 **Покупатель:** @{buyer_username or buyer_id}\n"
         f"👤 **Продавец:** @{seller_username or seller_id}\n"
         f"⭐ **Оценка:** {rating}/5\n"
         f"💬 **Комментарий:** {comment if comment else '—'}\n"
-        f"📅 **Дата:** {date}\n"
+        f"📅 **Дата:** {date}\n\n"
+        f"📥 Очередь: {stats}\n"
     )
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Одобрить", callback_data=f"mod_approve:{r_id}")
     builder.button(text="❌ Отклонить", callback_data=f"mod_reject:{r_id}")
     builder.button(text="🔍 Запросить док-ва", callback_data=f"mod_evidence:{r_id}")
-    user_id = target.from_user.id if isinstance(target, types.CallbackQuery) else target.chat.id
-    data = moderation_index.get(user_id)
-    if data:
-        current_idx = data['current']
-        total = len(data['review_ids'])
-        if current_idx > 0:
-            prev_id = data['review_ids'][current_idx-1]
-            builder.button(text="⬅️ Предыдущий", callback_data=f"mod_show:{prev_id}")
-        if current_idx < total - 1:
-            next_id = data['review_ids'][current_idx+1]
-            builder.button(text="➡️ Следующий", callback_data=f"mod_show:{next_id}")
+    builder.button(text="⏭ Пропустить", callback_data=f"mod_skip:{r_id}")
     builder.button(text="🔄 Обновить", callback_data=f"mod_refresh:{r_id}")
-    builder.adjust(2,2,2,1)
+    builder.adjust(2,2,1)
     if isinstance(target, types.Message):
         await target.answer(text, parse_mode="Markdown", reply_markup=builder.as_markup())
     else:
         await target.message.edit_text(text, parse_mode="Markdown", reply_markup=builder.as_markup())
 
-@dp.callback_query(F.data.startswith("mod_show:"))
-async def mod_show_callback(callback: types.CallbackQuery):
+@dp.callback_query(F.data.startswith("mod_skip:"))
+async def mod_skip_callback(callback: types.CallbackQuery):
     review_id = int(callback.data.split(":")[1])
-    user_id = callback.from_user.id
-    data = moderation_index.get(user_id)
-    if data:
-        try:
-            idx = data['review_ids'].index(review_id)
-            data['current'] = idx
-        except ValueError:
-            pass
-    await show_moderation_review(callback, review_id)
+    admin_id = callback.from_user.id
+    review = await db.run(get_review_by_id, review_id)
+    await db.run(release_review, review_id, admin_id)
+    await show_next_review(callback, admin_id, after=(review[3], review[0]) if review else None)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("mod_approve:"))
 async def mod_approve_callback(callback: types.CallbackQuery):
     review_id = int(callback.data.split(":")[1])
     admin_id = callback.from_user.id
-    result = approve_review(review_id, admin_id)
+    result = await db.run(approve_review, review_id, admin_id)
     if result:
         seller_id, rating, comment = result
         await callback.answer("✅ Отзыв одобрен!")
-        try:
-            await bot.send_message(
-                seller_id,
-                f"📢 Вам оставили новый отзыв!\n"
-                f"⭐ Оценка: {rating}/5\n"
-                f"💬 Комментарий: {comment if comment else '—'}"
-            )
-        except:
-            pass
-    else:
-        await callback.answer("❌ Ошибка при одобрении.")
-    user_id = callback.from_user.id
-    data = moderation_index.get(user_id)
-    if data and data['review_ids']:
-        try:
-            idx = data['review_ids'].index(review_id)
-            data['review_ids'].pop(idx)
-            if data['review_ids']:
-                new_idx = min(idx, len(data['review_ids'])-1)
-                data['current'] = new_idx
-                await show_moderation_review(callback, data['review_ids'][new_idx])
-            else:
-                await callback.message.edit_text("✅ Все отзывы обработаны!")
-                moderation_index.pop(user_id, None)
-        except ValueError:
-            pass
+        await outbox.send(
+            seller_id,
+            f"📢 Вам оставили новый отзыв!\n"
+            f"⭐ Оценка: {rating}/5\n"
+            f"💬 Комментарий: {comment if comment else '—'}"
+        )
     else:
-        await callback.message.edit_text("✅ Отзыв одобрен. Больше отзывов нет.")
+        await callback.answer("❌ Отзыв уже обработан или взят другим модератором.", show_alert=True)
+    await show_next_review(callback, admin_id)
 
 @dp.callback_query(F.data.startswith("mod_reject:"))
 async def mod_reject_callback(callback: types.CallbackQuery):
     review_id = int(callback.data.split(":")[1])
     admin_id = callback.from_user.id
-    buyer_id = reject_review(review_id, admin_id)
+    buyer_id = await db.run(reject_review, review_id, admin_id)
     if buyer_id:
         await callback.answer("❌ Отзыв отклонён!")
-        try:
-            await bot.send_message(
-                buyer_id,
-                "❌ Ваш отзыв не прошёл модерацию. Свяжитесь с администратором для уточнения причин."
-            )
-        except:
-            pass
-    else:
-        await callback.answer("❌ Ошибка при отклонении.")
-    user_id = callback.from_user.id
-    data = moderation_index.get(user_id)
-    if data and data['review_ids']:
-        try:
-            idx = data['review_ids'].index(review_id)
-            data['review_ids'].pop(idx)
-            if data['review_ids']:
-                new_idx = min(idx, len(data['review_ids'])-1)
-                data['current'] = new_idx
-                await show_moderation_review(callback, data['review_ids'][new_idx])
-            else:
-                await callback.message.edit_text("✅ Все отзывы обработаны!")
-                moderation_index.pop(user_id, None)
-        except ValueError:
-            pass
+        await outbox.send(
+            buyer_id,
+            "❌ Ваш отзыв не прошёл модерацию. Свяжитесь с администратором для уточнения причин."
+        )
     else:
-        await callback.message.edit_text("✅ Отзыв отклонён. Больше отзывов нет.")
+        await callback.answer("❌ Отзыв уже обработан или взят другим модератором.", show_alert=True)
+    await show_next_review(callback, admin_id)
 
 @dp.callback_query(F.data.startswith("mod_evidence:"))
 async def mod_evidence_callback(callback: types.CallbackQuery, state: FSMContext):
     review_id = int(callback.data.split(":")[1])
-    review = get_review_by_id(review_id)
+    review = await db.run(get_review_by_id, review_id)
     if not review:
         await callback.answer("❌ Отзыв не найден.")
         return
@@ -1931,7 +1952,7 @@ async def process_evidence_request(message: types.Message, state: FSMContext):
     review_id = data['evidence_review_id']
     request_text = message.text
     try:
-        await bot.send_message(
+        await outbox.send(
             buyer_id,
             f"🔍 Администратор запросил подтверждение по вашему отзыву #{review_id}:\n\n{request_text}\n\n"
             f"Пожалуйста, отправьте доказательства (скриншоты) в ответном сообщении."
@@ -1940,26 +1961,42 @@ async def process_evidence_request(message: types.Message, state: FSMContext):
     except Exception as e:
         await message.answer(f"❌ Не удалось отправить сообщение покупателю: {e}")
     await state.clear()
-    await moderation_start(message)
+    await show_next_review(message, message.from_user.id)
 
 @dp.callback_query(F.data == "cancel_evidence")
 async def cancel_evidence(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text("❌ Запрос доказательств отменён.")
     await callback.answer()
-    await moderation_start(callback.message)
+    await show_next_review(callback.message, callback.from_user.id)
 
 @dp.callback_query(F.data.startswith("mod_refresh:"))
 async def mod_refresh_callback(callback: types.CallbackQuery):
-    review_id = int(callback.data.split(":")[1])
-    await show_moderation_review(callback, review_id)
+    # Повторный захват продлевает аренду текущего отзыва
+    await show_next_review(callback, callback.from_user.id)
     await callback.answer()
 
 # ================== ПРОДАВЕЦ ==================
+def check_seller_access(user_id):
+    """Проверяет бан и дневной лимит продавца"""
+    is_banned, ban_reason = check_if_user_banned(user_id)
+    if is_banned:
+        return True, ban_reason, False, None
+    can_add, limit_message = can_user_add_product(user_id)
+    return False, None, can_add, limit_message
+
+def load_seller_status(user_id):
+    is_banned, ban_reason, can_add, limit_message = check_seller_access(user_id)
+    count = 0
+    if not is_banned:
+        with db.connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM products WHERE seller_id = ?", (user_id,)).fetchone()[0]
+    return is_banned, ban_reason, can_add, limit_message, count
+
 @dp.message(F.text == "💰 Продавец")
 async def seller_mode(message: types.Message, state: FSMContext):
     await state.clear()
-    is_banned, ban_reason = check_if_user_banned(message.from_user.id)
+    is_banned, ban_reason, can_add, limit_message, count = await db.run(load_seller_status, message.from_user.id)
     if is_banned:
         await message.answer(
             f"⛔ **Вы забанены в этом боте!**\n\n"
@@ -1970,12 +2007,6 @@ async def seller_mode(message: types.Message, state: FSMContext):
             reply_markup=get_main_menu_keyboard()
         )
         return
-    can_add, limit_message = can_user_add_product(message.from_user.id)
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM products WHERE seller_id = ?", (message.from_user.id,))
-    count = c.fetchone()[0]
-    conn.close()
     response = f"💰 Режим продавца\n\n📊 Ваших товаров: {count}\n\n"
     if not can_add and "Лимит исчерпан" in limit_message:
         response += f"⚠️ {limit_message}\n\n"
@@ -1985,7 +2016,7 @@ async def seller_mode(message: types.Message, state: FSMContext):
 @dp.message(F.text == "➕ Добавить товар")
 async def add_product_start(message: types.Message, state: FSMContext):
     await state.clear()
-    is_banned, ban_reason = check_if_user_banned(message.from_user.id)
+    is_banned, ban_reason, can_add, limit_message = await db.run(check_seller_access, message.from_user.id)
     if is_banned:
         await message.answer(
             f"⛔ **Вы забанены и не можете добавлять товары!**\n\n"
@@ -1995,7 +2026,6 @@ async def add_product_start(message: types.Message, state: FSMContext):
             reply_markup=get_seller_keyboard()
         )
         return
-    can_add, limit_message = can_user_add_product(message.from_user.id)
     if not can_add:
         await message.answer(
             limit_message,
@@ -2038,24 +2068,35 @@ async def process_price(message: types.Message, state: FSMContext):
     await state.set_state(ProductForm.contact)
     await message.answer("👤 Введите ваш username для связи (без @):")
 
-@dp.message(ProductForm.contact)
-async def process_contact(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def create_product(seller_id, title, description, price, contact):
+    """Сохраняет новый товар и возвращает его id и срок истечения"""
+    now = timestamps.now()
+    expires_at = now + 3 * timestamps.DAY
+    with db.connection() as conn:
         c = conn.cursor()
-        expires_at = datetime.now() + timedelta(days=3)
         c.execute(
             """INSERT INTO products 
                (seller_id, title, description, price, contact, created_at, expires_at, last_checked_at) 
                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (message.from_user.id, data['title'], data['description'], 
-             data['price'], message.text, datetime.now(), expires_at, datetime.now())
+            (seller_id, title, description, 
+             price, contact, now, expires_at, now)
         )
-        conn.commit()
-        conn.close()
+        product_id = c.lastrowid
+        activity.record(activity.LISTING_CREATED, seller_id, now)
+        quota.engine.record(seller_id, now)
+    return product_id, expires_at
 
-        can_add, limit_message = can_user_add_product(message.from_user.id)
+@dp.message(ProductForm.contact)
+async def process_contact(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    try:
+        product_id, expires_at = await db.run(
+            create_product, message.from_user.id, data['title'], data['description'], data['price'], message.text
+        )
+        # Остаток лимита - уже после коммита, когда товар попал в окно квоты
+        can_add, limit_message = await db.run(can_user_add_product, message.from_user.id)
+        await feed.refresh(product_id)
+        expiry_scheduler.schedule(product_id, expires_at)
 
         await message.answer(
             f"✅ Товар добавлен!\n\n"
@@ -2063,7 +2104,7 @@ async def process_contact(message: types.Message, state: FSMContext):
             f"📝 Описание: {data['description']}\n"
             f"💰 Цена: {data['price']}\n"
             f"👤 Контакты: @{message.text}\n"
-            f"⏳ Истекает: {expires_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"⏳ Истекает: {timestamps.format_ts(expires_at)}\n\n"
             f"{limit_message}",
             reply_markup=get_seller_keyboard()
         )
@@ -2075,14 +2116,10 @@ async def process_contact(message: types.Message, state: FSMContext):
 @dp.message(F.text == "📋 Мои товары")
 async def show_my_products(message: types.Message, state: FSMContext):
     await state.clear()
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute(
+    products = await db.fetchall(
         """SELECT id, title, price, contact, expires_at FROM products WHERE seller_id = ? ORDER BY id DESC""",
         (message.from_user.id,)
     )
-    products = c.fetchall()
-    conn.close()
     if not products:
         await message.answer(
             "📭 У вас пока нет товаров.\n\nДобавьте первый товар кнопкой '➕ Добавить товар'",
@@ -2091,27 +2128,16 @@ async def show_my_products(message: types.Message, state: FSMContext):
         return
     text = "📋 Ваши товары:\n\n"
     for product in products:
-        pid, title, price, contact, expires_at = product
-        if expires_at:
-            expires_clean = expires_at.split('.')[0]
-            expires_dt = datetime.strptime(expires_clean, '%Y-%m-%d %H:%M:%S')
-            expires_str = expires_dt.strftime('%d.%m.%Y %H:%M')
-        else:
-            expires_str = 'не указано'
-        text += f"#{pid} - {title}\n   💰 {price} | 👤 @{contact}\n   ⏳ Истекает: {expires_str}\n\n"
+        text += cards.seller_line(product)
     await message.answer(text, reply_markup=get_seller_keyboard())
 
 @dp.message(F.text == "✏️ Управление товарами")
 async def manage_products(message: types.Message, state: FSMContext):
     await state.clear()
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute(
+    products = await db.fetchall(
         """SELECT id, title, price FROM products WHERE seller_id = ? ORDER BY id DESC""",
         (message.from_user.id,)
     )
-    products = c.fetchall()
-    conn.close()
     if not products:
         await message.answer("📭 У вас пока нет товаров для управления.", reply_markup=get_seller_keyboard())
         return
@@ -2121,20 +2147,29 @@ async def manage_products(message: types.Message, state: FSMContext):
     keyboard = create_products_keyboard(products)
     await message.answer(text, reply_markup=keyboard)
 
+def delete_own_product(product_id, seller_id):
+    """Удаляет товар, если он принадлежит продавцу"""
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT title FROM products WHERE id = ? AND seller_id = ?", (product_id, seller_id))
+        product = c.fetchone()
+        if product:
+            c.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            activity.record(activity.LISTING_DELETED)
+    return product
+
 @dp.callback_query(F.data.startswith("delete_"))
 async def delete_product_callback(callback: types.CallbackQuery):
     product_id = callback.data.split("_")[1]
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
-        c.execute("SELECT title FROM products WHERE id = ? AND seller_id = ?", (product_id, callback.from_user.id))
-        product = c.fetchone()
+        product = await db.run(delete_own_product, product_id, callback.from_user.id)
         if not product:
             await callback.answer("❌ Товар не найден или вы не владелец!")
             return
-        c.execute("DELETE FROM products WHERE id = ?", (product_id,))
-        conn.commit()
-        conn.close()
+        quota.engine.forget(callback.from_user.id)
+        cards.invalidate(product_id)
+        feed.index.discard(int(product_id))
+        expiry_scheduler.cancel(product_id)
         await callback.message.edit_text(
             f"✅ Товар удален!\n\n🗑️ Удален товар: {product[0]}\n\nСписок обновлен:")
         await show_updated_products_list(callback.message, callback.from_user.id)
@@ -2143,11 +2178,7 @@ async def delete_product_callback(callback: types.CallbackQuery):
     await callback.answer()
 
 async def show_updated_products_list(message: types.Message, user_id: int):
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("""SELECT id, title, price FROM products WHERE seller_id = ? ORDER BY id DESC""", (user_id,))
-    products = c.fetchall()
-    conn.close()
+    products = await db.fetchall("""SELECT id, title, price FROM products WHERE seller_id = ? ORDER BY id DESC""", (user_id,))
     if not products:
         await message.answer("📭 У вас больше нет товаров.", reply_markup=get_seller_keyboard())
         return
@@ -2161,12 +2192,8 @@ async def show_updated_products_list(message: types.Message, user_id: int):
 async def edit_product_callback(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     product_id = callback.data.split("_")[1]
-    conn = sqlite3.connect('brainrot_shop.db')
-    c = conn.cursor()
-    c.execute("""SELECT title, description, price, contact FROM products WHERE id = ? AND seller_id = ?""",
-              (product_id, callback.from_user.id))
-    product = c.fetchone()
-    conn.close()
+    product = await db.fetchone("""SELECT title, description, price, contact FROM products WHERE id = ? AND seller_id = ?""",
+                                (product_id, callback.from_user.id))
     if not product:
         await callback.answer("❌ Товар не найден или вы не владелец!")
         return
@@ -2220,12 +2247,10 @@ async def process_new_value(message: types.Message, state: FSMContext):
     field = data['edit_field']
     new_value = message.text
     try:
-        conn = sqlite3.connect('brainrot_shop.db')
-        c = conn.cursor()
         field_column = {"title": "title", "description": "description", "price": "price", "contact": "contact"}[field]
-        c.execute(f"UPDATE products SET {field_column} = ? WHERE id = ?", (new_value, product_id))
-        conn.commit()
-        conn.close()
+        await db.execute(f"UPDATE products SET {field_column} = ? WHERE id = ?", (new_value, product_id))
+        cards.invalidate(product_id)
+        await feed.refresh(product_id)
         await message.answer(f"✅ {field.capitalize()} успешно обновлено!\n\nНовое значение: {new_value}",
                              reply_markup=get_seller_keyboard())
     except Exception as e:
@@ -2239,123 +2264,227 @@ async def back_to_seller_callback(callback: types.CallbackQuery, state: FSMConte
     await seller_mode(callback.message, state)
 
 # ================== ФОНОВАЯ ЗАДАЧА: УВЕДОМЛЕНИЯ ОБ ИСТЕЧЕНИИ ==================
-async def check_expiring_products():
-    while True:
+def queue_expiry_notice(seller_id, products):
+    """Ставит уведомление в очередь; вызывается в транзакции записи в журнал уведомлений"""
+    if len(products) >= digests.MIN_ITEMS:
+        digests.queue(seller_id, digests.EXPIRY, products)
+        logger.info(f"✅ Сводка об истечении {len(products)} товаров поставлена в очередь для продавца {seller_id}")
+        return
+    product_id, title, expires_at = products[0]
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⏳ Продлить на 3 дня", callback_data=f"extend_{product_id}")
+    expires_str = timestamps.format_ts(expires_at)
+    outbox.enqueue(
+        seller_id,
+        f"⚠️ <b>Ваш товар скоро истечёт!</b>\n\n"
+        f"📌 Название: {title}\n"
+        f"⏳ Истекает: {expires_str}\n\n"
+        f"Нажмите кнопку ниже, чтобы продлить товар ещё на 3 дня.",
+        parse_mode="HTML",
+        reply_markup=kb.as_markup()
+    )
+    logger.info(f"✅ Уведомление об истечении поставлено в очередь для продавца {seller_id}, товар {product_id}")
+
+# Уведомление приходит один раз за 6 часов до каждого срока истечения;
+# товары продавца, истекающие в следующие 6 часов, попадают в ту же сводку
+expiry_scheduler = scheduler.ExpiryScheduler(
+    queue_expiry_notice, lead=6 * timestamps.HOUR, horizon=6 * timestamps.HOUR
+)
+
+# ================== ФОНОВАЯ ЗАДАЧА: ПРОВЕРКА АКТУАЛЬНОСТИ ==================
+RELEVANCE_BATCH = 200
+# Итоги последнего прохода для /health
+relevance_stats = {}
+
+def load_relevance_page(after, checked_before, now, limit=RELEVANCE_BATCH):
+    """Следующие `limit` товаров на проверку после ключа after = (seller_id, id)"""
+    with db.connection() as conn:
+        return conn.execute("""
+            SELECT id, seller_id, title, expires_at 
+            FROM products 
+            WHERE (seller_id, id) > (?, ?) AND last_checked_at < ? AND expires_at > ?
+            ORDER BY seller_id, id LIMIT ?
+        """, (*after, checked_before, now, limit)).fetchall()
+
+def queue_relevance_batch(products):
+    """Ставит в очередь запросы продавцам и возвращает число сообщений.
+
+    Несколько товаров одного продавца уходят одной сводкой. Сообщения
+    и отметки о проверке фиксируются одной транзакцией на пачку.
+    """
+    now = timestamps.now()
+    by_seller = {}
+    for product_id, seller_id, title, expires_at in products:
+        by_seller.setdefault(seller_id, []).append((product_id, title, expires_at))
+    with db.connection() as conn:
+        for seller_id, items in by_seller.items():
+            if len(items) >= digests.MIN_ITEMS:
+                digests.queue(seller_id, digests.RELEVANCE, items)
+                continue
+            for product_id, title, _ in items:
+                kb = InlineKeyboardBuilder()
+                kb.button(text="✅ Продан, удалить", callback_data=f"sold_{product_id}")
+                kb.button(text="❌ Ещё продаётся", callback_data=f"still_selling_{product_id}")
+                kb.adjust(1)
+                outbox.enqueue(
+                    seller_id,
+                    f"❓ <b>Проверка актуальности товара</b>\n\n"
+                    f"📌 Название: {title}\n\n"
+                    f"Товар всё ещё продаётся?",
+                    parse_mode="HTML",
+                    reply_markup=kb.as_markup()
+                )
+        conn.executemany("UPDATE products SET last_checked_at = ? WHERE id = ?",
+                         [(now, product[0]) for product in products])
+    return sum(1 if len(items) >= digests.MIN_ITEMS else len(items) for items in by_seller.values())
+
+async def read_relevance_pages(pages):
+    """Страницы не длиннее RELEVANCE_BATCH по ключу (seller_id, id).
+
+    Товары последнего продавца полной страницы переносятся в следующую,
+    чтобы его сводка не разрывалась; делится только продавец, чьи товары
+    не помещаются в одну страницу.
+    """
+    now = timestamps.now()
+    after = (0, 0)
+    carry = []
+    try:
+        while True:
+            limit = RELEVANCE_BATCH - len(carry)
+            rows = await db.run(load_relevance_page, after, now - 3 * timestamps.DAY, now, limit)
+            page, carry = carry + rows, []
+            if not page:
+                break
+            if rows:
+                after = (rows[-1][1], rows[-1][0])
+            if len(rows) == limit and page[0][1] != page[-1][1]:
+                split = len(page)
+                while page[split - 1][1] == page[-1][1]:
+                    split -= 1
+                page, carry = page[:split], page[split:]
+            await pages.put(page)
+    finally:
+        await pages.put(None)
+
+async def relevance_sweep():
+    """Один проход: чтение страницами по (seller_id, id) и запись пачками, пока читается следующая"""
+    started = time.monotonic()
+    pages = asyncio.Queue(maxsize=2)
+    reader = asyncio.create_task(read_relevance_pages(pages))
+    queued = messages = failed = 0
+    while (page := await pages.get()) is not None:
         try:
-            conn = sqlite3.connect('brainrot_shop.db')
-            c = conn.cursor()
-            time_6h_later = datetime.now() + timedelta(hours=6)
-            c.execute("""
-                SELECT id, seller_id, title, expires_at 
-                FROM products 
-                WHERE expires_at BETWEEN ? AND ?
-            """, (datetime.now(), time_6h_later))
-            expiring_products = c.fetchall()
-            conn.close()
-            for product in expiring_products:
-                product_id, seller_id, title, expires_at = product
-                try:
-                    kb = InlineKeyboardBuilder()
-                    kb.button(text="⏳ Продлить на 3 дня", callback_data=f"extend_{product_id}")
-                    expires_clean = expires_at.split('.')[0]
-                    expires_dt = datetime.strptime(expires_clean, '%Y-%m-%d %H:%M:%S')
-                    expires_str = expires_dt.strftime('%d.%m.%Y %H:%M')
-                    await bot.send_message(
-                        seller_id,
-                        f"⚠️ <b>Ваш товар скоро истечёт!</b>\n\n"
-                        f"📌 Название: {title}\n"
-                        f"⏳ Истекает: {expires_str}\n\n"
-                        f"Нажмите кнопку ниже, чтобы продлить товар ещё на 3 дня.",
-                        parse_mode="HTML",
-                        reply_markup=kb.as_markup()
-                    )
-                    logger.info(f"✅ Уведомление об истечении отправлено продавцу {seller_id} для товара {product_id}")
-                except Exception as e:
-                    logger.error(f"❌ Не удалось отправить уведомление продавцу {seller_id}: {e}")
-            await asyncio.sleep(3600)
+            messages += await db.run(queue_relevance_batch, page)
+            queued += len(page)
         except Exception as e:
-            logger.error(f"❌ Ошибка в фоновой задаче проверки истечения: {e}")
-            await asyncio.sleep(3600)
+            failed += len(page)
+            logger.error(f"❌ Ошибка при постановке запросов актуальности (товары #{page[0][0]}-#{page[-1][0]}): {e}")
+    await reader
+    duration = time.monotonic() - started
+    relevance_stats.update(
+        finished_at=timestamps.now(), queued=queued, messages=messages, failed=failed,
+        duration=duration, rate=queued / duration if duration > 0 else 0.0
+    )
+    logger.info(f"✅ Проверка актуальности: {queued} товаров в {messages} сообщениях за {duration:.2f} с "
+                f"({relevance_stats['rate']:.0f}/с), ошибок: {failed}")
+
+def relevance_stats_text():
+    if not relevance_stats:
+        return "ещё не запускалась"
+    return (f"{timestamps.format_ts(relevance_stats['finished_at'], '%H:%M')}, "
+            f"{relevance_stats['queued']} товаров в {relevance_stats['messages']} сообщениях "
+            f"за {relevance_stats['duration']:.2f} с "
+            f"({relevance_stats['rate']:.0f}/с), ошибок {relevance_stats['failed']}")
 
-# ================== ФОНОВАЯ ЗАДАЧА: ПРОВЕРКА АКТУАЛЬНОСТИ ==================
 async def check_product_relevance():
     while True:
         try:
-            conn = sqlite3.connect('brainrot_shop.db')
-            c = conn.cursor()
-            three_days_ago = datetime.now() - timedelta(days=3)
-            c.execute("""
-                SELECT id, seller_id, title 
-                FROM products 
-                WHERE last_checked_at < ? AND expires_at > ?
-            """, (three_days_ago, datetime.now()))
-            products_to_check = c.fetchall()
-            conn.close()
-            for product_id, seller_id, title in products_to_check:
-                try:
-                    kb = InlineKeyboardBuilder()
-                    kb.button(text="✅ Продан, удалить", callback_data=f"sold_{product_id}")
-                    kb.button(text="❌ Ещё продаётся", callback_data=f"still_selling_{product_id}")
-                    kb.adjust(1)
-                    await bot.send_message(
-                        seller_id,
-                        f"❓ <b>Проверка актуальности товара</b>\n\n"
-                        f"📌 Название: {title}\n\n"
-                        f"Товар всё ещё продаётся?",
-                        parse_mode="HTML",
-                        reply_markup=kb.as_markup()
-                    )
-                    logger.info(f"✅ Запрос актуальности отправлен продавцу {seller_id} для товара {product_id}")
-                    conn2 = sqlite3.connect('brainrot_shop.db')
-                    c2 = conn2.cursor()
-                    c2.execute("UPDATE products SET last_checked_at = ? WHERE id = ?", 
-                             (datetime.now(), product_id))
-                    conn2.commit()
-                    conn2.close()
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при отправке запроса актуальности для товара {product_id}: {e}")
+            await relevance_sweep()
             await asyncio.sleep(6 * 3600)
         except Exception as e:
             logger.error(f"❌ Ошибка в фоновой задаче проверки актуальности: {e}")
             await asyncio.sleep(3600)
 
+
+# ================== ФОНОВАЯ ЗАДАЧА: СВЕРКА ИНДЕКСА ЛЕНТЫ ==================
+async def check_feed_index():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            for product_id in await feed.verify():
+                cards.invalidate(product_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при сверке индекса ленты: {e}")
+
+# ================== ФОНОВАЯ ЗАДАЧА: АРХИВАЦИЯ ИСТЁКШИХ ТОВАРОВ ==================
+async def archive_expired_products():
+    started = time.monotonic()
+    now = timestamps.now()
+    moved = 0
+    while True:
+        ids = await db.run(archive.archive_batch, now - archive.GRACE)
+        for product_id in ids:
+            cards.invalidate(product_id)
+            feed.index.discard(product_id)
+            expiry_scheduler.cancel(product_id)
+        moved += len(ids)
+        if len(ids) < archive.BATCH_SIZE:
+            break
+    pruned = await db.run(archive.prune, now) + await db.run(activity.prune, now)
+    reclaimed = await db.run(archive.vacuum)
+    logger.info(f"🗄 Архивация: перенесено товаров {moved}, удалено служебных строк {pruned}, "
+                f"освобождено {reclaimed / 1024:.0f} KB за {time.monotonic() - started:.2f} с")
+
+async def check_archive():
+    while True:
+        try:
+            await archive_expired_products()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при архивации товаров: {e}")
+        await asyncio.sleep(24 * 3600)
+
 # ================== ОБРАБОТЧИКИ ПРОДЛЕНИЯ И ПРОВЕРКИ АКТУАЛЬНОСТИ ==================
-@dp.callback_query(F.data.startswith("extend_"))
-async def extend_product_callback(callback: types.CallbackQuery):
-    product_id = int(callback.data.split("_")[1])
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def extend_product(product_id, user_id):
+    """Продлевает товар на 3 дня, если это разрешено"""
+    error = title = new_expires_at = None
+    now = timestamps.now()
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("SELECT seller_id, title, expires_at, last_extended_at FROM products WHERE id = ?", (product_id,))
         product = c.fetchone()
         if not product:
-            await callback.answer("❌ Товар не найден!", show_alert=True)
-            conn.close()
-            return
-        seller_id, title, expires_at, last_extended_at = product
-        if callback.from_user.id != seller_id:
-            await callback.answer("❌ Вы не можете продлить чужой товар!", show_alert=True)
-            conn.close()
+            error = "❌ Товар не найден!"
+        else:
+            seller_id, title, expires_at, last_extended_at = product
+            if user_id != seller_id:
+                error = "❌ Вы не можете продлить чужой товар!"
+            elif last_extended_at and now - last_extended_at < 3 * timestamps.DAY:
+                remaining = 3 * timestamps.DAY - (now - last_extended_at)
+                hours = remaining // timestamps.HOUR
+                error = f"⏳ Продлить можно будет через {hours} часов"
+        if error is None:
+            new_expires_at = now + 3 * timestamps.DAY
+            c.execute(
+                "UPDATE products SET expires_at = ?, last_extended_at = ? WHERE id = ?",
+                (new_expires_at, now, product_id)
+            )
+    return error, title, new_expires_at
+
+@dp.callback_query(F.data.startswith("extend_"))
+async def extend_product_callback(callback: types.CallbackQuery):
+    product_id = int(callback.data.split("_")[1])
+    try:
+        error, title, new_expires_at = await db.run(extend_product, product_id, callback.from_user.id)
+        if error:
+            await callback.answer(error, show_alert=True)
             return
-        if last_extended_at:
-            last_extended = datetime.strptime(last_extended_at, '%Y-%m-%d %H:%M:%S')
-            if datetime.now() - last_extended < timedelta(days=3):
-                remaining = timedelta(days=3) - (datetime.now() - last_extended)
-                hours = int(remaining.total_seconds() // 3600)
-                await callback.answer(f"⏳ Продлить можно будет через {hours} часов", show_alert=True)
-                conn.close()
-                return
-        new_expires_at = datetime.now() + timedelta(days=3)
-        c.execute(
-            "UPDATE products SET expires_at = ?, last_extended_at = ? WHERE id = ?",
-            (new_expires_at, datetime.now(), product_id)
-        )
-        conn.commit()
-        conn.close()
+        cards.invalidate(product_id)
+        await feed.refresh(product_id)
+        expiry_scheduler.schedule(product_id, new_expires_at)
         await callback.message.edit_text(
             f"✅ <b>Товар успешно продлён!</b>\n\n"
             f"📌 Название: {title}\n"
-            f"⏳ Новая дата истечения: {new_expires_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"⏳ Новая дата истечения: {timestamps.format_ts(new_expires_at)}\n\n"
             f"Следующее продление будет доступно через 3 дня.",
             parse_mode="HTML"
         )
@@ -2364,65 +2493,78 @@ async def extend_product_callback(callback: types.CallbackQuery):
         logger.error(f"❌ Ошибка при продлении товара {product_id}: {e}")
         await callback.answer("❌ Произошла ошибка при продлении", show_alert=True)
 
-@dp.callback_query(F.data.startswith("sold_"))
-async def mark_as_sold(callback: types.CallbackQuery):
-    product_id = int(callback.data.split("_")[1])
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def delete_sold_product(product_id, user_id):
+    error = title = seller_id = None
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("SELECT seller_id, title FROM products WHERE id = ?", (product_id,))
         product = c.fetchone()
         if not product:
-            await callback.answer("❌ Товар не найден!", show_alert=True)
-            conn.close()
-            return
-        seller_id, title = product
-        if callback.from_user.id != seller_id and callback.from_user.id not in ADMIN_IDS:
-            await callback.answer("❌ Только продавец может отметить товар как проданный!", show_alert=True)
-            conn.close()
+            error = "❌ Товар не найден!"
+        else:
+            seller_id, title = product
+            if user_id != seller_id and user_id not in ADMIN_IDS:
+                error = "❌ Только продавец может отметить товар как проданный!"
+            else:
+                c.execute("DELETE FROM products WHERE id = ?", (product_id,))
+                activity.record(activity.LISTING_SOLD)
+    return error, title, seller_id
+
+async def notify_admins_sold(user, title, product_id):
+    for admin_id in ADMIN_IDS:
+        await outbox.send(
+            admin_id,
+            f"📊 Продавец @{user.username or user.id} отметил товар как проданный:\n"
+            f"📌 {title}\n"
+            f"🆔 Товар #{product_id}"
+        )
+
+@dp.callback_query(F.data.startswith("sold_"))
+async def mark_as_sold(callback: types.CallbackQuery):
+    product_id = int(callback.data.split("_")[1])
+    try:
+        error, title, seller_id = await db.run(delete_sold_product, product_id, callback.from_user.id)
+        if error:
+            await callback.answer(error, show_alert=True)
             return
-        c.execute("DELETE FROM products WHERE id = ?", (product_id,))
-        conn.commit()
-        conn.close()
+        quota.engine.forget(seller_id)
+        cards.invalidate(product_id)
+        feed.index.discard(product_id)
+        expiry_scheduler.cancel(product_id)
         await callback.message.edit_text(
             f"✅ Товар <b>{title}</b> отмечен как проданный и удалён из ленты.",
             parse_mode="HTML"
         )
         await callback.answer("✅ Товар удалён", show_alert=False)
-        for admin_id in ADMIN_IDS:
-            try:
-                await bot.send_message(
-                    admin_id,
-                    f"📊 Продавец @{callback.from_user.username or callback.from_user.id} отметил товар как проданный:\n"
-                    f"📌 {title}\n"
-                    f"🆔 Товар #{product_id}"
-                )
-            except:
-                pass
+        await notify_admins_sold(callback.from_user, title, product_id)
     except Exception as e:
         logger.error(f"❌ Ошибка при отметке товара {product_id} как проданного: {e}")
         await callback.answer("❌ Произошла ошибка", show_alert=True)
 
-@dp.callback_query(F.data.startswith("still_selling_"))
-async def mark_as_still_selling(callback: types.CallbackQuery):
-    product_id = int(callback.data.split("_")[2])
-    try:
-        conn = sqlite3.connect('brainrot_shop.db')
+def confirm_product_relevance(product_id, user_id):
+    error = title = None
+    with db.connection() as conn:
         c = conn.cursor()
         c.execute("SELECT seller_id, title FROM products WHERE id = ?", (product_id,))
         product = c.fetchone()
         if not product:
-            await callback.answer("❌ Товар не найден!", show_alert=True)
-            conn.close()
-            return
-        seller_id, title = product
-        if callback.from_user.id != seller_id and callback.from_user.id not in ADMIN_IDS:
-            await callback.answer("❌ Только продавец может подтвердить актуальность!", show_alert=True)
-            conn.close()
+            error = "❌ Товар не найден!"
+        else:
+            seller_id, title = product
+            if user_id != seller_id and user_id not in ADMIN_IDS:
+                error = "❌ Только продавец может подтвердить актуальность!"
+            else:
+                c.execute("UPDATE products SET last_checked_at = ? WHERE id = ?", (timestamps.now(), product_id))
+    return error, title
+
+@dp.callback_query(F.data.startswith("still_selling_"))
+async def mark_as_still_selling(callback: types.CallbackQuery):
+    product_id = int(callback.data.split("_")[2])
+    try:
+        error, title = await db.run(confirm_product_relevance, product_id, callback.from_user.id)
+        if error:
+            await callback.answer(error, show_alert=True)
             return
-        c.execute("UPDATE products SET last_checked_at = ? WHERE id = ?", (datetime.now(), product_id))
-        conn.commit()
-        conn.close()
         await callback.message.edit_text(
             f"✅ Спасибо! Товар <b>{title}</b> остаётся в ленте.\n"
             f"Следующая проверка через 3 дня.",
@@ -2433,11 +2575,136 @@ async def mark_as_still_selling(callback: types.CallbackQuery):
         logger.error(f"❌ Ошибка при подтверждении актуальности товара {product_id}: {e}")
         await callback.answer("❌ Произошла ошибка", show_alert=True)
 
+# ================== СВОДКИ ДЛЯ ПРОДАВЦОВ ==================
+async def show_digest_page(callback: types.CallbackQuery, digest_id, page):
+    result = await db.run(digests.load_page, digest_id, callback.from_user.id, page)
+    if result is None:
+        await callback.answer("❌ Подборка не найдена!", show_alert=True)
+        return False
+    kind, items, total, page = result
+    text, markup = digests.render(digest_id, kind, items, total, page)
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    except TelegramBadRequest:
+        # Страница не изменилась
+        pass
+    return True
+
+def digest_item_action(action, digest_id, product_id, user_id):
+    # Действие с товаром и отметка в сводке - одной транзакцией
+    with db.connection():
+        result = action(product_id, user_id)
+        if result[0] is None:
+            digests.mark_done(digest_id, [product_id])
+    return result
+
+@dp.callback_query(F.data.startswith("dg_page_"))
+async def digest_page(callback: types.CallbackQuery):
+    _, _, digest_id, page = callback.data.split("_")
+    try:
+        if await show_digest_page(callback, int(digest_id), int(page)):
+            await callback.answer()
+    except Exception as e:
+        logger.error(f"❌ Ошибка при показе сводки {digest_id}: {e}")
+        await callback.answer("❌ Произошла ошибка", show_alert=True)
+
+@dp.callback_query(F.data.startswith("dg_ext_"))
+async def digest_extend(callback: types.CallbackQuery):
+    digest_id, product_id, page = map(int, callback.data.split("_")[2:])
+    try:
+        error, title, new_expires_at = await db.run(
+            digest_item_action, extend_product, digest_id, product_id, callback.from_user.id
+        )
+        if error:
+            await callback.answer(error, show_alert=True)
+            return
+        cards.invalidate(product_id)
+        await feed.refresh(product_id)
+        expiry_scheduler.schedule(product_id, new_expires_at)
+        await show_digest_page(callback, digest_id, page)
+        await callback.answer(f"✅ «{title}» продлён на 3 дня", show_alert=False)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при продлении товара {product_id} из сводки: {e}")
+        await callback.answer("❌ Произошла ошибка при продлении", show_alert=True)
+
+@dp.callback_query(F.data.startswith("dg_sold_"))
+async def digest_sold(callback: types.CallbackQuery):
+    digest_id, product_id, page = map(int, callback.data.split("_")[2:])
+    try:
+        error, title, seller_id = await db.run(
+            digest_item_action, delete_sold_product, digest_id, product_id, callback.from_user.id
+        )
+        if error:
+            await callback.answer(error, show_alert=True)
+            return
+        quota.engine.forget(seller_id)
+        cards.invalidate(product_id)
+        feed.index.discard(product_id)
+        expiry_scheduler.cancel(product_id)
+        await show_digest_page(callback, digest_id, page)
+        await callback.answer("✅ Товар удалён", show_alert=False)
+        await notify_admins_sold(callback.from_user, title, product_id)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при отметке товара {product_id} из сводки как проданного: {e}")
+        await callback.answer("❌ Произошла ошибка", show_alert=True)
+
+@dp.callback_query(F.data.startswith("dg_keep_"))
+async def digest_still_selling(callback: types.CallbackQuery):
+    digest_id, product_id, page = map(int, callback.data.split("_")[2:])
+    try:
+        error, title = await db.run(
+            digest_item_action, confirm_product_relevance, digest_id, product_id, callback.from_user.id
+        )
+        if error:
+            await callback.answer(error, show_alert=True)
+            return
+        await show_digest_page(callback, digest_id, page)
+        await callback.answer("✅ Актуальность подтверждена", show_alert=False)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при подтверждении актуальности товара {product_id} из сводки: {e}")
+        await callback.answer("❌ Произошла ошибка", show_alert=True)
+
+@dp.callback_query(F.data.startswith("dg_extall_"))
+async def digest_extend_all(callback: types.CallbackQuery):
+    digest_id = int(callback.data.split("_")[2])
+    try:
+        result = await db.run(digests.extend_all, digest_id, callback.from_user.id)
+        if result is None:
+            await callback.answer("❌ Подборка не найдена!", show_alert=True)
+            return
+        new_expires_at, extended, skipped = result
+        for product_id in extended:
+            cards.invalidate(product_id)
+            await feed.refresh(product_id)
+            expiry_scheduler.schedule(product_id, new_expires_at)
+        await show_digest_page(callback, digest_id, 0)
+        text = f"✅ Продлено товаров: {len(extended)}"
+        if skipped:
+            text += f"\n⏳ {len(skipped)} уже продлевались за последние 3 дня"
+        await callback.answer(text, show_alert=bool(skipped))
+    except Exception as e:
+        logger.error(f"❌ Ошибка при продлении товаров сводки {digest_id}: {e}")
+        await callback.answer("❌ Произошла ошибка при продлении", show_alert=True)
+
+@dp.callback_query(F.data.startswith("dg_keepall_"))
+async def digest_still_selling_all(callback: types.CallbackQuery):
+    digest_id = int(callback.data.split("_")[2])
+    try:
+        confirmed = await db.run(digests.confirm_all, digest_id, callback.from_user.id)
+        if confirmed is None:
+            await callback.answer("❌ Подборка не найдена!", show_alert=True)
+            return
+        await show_digest_page(callback, digest_id, 0)
+        await callback.answer(f"✅ Актуальность подтверждена: {len(confirmed)}", show_alert=False)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при подтверждении актуальности товаров сводки {digest_id}: {e}")
+        await callback.answer("❌ Произошла ошибка", show_alert=True)
+
 # ================== ГЛАВНОЕ МЕНЮ ==================
 @dp.message(F.text == "🏠 Главное меню")
 async def main_menu(message: types.Message, state: FSMContext):
     await state.clear()
-    user_product_positions[message.from_user.id] = 0
+    user_feed_cursors[message.from_user.id] = 0
     await cmd_start(message, state)
 
 # ================== О БОТЕ ==================
@@ -2486,25 +2753,43 @@ async def unknown_command(message: types.Message, state: FSMContext):
         )
 
 # ================== ЗАПУСК БОТА ==================
-async def main():
+def start_background_tasks(primary=True):
+    """primary - процесс, который ведёт общие для всей базы проходы"""
+    asyncio.create_task(storage.run())
+    asyncio.create_task(outbox_sender.run())
+    # Планировщик есть в каждом воркере: двойное уведомление не даст журнал
+    asyncio.create_task(expiry_scheduler.run())
+    asyncio.create_task(check_feed_index())
+    if primary:
+        asyncio.create_task(check_product_relevance())
+        asyncio.create_task(check_archive())
+
+async def main(webhook_mode=False):
     try:
         logger.info("=" * 70)
         logger.info("🚀 Запуск Brainrot Shop Bot v4.4 (финальная версия, всё исправлено)")
         logger.info("=" * 70)
         logger.info(f"📊 Настройки: Лимит {DAILY_LIMIT} товаров/сутки для обычных пользователей")
 
-        init_database()
-        add_missing_columns()
-        update_old_products()   # <--- обновляем expires_at для старых товаров
-
-        asyncio.create_task(check_expiring_products())
-        asyncio.create_task(check_product_relevance())
+        await db.run(migrations.migrate, DAILY_LIMIT)
+        await storage.load()
+        await feed.load()
+        await expiry_scheduler.load()
+        start_background_tasks()
+        await metrics.serve()
 
         bot_info = await bot.get_me()
         logger.info(f"✅ Бот подключен: @{bot_info.username}")
         logger.info(f"👤 Имя бота: {bot_info.first_name}")
         logger.info(f"🆔 ID бота: {bot_info.id}")
 
+        if webhook_mode:
+            logger.info("🔄 Запускаю вебхук...")
+            logger.info("✅ БОТ УСПЕШНО ЗАПУЩЕН!")
+            logger.info("=" * 70)
+            await webhook.WebhookServer(dp, bot).serve()
+            return
+
         await bot.delete_webhook(drop_pending_updates=True)
 
         logger.info("🔄 Запускаю polling...")
@@ -2517,9 +2802,85 @@ async def main():
         logger.info("\n👋 Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"💥 Критическая ошибка: {e}")
+    finally:
+        db.shutdown()
+
+# ================== ЗАПУСК НЕСКОЛЬКИМИ ПРОЦЕССАМИ ==================
+async def worker_main(index, count, updates):
+    global outbox_sender, worker_label
+    worker_label = f"{index + 1} из {count}"
+    try:
+        await invalidation.enable(index)
+        await storage.load(owns=lambda user_id: user_id % count == index)
+        await feed.load()
+        # Продавец - автор своих продлений, поэтому его сроки живут в его воркере
+        await expiry_scheduler.load(owns=lambda seller_id: seller_id % count == index)
+        # Лимит Telegram на отправку общий для бота, делим его между воркерами;
+        # чаты делятся так же, как апдейты, чтобы один чат отправлял один процесс
+        outbox_sender = outbox.OutboxSender(bot, rate=outbox.GLOBAL_RATE / count, shard=(index, count))
+        start_background_tasks(primary=index == 0)
+        asyncio.create_task(invalidation.run())
+        await metrics.serve(metrics.PORT + index if metrics.PORT else 0)
+        logger.info(f"✅ Воркер {worker_label} готов")
+        await workers.consume(dp, bot, updates)
+    except Exception as e:
+        logger.error(f"💥 Критическая ошибка в воркере {worker_label}: {e}")
+    finally:
+        await storage.close()
+        await bot.session.close()
+        db.shutdown()
+
+def run_worker(index, count, updates):
+    """Точка входа процесса-воркера"""
+    # Ctrl+C получает вся группа процессов; воркеры останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker {index} - %(levelname)s - %(message)s',
+        force=True
+    )
+    asyncio.run(worker_main(index, count, updates))
+
+async def supervise(count, webhook_mode=False):
+    supervisor = workers.Supervisor(count, run_worker)
+    try:
+        logger.info("=" * 70)
+        logger.info(f"🚀 Запуск Brainrot Shop Bot v4.4: {count} воркеров")
+        logger.info("=" * 70)
+
+        # Миграции один раз до запуска воркеров
+        await db.run(migrations.migrate, DAILY_LIMIT)
+        supervisor.start()
+        asyncio.create_task(supervisor.watch())
+
+        bot_info = await bot.get_me()
+        logger.info(f"✅ Бот подключен: @{bot_info.username}")
+
+        if webhook_mode:
+            logger.info("🔄 Запускаю вебхук...")
+            await webhook.WebhookServer(dp, bot, forward=supervisor.route).serve()
+        else:
+            logger.info("🔄 Запускаю polling...")
+            await supervisor.poll(bot, dp.resolve_used_update_types())
+    except Exception as e:
+        logger.error(f"💥 Критическая ошибка: {e}")
+    finally:
+        await supervisor.stop()
+        logger.info(f"👋 Воркеры остановлены: {supervisor.stats_text()}")
+        await bot.session.close()
+        db.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Brainrot Shop Bot")
+    parser.add_argument("--webhook", action="store_true",
+                        help="принимать апдейты через вебхук (BRAINROT_WEBHOOK_URL) вместо long polling")
+    parser.add_argument("--workers", type=int, default=workers.WORKERS,
+                        help="число процессов-воркеров; апдейты делятся между ними по user_id")
+    args = parser.parse_args()
+    if args.workers > 1:
+        asyncio.run(supervise(args.workers, webhook_mode=args.webhook))
+    else:
+        asyncio.run(main(webhook_mode=args.webhook))
 
 
 
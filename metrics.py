@@ -0,0 +1,165 @@
+import bisect
+import logging
+import os
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ МЕТРИК ==================
+# Метрики отдаются в текстовом формате Prometheus на локальном порту;
+# в режиме воркеров каждый воркер слушает PORT + свой номер. 0 отключает.
+PORT = int(os.getenv("BRAINROT_METRICS_PORT", "9108"))
+HOST = os.getenv("BRAINROT_METRICS_HOST", "127.0.0.1")
+# Границы корзин в секундах
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Счётчик с одной меткой"""
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+
+    def inc(self, key, amount=1):
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, key):
+        return self._values.get(key, 0)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(key)}"}} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и одной меткой.
+
+    Все наблюдения делаются из потока event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # ключ -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._series = {}
+
+    def observe(self, key, value):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, key):
+        series = self._series.get(key)
+        return sum(series[0]) if series else 0
+
+    def total(self, exclude=()):
+        """(число наблюдений, сумма) по всем ключам, кроме exclude"""
+        series = [value for key, value in self._series.items() if key not in exclude]
+        return sum(sum(counts) for counts, _ in series), sum(total for _, total in series)
+
+    def keys(self):
+        return list(self._series)
+
+    def quantile(self, key, q):
+        """Верхняя граница корзины, в которую попадает квантиль q; None без данных"""
+        series = self._series.get(key)
+        if not series:
+            return None
+        target = q * sum(series[0])
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[0]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            label = f'{self.label}="{_escape(key)}"'
+            seen = 0
+            for bound, count in zip(self.buckets, counts):
+                seen += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {seen}')
+            seen += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {seen}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {seen}")
+        return lines
+
+
+handler_seconds = Histogram("brainrot_handler_seconds", "Время работы обработчика апдейта", "handler")
+handler_errors = Counter("brainrot_handler_errors_total", "Исключения в обработчиках", "handler")
+db_seconds = Histogram("brainrot_db_seconds", "Время вызова db.run с ожиданием потока", "func")
+api_seconds = Histogram("brainrot_api_seconds", "Время запроса к Bot API", "method")
+api_errors = Counter("brainrot_api_errors_total", "Ошибки запросов к Bot API", "method")
+
+REGISTRY = (handler_seconds, handler_errors, db_seconds, api_seconds, api_errors)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# ================== СВОДКА ДЛЯ /health ==================
+def _ms(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return f"более {BUCKETS[-1] * 1000:.0f} мс"
+    return f"≤{seconds * 1000:g} мс"
+
+
+def summary_text(limit=5):
+    lines = []
+    busiest = sorted(handler_seconds.keys(), key=handler_seconds.count, reverse=True)[:limit]
+    for key in busiest:
+        lines.append(f"• {key}: {handler_seconds.count(key)} выз., p95 {_ms(handler_seconds.quantile(key, 0.95))}, "
+                     f"ошибок {handler_errors.get(key)}")
+    # getUpdates - это long polling, его время говорит только о простое
+    for title, histogram, exclude in (("БД", db_seconds, ()), ("Bot API", api_seconds, ("getUpdates",))):
+        count, total = histogram.total(exclude)
+        average = f"{total / count * 1000:.1f} мс" if count else "-"
+        lines.append(f"• {title}: {count} вызовов, в среднем {average}")
+    return "\n".join(lines)
+
+
+# ================== HTTP ==================
+async def _handle(request):
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def serve(port=PORT, host=HOST):
+    """Запускает /metrics; возвращает AppRunner или None, если метрики отключены"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось открыть порт метрик {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,84 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+import db
+import metrics
+import profiles
+
+logger = logging.getLogger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Загружает профиль автора апдейта один раз и передаёт его обработчикам.
+
+    Отсутствующий пользователь создаётся, изменившиеся username и имя
+    обновляются. Профиль попадает в аргумент обработчика `profile`, а
+    profiles.get() для этого пользователя до конца апдейта отвечает
+    из снимка без обращения к базе.
+    """
+
+    def __init__(self, daily_limit):
+        self.daily_limit = daily_limit
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        try:
+            profile = await db.run(
+                profiles.ensure, user.id, user.username, user.first_name, user.last_name, self.daily_limit
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка при загрузке профиля {user.id}: {e}")
+            data["profile"] = None
+            return await handler(event, data)
+        data["profile"] = profile
+        with profiles.request_scope(profile):
+            return await handler(event, data)
+
+
+# ================== МЕТРИКИ ==================
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки каждого обработчика; вешается как inner-middleware,
+    поэтому видит уже выбранный обработчик"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(name)
+            raise
+        finally:
+            metrics.handler_seconds.observe(name, time.perf_counter() - started)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки запросов к Bot API по методам"""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            metrics.api_errors.inc(name)
+            raise
+        finally:
+            metrics.api_seconds.observe(name, time.perf_counter() - started)
@@ -0,0 +1,460 @@
+import logging
+from collections import namedtuple
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== МИГРАЦИИ СХЕМЫ ==================
+# Каждая миграция применяется ровно один раз, её номер записывается в
+# таблицу schema_version. Новые миграции добавляются только в конец списка
+# со следующим номером; уже выпущенные миграции не редактируются.
+Migration = namedtuple("Migration", "version description func transactional")
+
+MIGRATIONS = []
+
+
+def migration(version, description, transactional=True):
+    def decorator(func):
+        MIGRATIONS.append(Migration(version, description, func, transactional))
+        return func
+    return decorator
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+@migration(1, "базовая схема")
+def _baseline(conn, settings):
+    """Таблицы, колонки и данные, которые раньше создавались при каждом старте"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        price TEXT NOT NULL,
+        contact TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned BOOLEAN DEFAULT 0,
+        ban_reason TEXT,
+        is_whitelisted BOOLEAN DEFAULT 0,
+        daily_limit INTEGER DEFAULT {int(settings["daily_limit"])},
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS admin_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        target_id INTEGER,
+        target_type TEXT,
+        reason TEXT,
+        details TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        buyer_id INTEGER NOT NULL,
+        product_id INTEGER,
+        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+        comment TEXT,
+        is_moderated BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (seller_id) REFERENCES users(user_id),
+        FOREIGN KEY (buyer_id) REFERENCES users(user_id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    )''')
+
+    columns = _columns(conn, "products")
+    if 'expires_at' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN expires_at TIMESTAMP")
+    if 'last_extended_at' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN last_extended_at TIMESTAMP")
+    if 'last_checked_at' not in columns:
+        conn.execute("ALTER TABLE products ADD COLUMN last_checked_at TIMESTAMP")
+        conn.execute("UPDATE products SET last_checked_at = CURRENT_TIMESTAMP WHERE last_checked_at IS NULL")
+
+    # Старые товары без срока истечения живут 3 дня с момента создания
+    conn.execute("""
+        UPDATE products
+        SET expires_at = datetime(created_at, '+3 days')
+        WHERE expires_at IS NULL
+    """)
+
+
+@migration(2, "индексы для горячих запросов")
+def _hot_path_indexes(conn, settings):
+    # Лимит продавца: COUNT(*) WHERE seller_id = ? AND created_at >= ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_seller_created ON products(seller_id, created_at)")
+    # Лента покупателя и фоновые задачи: WHERE expires_at > ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_expires ON products(expires_at, id)")
+    # Рейтинг продавца: AVG(rating), COUNT(*) WHERE seller_id = ? AND is_moderated = 1
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reviews_seller_moderated ON reviews(seller_id, is_moderated, rating)")
+    # Поиск пользователя админом: WHERE username = ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+
+
+@migration(3, "журнал WAL", transactional=False)
+def _wal_journal(conn, settings):
+    # Режим журнала нельзя сменить внутри транзакции; WAL сохраняется в файле базы
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if mode.lower() != "wal":
+        logger.warning(f"⚠️ Не удалось включить WAL, текущий режим: {mode}")
+
+
+# Откуда бралось время до миграции 4: Python писал datetime.now() -
+# локальное время, с микросекундами, если они не нулевые; DEFAULT
+# CURRENT_TIMESTAMP и прочие функции SQLite - UTC без дробной части.
+# Для каждой колонки задаётся SQL-условие «текст - локальное время».
+LOCAL = "1"
+UTC = "0"
+
+
+def _dotted(column):
+    # Колонки с обоими источниками; значение Python с нулевыми
+    # микросекундами (одно на миллион) сдвинется на смещение часового пояса
+    return f"{column} LIKE '%.%'"
+
+
+def _epoch(column, local):
+    return f"""CASE
+        WHEN {column} IS NULL THEN NULL
+        WHEN typeof({column}) = 'integer' THEN {column}
+        WHEN {local} THEN CAST(strftime('%s', {column}, 'utc') AS INTEGER)
+        ELSE CAST(strftime('%s', {column}) AS INTEGER)
+    END"""
+
+
+def _rebuild(conn, table, ddl, columns, timestamp_columns, indexes=()):
+    """Пересоздаёт таблицу по новому DDL, переводя колонки времени в epoch.
+
+    timestamp_columns - {колонка: условие локального времени}.
+    """
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    conn.execute(ddl.format(table=f"{table}_new"))
+    select = ", ".join(_epoch(col, timestamp_columns[col]) if col in timestamp_columns else col
+                       for col in columns)
+    conn.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) SELECT {select} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    # Не даём AUTOINCREMENT повторно выдать id уже удалённых записей
+    if seq:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                     (table, max(seq[0], conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0])))
+    for index in indexes:
+        conn.execute(index)
+
+
+@migration(4, "время в целых секундах UTC")
+def _epoch_timestamps(conn, settings):
+    _rebuild(conn, "products", f'''CREATE TABLE {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        price TEXT NOT NULL,
+        contact TEXT NOT NULL,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW},
+        expires_at INTEGER,
+        last_extended_at INTEGER,
+        last_checked_at INTEGER
+    )''',
+        ("id", "seller_id", "title", "description", "price", "contact",
+         "created_at", "expires_at", "last_extended_at", "last_checked_at"),
+        {
+            # datetime.now() при добавлении; у товаров старых версий бота - DEFAULT
+            "created_at": _dotted("created_at"),
+            # datetime.now() + 3 дня или datetime(created_at, '+3 days') из
+            # update_old_products: такой срок без дробной части, но в поясе created_at
+            "expires_at": f"{_dotted('expires_at')} OR {_dotted('created_at')}",
+            "last_extended_at": LOCAL,
+            # datetime.now() или CURRENT_TIMESTAMP при добавлении колонки
+            "last_checked_at": _dotted("last_checked_at"),
+        },
+        ("CREATE INDEX idx_products_seller_created ON products(seller_id, created_at)",
+         "CREATE INDEX idx_products_expires ON products(expires_at, id)"))
+
+    _rebuild(conn, "users", f'''CREATE TABLE {{table}} (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned BOOLEAN DEFAULT 0,
+        ban_reason TEXT,
+        is_whitelisted BOOLEAN DEFAULT 0,
+        daily_limit INTEGER DEFAULT {int(settings["daily_limit"])},
+        registered_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )''',
+        ("user_id", "username", "first_name", "last_name", "is_banned",
+         "ban_reason", "is_whitelisted", "daily_limit", "registered_at"),
+        {"registered_at": UTC},
+        ("CREATE INDEX idx_users_username ON users(username)",))
+
+    _rebuild(conn, "admin_actions", f'''CREATE TABLE {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        target_id INTEGER,
+        target_type TEXT,
+        reason TEXT,
+        details TEXT,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )''',
+        ("id", "admin_id", "action_type", "target_id", "target_type", "reason", "details", "created_at"),
+        {"created_at": UTC})
+
+    _rebuild(conn, "reviews", f'''CREATE TABLE {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        buyer_id INTEGER NOT NULL,
+        product_id INTEGER,
+        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+        comment TEXT,
+        is_moderated BOOLEAN DEFAULT 0,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW},
+        FOREIGN KEY (seller_id) REFERENCES users(user_id),
+        FOREIGN KEY (buyer_id) REFERENCES users(user_id),
+        FOREIGN KEY (product_id) REFERENCES products(id)
+    )''',
+        ("id", "seller_id", "buyer_id", "product_id", "rating", "comment", "is_moderated", "created_at"),
+        {"created_at": UTC},
+        ("CREATE INDEX idx_reviews_seller_moderated ON reviews(seller_id, is_moderated, rating)",))
+
+
+@migration(5, "журнал отправленных уведомлений")
+def _notification_ledger(conn, settings):
+    # Одно уведомление каждого вида на товар и срок истечения: после
+    # продления срок другой, и уведомление снова разрешено
+    conn.execute(f"""CREATE TABLE notification_ledger (
+        product_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        deadline INTEGER NOT NULL,
+        sent_at INTEGER DEFAULT {timestamps.SQL_NOW},
+        PRIMARY KEY (product_id, kind, deadline)
+    ) WITHOUT ROWID""")
+
+
+@migration(6, "очередь исходящих сообщений")
+def _outbox(conn, settings):
+    conn.execute(f"""CREATE TABLE outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        parse_mode TEXT,
+        reply_markup TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL,
+        last_error TEXT,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )""")
+    conn.execute("CREATE INDEX idx_outbox_pending ON outbox(next_attempt_at) WHERE status = 'pending'")
+
+
+@migration(7, "сводки уведомлений продавцам")
+def _digests(conn, settings):
+    conn.execute(f"""CREATE TABLE digests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seller_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )""")
+    conn.execute("""CREATE TABLE digest_items (
+        digest_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (digest_id, product_id)
+    ) WITHOUT ROWID""")
+
+
+@migration(8, "архив истёкших товаров")
+def _products_archive(conn, settings):
+    # id сохраняется, поэтому reviews.product_id по-прежнему находит товар
+    # через представление products_all
+    conn.execute(f"""CREATE TABLE products_archive (
+        id INTEGER PRIMARY KEY,
+        seller_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        price TEXT NOT NULL,
+        contact TEXT NOT NULL,
+        created_at INTEGER,
+        expires_at INTEGER,
+        last_extended_at INTEGER,
+        last_checked_at INTEGER,
+        archived_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )""")
+    conn.execute("CREATE INDEX idx_products_archive_seller ON products_archive(seller_id)")
+    conn.execute("""CREATE VIEW products_all AS
+        SELECT id, seller_id, title, description, price, contact,
+               created_at, expires_at, last_extended_at, last_checked_at, NULL AS archived_at
+        FROM products
+        UNION ALL
+        SELECT id, seller_id, title, description, price, contact,
+               created_at, expires_at, last_extended_at, last_checked_at, archived_at
+        FROM products_archive""")
+
+
+@migration(9, "инкрементальная очистка файла базы", transactional=False)
+def _incremental_vacuum(conn, settings):
+    # auto_vacuum у существующей базы меняется только полным VACUUM;
+    # после этого свободные страницы можно возвращать через PRAGMA incremental_vacuum
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+@migration(10, "агрегаты рейтинга продавцов")
+def _seller_stats(conn, settings):
+    conn.execute("""CREATE TABLE seller_stats (
+        seller_id INTEGER PRIMARY KEY,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_count INTEGER NOT NULL DEFAULT 0,
+        stars_1 INTEGER NOT NULL DEFAULT 0,
+        stars_2 INTEGER NOT NULL DEFAULT 0,
+        stars_3 INTEGER NOT NULL DEFAULT 0,
+        stars_4 INTEGER NOT NULL DEFAULT 0,
+        stars_5 INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""INSERT INTO seller_stats
+        SELECT seller_id, SUM(rating), COUNT(*),
+               SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+        FROM reviews WHERE is_moderated = 1 GROUP BY seller_id""")
+
+
+@migration(11, "индекс для постраничного вывода отзывов")
+def _reviews_page_index(conn, settings):
+    # Страницы отзывов идут по курсору (created_at, id) внутри продавца;
+    # рейтинг теперь читается из seller_stats, и старый индекс по rating не нужен
+    conn.execute("CREATE INDEX idx_reviews_seller_page ON reviews(seller_id, is_moderated, created_at, id)")
+    conn.execute("DROP INDEX IF EXISTS idx_reviews_seller_moderated")
+
+
+@migration(12, "индекс каталога товаров для админа")
+def _catalogue_index(conn, settings):
+    # Каталог листается по (created_at, id) от новых к старым; с фильтром
+    # по продавцу работает idx_products_seller_created
+    conn.execute("CREATE INDEX idx_products_created ON products(created_at, id)")
+
+
+@migration(13, "очередь модерации отзывов")
+def _moderation_queue(conn, settings):
+    # Модератор берёт отзыв в аренду до lease_until; по её истечении
+    # отзыв снова достаётся любому
+    columns = _columns(conn, "reviews")
+    if "lease_owner" not in columns:
+        conn.execute("ALTER TABLE reviews ADD COLUMN lease_owner INTEGER")
+    if "lease_until" not in columns:
+        conn.execute("ALTER TABLE reviews ADD COLUMN lease_until INTEGER")
+    conn.execute("CREATE INDEX idx_reviews_moderation ON reviews(created_at, id) WHERE is_moderated = 0")
+    conn.execute("CREATE INDEX idx_reviews_lease ON reviews(lease_owner) WHERE is_moderated = 0")
+
+
+@migration(14, "счётчики активности")
+def _activity_counters(conn, settings):
+    conn.execute("""CREATE TABLE activity_counters (
+        period TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, event, bucket)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE seller_activity (
+        seller_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (seller_id, bucket)
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX idx_seller_activity_bucket ON seller_activity(bucket)")
+    # Белый список и баны - малая доля пользователей; их счёт идёт по этим индексам
+    conn.execute("CREATE INDEX idx_users_whitelisted ON users(user_id) WHERE is_whitelisted = 1")
+    conn.execute("CREATE INDEX idx_users_banned ON users(user_id) WHERE is_banned = 1")
+
+
+@migration(15, "хранилище состояний FSM")
+def _fsm_storage(conn, settings):
+    conn.execute("""CREATE TABLE fsm_storage (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at INTEGER NOT NULL
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX idx_fsm_storage_updated ON fsm_storage(updated_at)")
+
+
+@migration(16, "события сброса кэшей между воркерами")
+def _cache_events(conn, settings):
+    # AUTOINCREMENT: после очистки таблицы id не должны начаться заново,
+    # иначе воркеры примут новые события за уже прочитанные
+    conn.execute(f"""CREATE TABLE cache_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        key INTEGER NOT NULL,
+        created_at INTEGER DEFAULT {timestamps.SQL_NOW}
+    )""")
+    conn.execute("CREATE INDEX idx_cache_events_created ON cache_events(created_at)")
+
+
+@migration(17, "индекс обхода товаров по продавцам")
+def _seller_keyset_index(conn, settings):
+    # Проверка актуальности идёт страницами по (seller_id, id); в индексе
+    # (seller_id, created_at) порядок по id внутри продавца пришлось бы досортировывать
+    conn.execute("CREATE INDEX idx_products_seller_id ON products(seller_id, id)")
+
+
+# ================== ЗАПУСК МИГРАЦИЙ ==================
+def current_version(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(daily_limit):
+    """Применяет все ещё не применённые миграции по порядку"""
+    settings = {"daily_limit": daily_limit}
+    with db.connection() as conn:
+        version = current_version(conn)
+        pending = sorted((m for m in MIGRATIONS if m.version > version), key=lambda m: m.version)
+        if not pending:
+            logger.info(f"✅ Схема базы актуальна (версия {version})")
+            return version
+        conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        conn.commit()
+        for m in pending:
+            if m.transactional:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    m.func(conn, settings)
+                    conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                                 (m.version, m.description))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            else:
+                m.func(conn, settings)
+                conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                             (m.version, m.description))
+                conn.commit()
+            logger.info(f"✅ Применена миграция {m.version}: {m.description}")
+            version = m.version
+    return version
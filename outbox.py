@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ ОТПРАВКИ ==================
+# Telegram допускает около 30 сообщений в секунду на бота и около
+# одного сообщения в секунду в один чат; держимся немного ниже.
+GLOBAL_RATE = float(os.getenv("BRAINROT_SEND_RATE", "25"))
+CHAT_INTERVAL = float(os.getenv("BRAINROT_CHAT_INTERVAL", "1.1"))
+WORKERS = int(os.getenv("BRAINROT_SEND_WORKERS", "4"))
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 100
+# Сколько сообщение считается занятым отправителем; если процесс упал
+# посреди отправки, по истечении аренды оно снова уйдёт в работу
+LEASE = 5 * timestamps.MINUTE
+IDLE_POLL = 30
+# Ошибка базы (например, «database is locked» от другого процесса) обычно
+# проходит быстро: повторяем через ERROR_RETRY, удваивая до ERROR_RETRY_MAX
+ERROR_RETRY = 0.5
+ERROR_RETRY_MAX = 5
+# В режиме воркеров сообщение для чата может поставить в очередь другой
+# процесс, и разбудить нас он не может - поэтому опрашиваем чаще
+SHARD_POLL = 1
+
+
+# ================== ОЧЕРЕДЬ В БАЗЕ ==================
+def enqueue(chat_id, text, parse_mode=None, reply_markup=None, send_at=None):
+    """Кладёт сообщение в очередь в рамках текущей транзакции"""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    with db.connection() as conn:
+        message_id = conn.execute(
+            "INSERT INTO outbox (chat_id, text, parse_mode, reply_markup, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, text, parse_mode, markup, send_at or timestamps.now())
+        ).lastrowid
+    db.after_transaction(_wake)
+    return message_id
+
+
+async def send(chat_id, text, parse_mode=None, reply_markup=None):
+    """Ставит сообщение в очередь; отправит его OutboxSender"""
+    return await db.run(enqueue, chat_id, text, parse_mode, reply_markup)
+
+
+def _shard_filter(shard):
+    """Условие на chat_id для shard = (index, count); None - все чаты"""
+    if shard is None:
+        return "", ()
+    index, count = shard
+    # Остаток как в Python: у групп chat_id отрицательный, а % в SQLite сохраняет знак
+    return " AND ((chat_id % ?) + ?) % ? = ?", (count, count, count, index)
+
+
+def claim_due(now, limit=BATCH_SIZE, shard=None):
+    """Забирает созревшие сообщения, продлевая им аренду.
+
+    С shard берутся только чаты этого воркера: так каждый чат отправляет
+    один процесс, и интервал и порядок сообщений в чате соблюдаются.
+    """
+    condition, params = _shard_filter(shard)
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, chat_id, text, parse_mode, reply_markup, attempts, next_attempt_at FROM outbox "
+            f"WHERE status = 'pending' AND next_attempt_at <= ?{condition} ORDER BY next_attempt_at, id LIMIT ?",
+            (now, *params, limit)
+        )
+        claimed = []
+        for row in c.fetchall():
+            # Условие на старое значение не даёт двум процессам взять одно сообщение
+            c.execute("UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND next_attempt_at = ?",
+                      (now + LEASE, row[0], row[6]))
+            if c.rowcount:
+                claimed.append(row[:6])
+    return claimed
+
+
+def next_due(shard=None):
+    condition, params = _shard_filter(shard)
+    with db.connection() as conn:
+        return conn.execute(
+            f"SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'{condition}", params
+        ).fetchone()[0]
+
+
+def mark_sent(message_id):
+    with db.connection() as conn:
+        conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+
+def mark_retry(message_id, attempts, next_attempt_at, error):
+    with db.connection() as conn:
+        conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                     (attempts, next_attempt_at, error, message_id))
+    # Диспетчер мог уснуть до окончания аренды - пусть пересчитает срок
+    db.after_transaction(_wake)
+
+
+def mark_failed(message_id, attempts, error):
+    with db.connection() as conn:
+        conn.execute("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                     (attempts, error, message_id))
+
+
+# ================== ОГРАНИЧЕНИЕ СКОРОСТИ ==================
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает все отправки (ответ RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ================== ОТПРАВИТЕЛЬ ==================
+_sender = None
+
+
+def _wake():
+    if _sender is not None:
+        _sender.wake()
+
+
+def _backoff(attempts):
+    return min(5 * 2 ** attempts, timestamps.HOUR)
+
+
+class OutboxSender:
+    """Разбирает очередь outbox несколькими воркерами под общим лимитом.
+
+    shard = (index, count) в режиме нескольких процессов: отправляются
+    только чаты с chat_id % count == index.
+    """
+
+    def __init__(self, bot, workers=WORKERS, rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL, shard=None):
+        self.bot = bot
+        self.shard = shard
+        self.idle_poll = IDLE_POLL if shard is None else SHARD_POLL
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self._chat_next = {}
+        self._queue = asyncio.Queue(maxsize=BATCH_SIZE * 2)
+        self._wakeup = asyncio.Event()
+        self._loop = None
+        self.sent = 0
+        self.failed = 0
+
+    def wake(self):
+        """Можно вызывать из любого потока"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run(self):
+        global _sender
+        self._loop = asyncio.get_running_loop()
+        _sender = self
+        tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await self._dispatch()
+        finally:
+            for task in tasks:
+                task.cancel()
+            _sender = None
+
+    def _prune_chats(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, at in self._chat_next.items() if at <= now]:
+            del self._chat_next[chat_id]
+
+    async def _dispatch(self):
+        retry = ERROR_RETRY
+        while True:
+            try:
+                self._wakeup.clear()
+                self._prune_chats()
+                batch = await db.run(claim_due, timestamps.now(), BATCH_SIZE, self.shard)
+                for row in batch:
+                    await self._queue.put(row)
+                if len(batch) == BATCH_SIZE:
+                    continue
+                due = await db.run(next_due, self.shard)
+                timeout = self.idle_poll if due is None else min(self.idle_poll, max(due - timestamps.now(), 0))
+                retry = ERROR_RETRY
+            except Exception as e:
+                logger.error(f"❌ Ошибка при разборе очереди сообщений: {e}")
+                timeout = retry
+                retry = min(retry * 2, ERROR_RETRY_MAX)
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _worker(self):
+        while True:
+            row = await self._queue.get()
+            try:
+                await self._deliver(*row)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в отправителе сообщений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _wait_chat(self, chat_id):
+        # Слот в чате резервируется сразу, поэтому два воркера с сообщениями
+        # в один чат встанут друг за другом с нужным интервалом
+        now = time.monotonic()
+        start = max(now, self._chat_next.get(chat_id, 0))
+        self._chat_next[chat_id] = start + self.chat_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _deliver(self, message_id, chat_id, text, parse_mode, reply_markup, attempts):
+        kwargs = {}
+        # parse_mode=None отключил бы HTML по умолчанию, поэтому передаём только заданный
+        if parse_mode:
+            kwargs["parse_mode"] = parse_mode
+        if reply_markup:
+            try:
+                kwargs["reply_markup"] = InlineKeyboardMarkup.model_validate_json(reply_markup)
+            except ValueError as e:
+                # Испорченная клавиатура не исправится сама - иначе сообщение
+                # возвращалось бы в работу после каждой аренды
+                self.failed += 1
+                logger.warning(f"⚠️ Сообщение {message_id} для {chat_id} с некорректной клавиатурой: {e}")
+                await db.run(mark_failed, message_id, attempts + 1, str(e))
+                return
+        await self._wait_chat(chat_id)
+        await self.bucket.acquire()
+        attempts += 1
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            await db.run(mark_retry, message_id, attempts - 1, timestamps.now() + e.retry_after, str(e))
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или сообщение некорректно - повтор не поможет
+            self.failed += 1
+            logger.warning(f"⚠️ Сообщение {message_id} для {chat_id} не доставлено: {e}")
+            await db.run(mark_failed, message_id, attempts, str(e))
+            return
+        except Exception as e:
+            if attempts >= MAX_ATTEMPTS:
+                self.failed += 1
+                logger.error(f"❌ Сообщение {message_id} для {chat_id} не доставлено после {attempts} попыток: {e}")
+                await db.run(mark_failed, message_id, attempts, str(e))
+            else:
+                await db.run(mark_retry, message_id, attempts, timestamps.now() + _backoff(attempts), str(e))
+            return
+        self.sent += 1
+        await db.run(mark_sent, message_id)
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import activity
+import db
+import invalidation
+
+logger = logging.getLogger(__name__)
+
+# ================== КЭШ ПРОФИЛЕЙ ПОЛЬЗОВАТЕЛЕЙ ==================
+CACHE_SIZE = int(os.getenv("BRAINROT_PROFILE_CACHE", "4096"))
+CACHE_TTL = int(os.getenv("BRAINROT_PROFILE_TTL", "300"))
+
+Profile = namedtuple(
+    "Profile", "user_id username first_name last_name is_banned ban_reason is_whitelisted daily_limit"
+)
+
+
+class ProfileCache:
+    """LRU-кэш строк users с ограниченным временем жизни.
+
+    Всё, что меняет бан, белый список или username, обязано вызвать
+    invalidate(); TTL лишь страхует от правок базы в обход бота.
+    Отсутствующий пользователь тоже кэшируется (как None).
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, user_id):
+        with db.connection() as conn:
+            row = conn.execute(
+                "SELECT user_id, username, first_name, last_name, is_banned, ban_reason, is_whitelisted, daily_limit "
+                "FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        user_id, username, first_name, last_name, is_banned, ban_reason, is_whitelisted, daily_limit = row
+        return Profile(user_id, username, first_name, last_name,
+                       bool(is_banned), ban_reason, bool(is_whitelisted), daily_limit)
+
+    def get(self, user_id):
+        """Профиль пользователя или None; при промахе читает базу"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        profile = self._load(user_id)
+        with self._lock:
+            # Пока читали, профиль мог быть сброшен - тогда не кэшируем прочитанное
+            if generation != self._generation:
+                return profile
+            self._items[user_id] = (now + self.ttl, profile)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id):
+        """Сбрасывает профиль сразу и ещё раз после завершения текущей транзакции"""
+        self._discard(user_id)
+        db.after_transaction(lambda: self._discard(user_id))
+
+    def _discard(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._items.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+cache = ProfileCache()
+
+# Профиль автора текущего апдейта. Его загружает middleware один раз на
+# апдейт, и все чтения внутри обработчика (в том числе в потоках БД,
+# куда db.run передаёт контекст) берут его отсюда.
+_request = ContextVar("profile_request", default=None)
+
+
+@contextmanager
+def request_scope(profile):
+    token = _request.set({profile.user_id: profile} if profile else {})
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def get(user_id):
+    snapshot = _request.get()
+    if snapshot is not None and user_id in snapshot:
+        return snapshot[user_id]
+    return cache.get(user_id)
+
+
+def invalidate(user_id):
+    snapshot = _request.get()
+    if snapshot is not None:
+        snapshot.pop(user_id, None)
+    cache.invalidate(user_id)
+    invalidation.publish(invalidation.PROFILE, user_id)
+
+
+def _forget(user_ids):
+    """Профили, изменённые другими воркерами"""
+    for user_id in user_ids:
+        cache._discard(user_id)
+
+
+invalidation.subscribe(invalidation.PROFILE, _forget)
+
+
+def ensure(user_id, username, first_name, last_name, daily_limit):
+    """Возвращает профиль, создавая пользователя или обновляя его имя при необходимости"""
+    profile = cache.get(user_id)
+    if profile and (profile.username, profile.first_name, profile.last_name) == (username, first_name, last_name):
+        return profile
+    with db.connection() as conn:
+        c = conn.cursor()
+        created = False
+        if profile is None:
+            c.execute(
+                """INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, daily_limit) 
+                   VALUES (?, ?, ?, ?, ?)""",
+                (user_id, username, first_name, last_name, daily_limit)
+            )
+            created = c.rowcount > 0
+            if created:
+                activity.record(activity.NEW_USER)
+                logger.info(f"👤 Создан новый пользователь: {username} (ID: {user_id})")
+        if not created:
+            c.execute(
+                """UPDATE users SET username = ?, first_name = ?, last_name = ? 
+                   WHERE user_id = ?""",
+                (username, first_name, last_name, user_id)
+            )
+        invalidate(user_id)
+        # Кэш заполнится уже закоммиченной строкой при следующем обращении
+        return cache._load(user_id)
@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+
+import db
+import invalidation
+import timestamps
+
+# ================== ДНЕВНЫЕ ЛИМИТЫ ПРОДАВЦОВ ==================
+class QuotaEngine:
+    """Скользящее окно времён создания товаров для каждого продавца.
+
+    В окне хранится не больше daily_limit последних отметок: чтобы понять,
+    исчерпан ли лимит, больше и не нужно. Окно строится из базы при первом
+    обращении и после удаления товара продавца, а дальше только
+    пополняется при создании новых товаров.
+    """
+
+    def __init__(self, window=timestamps.DAY):
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+        # Растёт при каждом сбросе окна: окно, прочитанное из базы до
+        # сброса, уже устарело и не сохраняется
+        self._generation = 0
+
+    def _load(self, seller_id, daily_limit, since):
+        with db.connection() as conn:
+            rows = conn.execute(
+                "SELECT created_at FROM products WHERE seller_id = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (seller_id, since, daily_limit)
+            ).fetchall()
+        return deque((row[0] for row in reversed(rows)), maxlen=daily_limit)
+
+    def used(self, seller_id, daily_limit, now=None):
+        """Сколько товаров продавец добавил за окно (не больше daily_limit)"""
+        if daily_limit <= 0:
+            return 0
+        now = now or timestamps.now()
+        since = now - self.window
+        with self._lock:
+            times = self._windows.get(seller_id)
+            if times is not None and times.maxlen == daily_limit:
+                return self._trim(times, since)
+            generation = self._generation
+        # Запрос к базе - без блокировки, чтобы холодное окно одного
+        # продавца не задерживало остальные потоки пула
+        loaded = self._load(seller_id, daily_limit, since)
+        with self._lock:
+            times = self._windows.get(seller_id)
+            if times is None or times.maxlen != daily_limit:
+                times = loaded
+                if generation == self._generation:
+                    self._windows[seller_id] = times
+            return self._trim(times, since)
+
+    @staticmethod
+    def _trim(times, since):
+        while times and times[0] < since:
+            times.popleft()
+        return len(times)
+
+    def record(self, seller_id, created_at):
+        """Учитывает только что созданный товар, если окно уже построено.
+
+        Внутри транзакции окно пополняется только после её коммита.
+        """
+        db.after_commit(lambda: self._append(seller_id, created_at))
+
+    def _append(self, seller_id, created_at):
+        with self._lock:
+            times = self._windows.get(seller_id)
+            if times is not None:
+                times.append(created_at)
+
+    def forget(self, seller_id):
+        """Сбрасывает окно продавца; вызывается после коммита удаления"""
+        self._drop(seller_id)
+        invalidation.publish(invalidation.QUOTA, seller_id)
+
+    def _drop(self, seller_id):
+        with self._lock:
+            self._windows.pop(seller_id, None)
+            self._generation += 1
+
+
+engine = QuotaEngine()
+
+
+def _forget(seller_ids):
+    """Продавцы, чьи товары удалили в других воркерах"""
+    for seller_id in seller_ids:
+        engine._drop(seller_id)
+
+
+invalidation.subscribe(invalidation.QUOTA, _forget)
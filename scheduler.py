@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import logging
+
+import db
+import timestamps
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_NOTICE = "expiry_soon"
+# Через сколько повторить уведомление, если его не удалось поставить в очередь
+RETRY_DELAY = timestamps.MINUTE
+
+
+# ================== ЖУРНАЛ УВЕДОМЛЕНИЙ ==================
+def load_pending_deadlines(kind, now):
+    """(id, expires_at, seller_id) активных товаров, о текущем сроке которых ещё не уведомляли"""
+    with db.connection() as conn:
+        return conn.execute("""
+            SELECT p.id, p.expires_at, p.seller_id
+            FROM products p
+            WHERE p.expires_at > ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM notification_ledger l
+                  WHERE l.product_id = p.id AND l.kind = ? AND l.deadline = p.expires_at
+              )
+        """, (now, kind)).fetchall()
+
+
+def claim_notice(product_id, kind, deadline, horizon=0):
+    """Записывает уведомление в журнал и возвращает (seller_id, товары).
+
+    Товары - список (id, title, expires_at): сам товар и другие товары
+    того же продавца, истекающие не позже чем через `horizon` секунд
+    после него и ещё не уведомлённые. Они уходят одной сводкой.
+    None, если срок товара уже другой, товара нет или уведомление
+    об этом сроке уже отправлялось.
+    """
+    with db.connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT seller_id, title FROM products WHERE id = ? AND expires_at = ?", (product_id, deadline))
+        product = c.fetchone()
+        if not product:
+            return None
+        c.execute("INSERT OR IGNORE INTO notification_ledger (product_id, kind, deadline) VALUES (?, ?, ?)",
+                  (product_id, kind, deadline))
+        if c.rowcount == 0:
+            return None
+        seller_id, title = product
+        products = [(product_id, title, deadline)]
+        if horizon > 0:
+            c.execute("""
+                SELECT p.id, p.title, p.expires_at FROM products p
+                WHERE p.seller_id = ? AND p.id != ? AND p.expires_at > ? AND p.expires_at <= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM notification_ledger l
+                      WHERE l.product_id = p.id AND l.kind = ? AND l.deadline = p.expires_at
+                  )
+            """, (seller_id, product_id, timestamps.now(), deadline + horizon, kind))
+            extra = c.fetchall()
+            c.executemany("INSERT OR IGNORE INTO notification_ledger (product_id, kind, deadline) VALUES (?, ?, ?)",
+                          [(row[0], kind, row[2]) for row in extra])
+            products.extend(extra)
+    products.sort(key=lambda row: (row[2], row[0]))
+    return seller_id, products
+
+
+# ================== ПЛАНИРОВЩИК ИСТЕЧЕНИЯ ==================
+class ExpiryScheduler:
+    """Мин-куча сроков истечения товаров.
+
+    Для каждого товара хранится текущий срок; запись в куче срабатывает
+    за `lead` секунд до него. Продление просто кладёт новую запись, а
+    старая при извлечении отбрасывается, так как срок уже не совпадает.
+    Вместе со сработавшим товаром уведомление получают и товары того же
+    продавца, истекающие в пределах `horizon` после него.
+
+    notify(seller_id, products) - синхронная функция; она выполняется в
+    потоке БД в одной транзакции с записью в журнал, поэтому уведомление
+    либо записано и поставлено в очередь, либо нет ни того, ни другого.
+    """
+
+    def __init__(self, notify, lead=6 * timestamps.HOUR, kind=EXPIRY_NOTICE, horizon=0):
+        self.notify = notify
+        self.lead = lead
+        self.kind = kind
+        self.horizon = horizon
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, product_id, deadline):
+        product_id = int(product_id)
+        self._deadlines[product_id] = deadline
+        heapq.heappush(self._heap, (deadline - self.lead, product_id, deadline))
+        if self._heap[0][1] == product_id:
+            self._wakeup.set()
+
+    def cancel(self, product_id):
+        self._deadlines.pop(int(product_id), None)
+
+    async def load(self, owns=None):
+        """owns(seller_id) - чьи товары брать, когда продавцы поделены между воркерами.
+
+        Товары продавца попадают в кучу его воркера, и при перезапуске
+        каждый воркер держит и проверяет только свою долю сроков.
+        """
+        rows = await db.run(load_pending_deadlines, self.kind, timestamps.now())
+        for product_id, deadline, seller_id in rows:
+            if owns is None or owns(seller_id):
+                self.schedule(product_id, deadline)
+        logger.info(f"✅ Планировщик истечения: {len(self)} товаров в очереди")
+
+    def _is_current(self, entry):
+        return self._deadlines.get(entry[1]) == entry[2]
+
+    async def run(self):
+        while True:
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - timestamps.now()
+                if timeout <= 0:
+                    _, product_id, deadline = heapq.heappop(self._heap)
+                    del self._deadlines[product_id]
+                    await self._fire(product_id, deadline)
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim_and_notify(self, product_id, deadline):
+        with db.connection():
+            claimed = claim_notice(product_id, self.kind, deadline, self.horizon)
+            if claimed:
+                self.notify(*claimed)
+        return claimed
+
+    async def _fire(self, product_id, deadline):
+        if deadline <= timestamps.now():
+            return
+        try:
+            claimed = await db.run(self._claim_and_notify, product_id, deadline)
+        except Exception as e:
+            # Запись в журнал откатилась вместе с очередью - пробуем ещё раз позже,
+            # если срок за это время не поменялся
+            logger.error(f"❌ Ошибка при уведомлении об истечении товара {product_id}: {e}")
+            if product_id not in self._deadlines:
+                self._deadlines[product_id] = deadline
+                heapq.heappush(self._heap, (timestamps.now() + RETRY_DELAY, product_id, deadline))
+            return
+        if claimed:
+            for other_id, _, other_deadline in claimed[1]:
+                if self._deadlines.get(other_id) == other_deadline:
+                    del self._deadlines[other_id]
@@ -0,0 +1,30 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# db читает путь к базе при импорте, поэтому подменяем его до импорта модулей бота
+TMP_DIR = tempfile.mkdtemp(prefix="brainrot-tests-")
+os.environ["BRAINROT_DB"] = os.path.join(TMP_DIR, "brainrot_shop.db")
+os.environ["BRAINROT_METRICS_PORT"] = "0"
+DAILY_LIMIT = 6
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Временная база с применёнными миграциями, общая на весь прогон"""
+    import db
+    import migrations
+
+    migrations.migrate(DAILY_LIMIT)
+    yield db
+    db.shutdown()
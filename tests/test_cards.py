@@ -0,0 +1,26 @@
+import cards
+
+
+def test_invalidate_rerenders_and_eviction_keeps_no_leftovers():
+    cache = cards.RenderCache(maxsize=3)
+    renders = []
+
+    def render(key):
+        renders.append(key)
+        return key
+
+    cache.get_or_render(("card", 1), lambda: render("card 1"))
+    cache.get_or_render(("seller", 1), lambda: render("seller 1"))
+    cache.get_or_render(("card", 1), lambda: render("card 1"))
+    assert renders == ["card 1", "seller 1"]
+
+    cache.discard(1)
+    cache.get_or_render(("card", 1), lambda: render("card 1 v2"))
+    assert renders[-1] == "card 1 v2"
+
+    # Товары, вытесненные из LRU или сброшенные, не оставляют следов
+    for product_id in range(2, 100):
+        cache.get_or_render(("card", product_id), lambda: render("card"))
+        cache.discard(product_id - 1)
+    assert len(cache) <= 3
+    assert set(cache._by_product) <= {key[1] for key in cache._items}
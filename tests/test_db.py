@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+TICK = 0.01
+# Рекурсивный CTE без индексов и диска: честно занимает SQLite на сотни миллисекунд
+SLOW_QUERY = """
+    WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 3000000)
+    SELECT SUM(x) FROM n
+"""
+
+
+def test_event_loop_stays_responsive_during_slow_query(database):
+    db = database
+
+    def slow_query():
+        with db.connection() as conn:
+            return conn.execute(SLOW_QUERY).fetchone()[0]
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(TICK)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        result = await db.run(slow_query)
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return result, ticks, elapsed
+
+    result, ticks, elapsed = asyncio.run(scenario())
+    assert result == 3000000 * 3000001 // 2
+    assert elapsed > 0.2, "запрос слишком быстрый, тест ничего не проверяет"
+    # Если бы запрос блокировал event loop, тиков за это время не было бы вовсе;
+    # половина от идеала оставляет запас на медленную машину
+    assert ticks >= elapsed / TICK / 2, (ticks, elapsed)
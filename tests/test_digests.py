@@ -0,0 +1,67 @@
+import pytest
+
+SELLER = 9400
+
+
+@pytest.fixture
+def products(database, monkeypatch):
+    """Три товара продавца: один продлевали вчера, остальные - никогда"""
+    import timestamps
+
+    db = database
+    now = 1_000_000_000
+    monkeypatch.setattr(timestamps, "now", lambda: now)
+    with db.connection() as conn:
+        ids = [conn.execute(
+            "INSERT INTO products (seller_id, title, description, price, contact, created_at, expires_at, "
+            "last_extended_at, last_checked_at) VALUES (?, 'Товар', 'Описание', '10', 'seller', ?, ?, ?, 0)",
+            (SELLER, now - timestamps.DAY, now + offset, extended_at)
+        ).lastrowid for offset, extended_at in ((1, None), (2, now - timestamps.DAY), (3, None))]
+    yield now, ids
+    with db.connection() as conn:
+        conn.execute("DELETE FROM digest_items WHERE digest_id IN (SELECT id FROM digests WHERE seller_id = ?)",
+                     (SELLER,))
+        conn.execute("DELETE FROM digests WHERE seller_id = ?", (SELLER,))
+        conn.execute("DELETE FROM products WHERE seller_id = ?", (SELLER,))
+
+
+def columns(db, ids, column):
+    with db.connection() as conn:
+        return [conn.execute(f"SELECT {column} FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+                for product_id in ids]
+
+
+def done(db, digest_id):
+    with db.connection() as conn:
+        return {row[0] for row in conn.execute(
+            "SELECT product_id FROM digest_items WHERE digest_id = ? AND done = 1", (digest_id,))}
+
+
+def test_extend_all_skips_recently_extended(database, products):
+    import digests
+    import timestamps
+
+    now, ids = products
+    digest_id = digests.create(SELLER, digests.EXPIRY, ids)
+    assert digests.extend_all(digest_id, SELLER + 1) is None
+    assert digests.extend_all(digest_id, SELLER) == (now + 3 * timestamps.DAY, [ids[0], ids[2]], [ids[1]])
+    assert columns(database, ids, "expires_at") == [now + 3 * timestamps.DAY, now + 2, now + 3 * timestamps.DAY]
+    assert done(database, digest_id) == {ids[0], ids[2]}
+    # Повторно продлевать нечего, кроме пропущенного
+    assert digests.extend_all(digest_id, SELLER) == (now + 3 * timestamps.DAY, [], [ids[1]])
+    # Сводка проверки актуальности продлевать не умеет
+    assert digests.extend_all(digests.create(SELLER, digests.RELEVANCE, ids), SELLER) is None
+
+
+def test_confirm_all_marks_pending_items(database, products):
+    import digests
+
+    now, ids = products
+    digest_id = digests.create(SELLER, digests.RELEVANCE, ids)
+    digests.mark_done(digest_id, [ids[1]])
+    assert digests.confirm_all(digest_id, SELLER + 1) is None
+    assert digests.confirm_all(digest_id, SELLER) == [ids[0], ids[2]]
+    assert columns(database, ids, "last_checked_at") == [now, 0, now]
+    assert done(database, digest_id) == set(ids)
+    assert digests.confirm_all(digest_id, SELLER) == []
+    assert digests.confirm_all(digests.create(SELLER, digests.EXPIRY, ids), SELLER) is None
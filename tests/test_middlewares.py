@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from aiogram.types import User
+
+DAILY_LIMIT = 6
+
+
+@pytest.fixture
+def statements(database, monkeypatch):
+    """SQL, выполненный соединениями пула, без BEGIN/COMMIT вокруг транзакций"""
+    db = database
+    executed = []
+    connect = db.pool._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(executed.append)
+        return conn
+
+    # Пул создаёт соединения лениво: закрываем свободные, новые придут уже с трассировкой
+    db.pool.close()
+    monkeypatch.setattr(db.pool, "_connect", traced_connect)
+    yield executed
+    db.pool.close()
+
+
+def sql(executed):
+    return [" ".join(statement.split()) for statement in executed
+            if statement.split()[0].upper() not in ("BEGIN", "COMMIT", "ROLLBACK")]
+
+
+def feed(user):
+    import middlewares
+
+    seen = {}
+
+    async def handler(event, data):
+        import profiles
+
+        seen["profile"] = data["profile"]
+        # Внутри апдейта профиль автора берётся из снимка, а не из базы
+        seen["lookup"] = profiles.get(user.id)
+
+    asyncio.run(middlewares.UserContextMiddleware(DAILY_LIMIT)(handler, None, {"event_from_user": user}))
+    return seen
+
+
+def test_warm_user_costs_no_queries(statements):
+    import profiles
+
+    user = User(id=5001, is_bot=False, first_name="Warm", username="warm")
+    feed(user)
+    profiles.get(user.id)
+    statements.clear()
+
+    seen = feed(user)
+
+    assert sql(statements) == []
+    assert seen["profile"].username == "warm"
+    assert seen["lookup"] is seen["profile"]
+
+
+def test_new_user_is_inserted_and_read_once(statements):
+    user = User(id=5002, is_bot=False, first_name="New", username="new")
+
+    seen = feed(user)
+
+    executed = sql(statements)
+    assert executed[0].startswith("SELECT user_id, username") and executed[0].endswith("WHERE user_id = 5002")
+    assert executed[1].startswith("INSERT OR IGNORE INTO users")
+    # Регистрация попадает в счётчики активности: почасовой и суточный
+    assert [s.split("(")[0].strip() for s in executed[2:4]] == ["INSERT INTO activity_counters"] * 2
+    assert executed[4] == executed[0]
+    assert len(executed) == 5, executed
+    assert seen["profile"].user_id == 5002 and seen["profile"].daily_limit == DAILY_LIMIT
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# Схема и форматы времени, которые писала версия бота до миграций
+BASELINE_SCHEMA = """
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seller_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    price TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
+    last_extended_at TIMESTAMP,
+    last_checked_at TIMESTAMP
+);
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    is_banned BOOLEAN DEFAULT 0,
+    ban_reason TEXT,
+    is_whitelisted BOOLEAN DEFAULT 0,
+    daily_limit INTEGER DEFAULT 6,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE admin_actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_id INTEGER NOT NULL,
+    action_type TEXT NOT NULL,
+    target_id INTEGER,
+    target_type TEXT,
+    reason TEXT,
+    details TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seller_id INTEGER NOT NULL,
+    buyer_id INTEGER NOT NULL,
+    product_id INTEGER,
+    rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+    comment TEXT,
+    is_moderated BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+# Москва без перехода на летнее время: локальное время = UTC + 3 часа
+TZ = "MSK-3"
+OFFSET = timedelta(hours=3)
+
+
+def utc(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp())
+
+
+def local(text):
+    return int((datetime.fromisoformat(text) - OFFSET).replace(tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def moscow_time():
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = TZ
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+@pytest.fixture
+def baseline_db(database, tmp_path, monkeypatch):
+    """Отдельная база в формате до миграций; пул db на время теста смотрит в неё"""
+    db = database
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO products (id, seller_id, title, description, price, contact, created_at, expires_at, "
+        "last_extended_at, last_checked_at) VALUES (?, 1, 't', 'd', 'p', 'c', ?, ?, ?, ?)",
+        [
+            # Новый товар: всё из datetime.now(), продление пришлось на нулевые микросекунды
+            (1, "2026-01-10 12:00:00.123456", "2026-01-13 12:00:00.123456", "2026-01-11 08:30:00",
+             "2026-01-11 09:00:00.5"),
+            # last_checked_at проставлен CURRENT_TIMESTAMP при добавлении колонки
+            (2, "2026-01-10 12:00:00.250000", "2026-01-13 12:00:00.250000", None, "2026-01-10 20:00:00"),
+            # Товар старой версии бота: created_at из DEFAULT, срока ещё нет
+            (3, "2026-01-09 06:00:00", None, None, None),
+            # Срока ещё нет, но created_at из datetime.now()
+            (4, "2026-01-09 15:45:10.000001", None, None, None),
+        ]
+    )
+    conn.execute("INSERT INTO users (user_id, registered_at) VALUES (1, '2026-01-05 10:00:00')")
+    conn.execute("INSERT INTO admin_actions (admin_id, action_type, created_at) "
+                 "VALUES (1, 'ban', '2026-01-06 11:00:00')")
+    conn.execute("INSERT INTO reviews (seller_id, buyer_id, rating, created_at) "
+                 "VALUES (1, 1, 5, '2026-01-07 12:00:00')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "pool", db.ConnectionPool(path))
+    yield db
+    db.pool.close()
+
+
+def test_baseline_timestamps_become_utc_epoch(moscow_time, baseline_db):
+    import migrations
+
+    db = baseline_db
+    assert migrations.migrate(6) == max(m.version for m in migrations.MIGRATIONS)
+
+    with db.connection() as conn:
+        products = {row[0]: row[1:] for row in conn.execute(
+            "SELECT id, created_at, expires_at, last_extended_at, last_checked_at FROM products"
+        )}
+        registered_at = conn.execute("SELECT registered_at FROM users").fetchone()[0]
+        action_at = conn.execute("SELECT created_at FROM admin_actions").fetchone()[0]
+        review_at = conn.execute("SELECT created_at FROM reviews").fetchone()[0]
+
+    assert products[1] == (local("2026-01-10 12:00:00"), local("2026-01-13 12:00:00"),
+                           local("2026-01-11 08:30:00"), local("2026-01-11 09:00:00"))
+    assert products[2] == (local("2026-01-10 12:00:00"), local("2026-01-13 12:00:00"),
+                           None, utc("2026-01-10 20:00:00"))
+    # Срок из datetime(created_at, '+3 days') - в поясе своего created_at
+    assert products[3] == (utc("2026-01-09 06:00:00"), utc("2026-01-12 06:00:00"), None, None)
+    assert products[4] == (local("2026-01-09 15:45:10"), local("2026-01-12 15:45:10"), None, None)
+    assert registered_at == utc("2026-01-05 10:00:00")
+    assert action_at == utc("2026-01-06 11:00:00")
+    assert review_at == utc("2026-01-07 12:00:00")
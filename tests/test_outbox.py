@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+
+
+@pytest.fixture
+def outbox(database):
+    import outbox
+
+    db = database
+    with db.connection() as conn:
+        conn.execute("DELETE FROM outbox")
+    yield outbox
+    with db.connection() as conn:
+        conn.execute("DELETE FROM outbox")
+
+
+def test_claims_are_split_between_workers_by_chat(outbox):
+    import timestamps
+
+    now = timestamps.now()
+    # -1001 - группа: остаток считается как в Python, а не со знаком, как в SQLite
+    chats = [10, 11, 12, 13, -1001]
+    for chat_id in chats:
+        outbox.enqueue(chat_id, "привет", send_at=now - 1)
+
+    assert outbox.next_due((0, 2)) == now - 1
+    first = {row[1] for row in outbox.claim_due(now, shard=(0, 2))}
+    second = {row[1] for row in outbox.claim_due(now, shard=(1, 2))}
+    assert first == {10, 12}
+    assert second == {11, 13, -1001}
+    # Всё уже в аренде: ни один воркер не возьмёт сообщение повторно
+    assert outbox.claim_due(now) == []
+
+
+class FakeBot:
+    """Вместо Telegram: запоминает отправленное или бросает заданную ошибку"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((chat_id, text, kwargs))
+
+
+def deliver_one(outbox, bot, chat_id):
+    import timestamps
+
+    sender = outbox.OutboxSender(bot, rate=1000, chat_interval=0)
+    [row] = outbox.claim_due(timestamps.now(), shard=None)
+    assert row[1] == chat_id
+    asyncio.run(sender._deliver(*row))
+    return sender, row[0]
+
+
+def stored(database, message_id):
+    with database.connection() as conn:
+        return conn.execute("SELECT status, attempts, next_attempt_at FROM outbox WHERE id = ?",
+                            (message_id,)).fetchone()
+
+
+def test_claimed_message_is_hidden_until_lease_expires(outbox):
+    import timestamps
+
+    now = timestamps.now()
+    outbox.enqueue(20, "привет", send_at=now - 1)
+    assert len(outbox.claim_due(now)) == 1
+    assert outbox.claim_due(now) == []
+    assert outbox.next_due() == now + outbox.LEASE
+    # Отправитель упал, аренда истекла - сообщение снова в работе
+    assert len(outbox.claim_due(now + outbox.LEASE)) == 1
+
+
+def test_delivered_message_is_removed(outbox, database):
+    bot = FakeBot()
+    outbox.enqueue(21, "<b>привет</b>", parse_mode="HTML")
+    sender, message_id = deliver_one(outbox, bot, 21)
+    assert bot.sent == [(21, "<b>привет</b>", {"parse_mode": "HTML"})]
+    assert sender.sent == 1
+    assert stored(database, message_id) is None
+
+
+def test_error_is_retried_with_backoff_until_max_attempts(outbox, database, monkeypatch):
+    import timestamps
+
+    monkeypatch.setattr(timestamps, "now", lambda: 1_000_000)
+    bot = FakeBot(RuntimeError("сеть недоступна"))
+    message_id = outbox.enqueue(22, "привет")
+    deliver_one(outbox, bot, 22)
+    assert stored(database, message_id) == ("pending", 1, 1_000_000 + outbox._backoff(1))
+
+    with database.connection() as conn:
+        conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = 0 WHERE id = ?",
+                     (outbox.MAX_ATTEMPTS - 1, message_id))
+    sender, _ = deliver_one(outbox, bot, 22)
+    assert stored(database, message_id)[:2] == ("failed", outbox.MAX_ATTEMPTS)
+    assert sender.failed == 1
+
+
+def test_retry_after_pauses_sending_without_spending_attempt(outbox, database, monkeypatch):
+    import timestamps
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import SendMessage
+
+    monkeypatch.setattr(timestamps, "now", lambda: 1_000_000)
+    error = TelegramRetryAfter(SendMessage(chat_id=23, text="привет"), "Too Many Requests", 7)
+    message_id = outbox.enqueue(23, "привет")
+    sender, _ = deliver_one(outbox, FakeBot(error), 23)
+    assert stored(database, message_id) == ("pending", 0, 1_000_000 + 7)
+    assert sender.bucket._paused_until - time.monotonic() > 6
+
+
+def test_forbidden_is_failed_at_once(outbox, database):
+    from aiogram.exceptions import TelegramForbiddenError
+    from aiogram.methods import SendMessage
+
+    error = TelegramForbiddenError(SendMessage(chat_id=24, text="привет"), "bot was blocked by the user")
+    message_id = outbox.enqueue(24, "привет")
+    sender, _ = deliver_one(outbox, FakeBot(error), 24)
+    assert stored(database, message_id)[:2] == ("failed", 1)
+    assert sender.failed == 1
+
+
+def test_token_bucket_limits_rate_and_honours_pause():
+    import outbox
+
+    async def timed(bucket, count):
+        started = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Запас в capacity токенов уходит сразу, дальше - по одному на 1/rate
+    bucket = outbox.TokenBucket(rate=50, capacity=5)
+    assert asyncio.run(timed(bucket, 5)) < 0.05
+    assert 0.15 <= asyncio.run(timed(bucket, 10)) < 0.5
+
+    bucket = outbox.TokenBucket(rate=1000)
+    bucket.pause(0.2)
+    assert asyncio.run(timed(bucket, 1)) >= 0.19
@@ -0,0 +1,37 @@
+import asyncio
+
+SELLERS = {9201: 3, 9202: 8, 9203: 2}
+
+
+def test_relevance_pages_are_bounded_and_keep_seller_groups(database, monkeypatch):
+    import main
+    import timestamps
+
+    db = database
+    expires_at = timestamps.now() + timestamps.DAY
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO products (seller_id, title, description, price, contact, created_at, expires_at, "
+            "last_checked_at) VALUES (?, 'Товар', 'Описание', '10', 'seller', 0, ?, 0)",
+            [(seller_id, expires_at) for seller_id, count in SELLERS.items() for _ in range(count)]
+        )
+    monkeypatch.setattr(main, "RELEVANCE_BATCH", 5)
+
+    async def read():
+        queue = asyncio.Queue()
+        await main.read_relevance_pages(queue)
+        pages = []
+        while (page := queue.get_nowait()) is not None:
+            pages.append([row[1] for row in page if row[1] in SELLERS])
+        return pages
+
+    try:
+        pages = [page for page in asyncio.run(read()) if page]
+    finally:
+        with db.connection() as conn:
+            conn.execute(f"DELETE FROM products WHERE seller_id IN ({','.join('?' * len(SELLERS))})",
+                         tuple(SELLERS))
+
+    assert all(len(page) <= 5 for page in pages)
+    # Продавец целиком в одной странице, если помещается; 9202 с 8 товарами делится
+    assert pages == [[9201] * 3, [9202] * 5, [9202] * 3, [9203] * 2]
@@ -0,0 +1,106 @@
+import pytest
+
+SELLER = 9500
+
+
+@pytest.fixture
+def reviews(database):
+    """Семь одобренных отзывов продавца; у двух одинаковое время создания, и первая страница
+    из трёх отзывов проходит ровно между ними"""
+    db = database
+    created = [100, 200, 300, 400, 400, 500, 600]
+    with db.connection() as conn:
+        ids = [conn.execute(
+            "INSERT INTO reviews (seller_id, buyer_id, rating, comment, is_moderated, created_at) "
+            "VALUES (?, 1, 5, 'ок', 1, ?)", (SELLER, created_at)
+        ).lastrowid for created_at in created]
+    yield ids
+    with db.connection() as conn:
+        conn.execute("DELETE FROM reviews WHERE seller_id = ?", (SELLER,))
+
+
+def test_review_cursor_round_trip():
+    import main
+
+    assert main.decode_review_cursor(None) is None
+    assert main.decode_review_cursor("") is None
+    for direction in ("a", "b"):
+        for created_at, review_id in ((0, 1), (1_700_000_000, 35), (2 ** 40, 36 ** 5)):
+            cursor = main.encode_review_cursor(direction, created_at, review_id)
+            assert main.decode_review_cursor(cursor) == (direction, created_at, review_id)
+
+
+def test_reviews_are_paged_from_cursor_both_ways(reviews):
+    import main
+
+    def page(cursor=None):
+        return [row[0] for row in main.get_seller_reviews(SELLER, cursor, per_page=3)]
+
+    def cursor(direction, review_id):
+        created_at = {row[0]: row[3] for row in main.get_seller_reviews(SELLER, per_page=10)}[review_id]
+        return main.encode_review_cursor(direction, created_at, review_id)
+
+    newest = reviews[::-1]
+    first = page()
+    assert first == newest[:3]
+    second = page(cursor("a", first[-1]))
+    # Отзывы с одинаковым created_at не теряются и не повторяются на границе
+    assert second == newest[3:6]
+    assert page(cursor("a", second[-1])) == newest[6:]
+    assert page(cursor("b", second[0])) == first
+
+
+@pytest.fixture
+def queue(database, monkeypatch):
+    """Три отзыва на модерации; других в очереди на время теста нет"""
+    import timestamps
+
+    db = database
+    now = 1_000_000_000
+    monkeypatch.setattr(timestamps, "now", lambda: now)
+    with db.connection() as conn:
+        hidden = [row[0] for row in conn.execute("SELECT id FROM reviews WHERE is_moderated = 0")]
+        conn.execute("UPDATE reviews SET is_moderated = 2 WHERE is_moderated = 0")
+        ids = [conn.execute(
+            "INSERT INTO reviews (seller_id, buyer_id, rating, comment, is_moderated, created_at) "
+            "VALUES (?, 1, 4, 'ок', 0, ?)", (SELLER, created_at)
+        ).lastrowid for created_at in (100, 200, 300)]
+    yield now, ids
+    with db.connection() as conn:
+        conn.execute("DELETE FROM reviews WHERE seller_id = ?", (SELLER,))
+        conn.executemany("UPDATE reviews SET is_moderated = 0 WHERE id = ?", [(review_id,) for review_id in hidden])
+
+
+def test_moderators_lease_different_reviews(queue, monkeypatch):
+    import main
+    import timestamps
+
+    now, ids = queue
+    first = main.claim_next_review(1)
+    assert first == ids[0]
+    # Повторный запрос возвращает уже арендованный, второй админ берёт следующий
+    assert main.claim_next_review(1) == first
+    assert main.claim_next_review(2) == ids[1]
+    # Чужой отзыв в аренде нельзя ни одобрить, ни отклонить
+    assert main.approve_review(first, 2) is None
+    assert main.reject_review(first, 2) is None
+    # «Пропустить» берёт свободный после текущего, минуя арендованные
+    assert main.claim_next_review(1, after=(100, first)) == ids[2]
+    assert main.claim_next_review(3) is None
+    assert main.moderation_queue_stats() == (3, 3, now - 100)
+
+    monkeypatch.setattr(timestamps, "now", lambda: now + main.MODERATION_LEASE)
+    # Аренда истекла - отзыв снова свободен
+    assert main.claim_next_review(3) == ids[0]
+
+
+def test_released_review_goes_back_to_queue(queue):
+    import main
+
+    now, ids = queue
+    assert main.claim_next_review(1) == ids[0]
+    main.release_review(ids[0], 2)
+    assert main.claim_next_review(2) == ids[1]
+    main.release_review(ids[0], 1)
+    assert main.claim_next_review(3) == ids[0]
+    assert main.moderation_queue_stats() == (3, 2, now - 100)
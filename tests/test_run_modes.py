@@ -0,0 +1,116 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+import aiohttp
+
+import loadtest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Импорт бота на медленной машине занимает секунды, с запасом
+START_TIMEOUT = 90
+USER_ID = 777000
+WEBHOOK_URL = "https://bot.example.test"
+SECRET = "test-secret"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(predicate, timeout=START_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "бот не запустился вовремя"
+        await asyncio.sleep(0.1)
+
+
+class BotProcess:
+    """main.py отдельным процессом против подставного Bot API на localhost"""
+
+    def __init__(self, tmp_path, *args, **env):
+        self.tmp_path = tmp_path
+        self.args = args
+        self.env = env
+        self.api = loadtest.FakeBotAPI()
+
+    async def __aenter__(self):
+        port = free_port()
+        self._runner = await self.api.start(port)
+        env = dict(os.environ, BRAINROT_DB=str(self.tmp_path / "bot.db"),
+                   BRAINROT_BOT_API=f"http://127.0.0.1:{port}", BRAINROT_METRICS_PORT="0", **self.env)
+        self._log = open(self.tmp_path / "bot.log", "w")
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), *self.args],
+                                        cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.process.wait, 30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+        await self._runner.cleanup()
+
+    async def reply(self, user_id=USER_ID):
+        _, method, params = await asyncio.wait_for(self.api.inboxes[user_id].get(), START_TIMEOUT)
+        return method, params
+
+
+def test_polling_answers_start(tmp_path):
+    async def scenario():
+        async with BotProcess(tmp_path) as bot:
+            bot.api.message(USER_ID, "/start")
+            return await bot.reply()
+
+    method, params = asyncio.run(scenario())
+    assert method == "sendMessage"
+    assert int(params["chat_id"]) == USER_ID
+
+
+def test_webhook_mode(tmp_path):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+
+    async def scenario():
+        async with BotProcess(tmp_path, "--webhook", BRAINROT_WEBHOOK_URL=WEBHOOK_URL,
+                              BRAINROT_WEBHOOK_SECRET=SECRET, BRAINROT_WEBHOOK_HOST="127.0.0.1",
+                              BRAINROT_WEBHOOK_PORT=str(port)) as bot:
+            await wait_for(lambda: "setWebhook" in bot.api.params)
+            registered = bot.api.params["setWebhook"]
+            update = dict(bot.api.message_update(USER_ID, "/start"), update_id=1)
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base}/healthz") as response:
+                    health = response.status
+                # ready выставляется сразу после ответа на setWebhook
+                for _ in range(50):
+                    async with session.get(f"{base}/readyz") as response:
+                        ready = response.status, await response.json()
+                    if ready[0] == 200:
+                        break
+                    await asyncio.sleep(0.1)
+                async with session.post(f"{base}/webhook", json=update,
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                    forged = response.status
+                async with session.post(f"{base}/webhook", json=update,
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+                    accepted = response.status
+            method, _ = await bot.reply()
+            return registered, health, ready, forged, accepted, method
+
+    registered, health, ready, forged, accepted, method = asyncio.run(scenario())
+    assert registered["url"] == f"{WEBHOOK_URL}/webhook"
+    assert registered["secret_token"] == SECRET
+    assert health == 200
+    assert ready == (200, {"status": "ready", "in_flight": 0})
+    assert forged == 401
+    assert accepted == 200
+    # Принятый апдейт действительно обработан: бот ответил на /start
+    assert method == "sendMessage"
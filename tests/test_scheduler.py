@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def product(database):
+    import timestamps
+
+    db = database
+    deadline = timestamps.now() + timestamps.HOUR
+    with db.connection() as conn:
+        product_id = conn.execute(
+            "INSERT INTO products (seller_id, title, description, price, contact, created_at, expires_at) "
+            "VALUES (9100, 'Товар', 'Описание', '10', 'seller', ?, ?)", (timestamps.now(), deadline)
+        ).lastrowid
+    yield product_id, deadline
+    with db.connection() as conn:
+        conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        conn.execute("DELETE FROM notification_ledger WHERE product_id = ?", (product_id,))
+        conn.execute("DELETE FROM outbox WHERE chat_id = 9100")
+
+
+def ledger_and_outbox(db, product_id):
+    with db.connection() as conn:
+        ledger = conn.execute("SELECT COUNT(*) FROM notification_ledger WHERE product_id = ?",
+                              (product_id,)).fetchone()[0]
+        queued = conn.execute("SELECT COUNT(*) FROM outbox WHERE chat_id = 9100").fetchone()[0]
+    return ledger, queued
+
+
+def test_notice_is_logged_and_queued_in_one_transaction(database, product):
+    import outbox
+    import scheduler
+
+    product_id, deadline = product
+    sent = []
+
+    def notify(seller_id, products):
+        sent.append((seller_id, products))
+        outbox.enqueue(seller_id, "⚠️ скоро истечёт")
+
+    expiry = scheduler.ExpiryScheduler(notify)
+    asyncio.run(expiry._fire(product_id, deadline))
+    assert sent == [(9100, [(product_id, "Товар", deadline)])]
+    assert ledger_and_outbox(database, product_id) == (1, 1)
+
+    # Повторное срабатывание того же срока ничего не шлёт
+    asyncio.run(expiry._fire(product_id, deadline))
+    assert len(sent) == 1
+    assert ledger_and_outbox(database, product_id) == (1, 1)
+
+
+def test_failed_enqueue_rolls_back_the_claim_and_retries(database, product):
+    import outbox
+    import scheduler
+
+    product_id, deadline = product
+
+    def notify(seller_id, products):
+        outbox.enqueue(seller_id, "⚠️ скоро истечёт")
+        raise RuntimeError("очередь недоступна")
+
+    expiry = scheduler.ExpiryScheduler(notify)
+    asyncio.run(expiry._fire(product_id, deadline))
+    assert ledger_and_outbox(database, product_id) == (0, 0)
+    # Товар вернулся в кучу с отсрочкой, а не потерян
+    assert len(expiry) == 1
+    fire_at, retried_id, retried_deadline = expiry._heap[0]
+    assert (retried_id, retried_deadline) == (product_id, deadline)
+    assert fire_at > deadline - expiry.lead
+
+
+def test_workers_load_only_their_sellers(database):
+    import scheduler
+    import timestamps
+
+    db = database
+    deadline = timestamps.now() + timestamps.DAY
+    with db.connection() as conn:
+        ids = {seller_id: conn.execute(
+            "INSERT INTO products (seller_id, title, description, price, contact, created_at, expires_at) "
+            "VALUES (?, 'Товар', 'Описание', '10', 'seller', ?, ?)", (seller_id, timestamps.now(), deadline)
+        ).lastrowid for seller_id in (9300, 9301)}
+    try:
+        expiry = scheduler.ExpiryScheduler(lambda seller_id, products: None)
+        asyncio.run(expiry.load(owns=lambda seller_id: seller_id % 2 == 0 and seller_id in ids))
+    finally:
+        with db.connection() as conn:
+            conn.execute("DELETE FROM products WHERE seller_id IN (9300, 9301)")
+    assert set(expiry._deadlines) == {ids[9300]}
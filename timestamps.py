@@ -0,0 +1,44 @@
+import time
+from datetime import datetime
+
+# ================== ВРЕМЯ В БАЗЕ ==================
+# Все отметки времени хранятся как целые секунды UTC (unix epoch).
+# Сравнения в запросах - обычные сравнения чисел по индексу, а в
+# человекочитаемый вид время переводится только здесь.
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Значение по умолчанию для колонок времени в DDL
+SQL_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+DATETIME_FORMAT = '%d.%m.%Y %H:%M'
+DATE_FORMAT = '%d.%m.%Y'
+
+
+def now():
+    return int(time.time())
+
+
+def from_datetime(value):
+    return int(value.timestamp())
+
+
+def to_datetime(ts):
+    """Локальное время сервера, как его видели пользователи раньше"""
+    return datetime.fromtimestamp(ts)
+
+
+def format_ts(ts, fmt=DATETIME_FORMAT, default='не указано'):
+    if ts is None:
+        return default
+    return to_datetime(ts).strftime(fmt)
+
+
+def format_date(ts, default='не указано'):
+    return format_ts(ts, DATE_FORMAT, default)
+
+
+def parse_date(text):
+    """Начало дня DATE_FORMAT по местному времени; ValueError при неверной дате"""
+    return from_datetime(datetime.strptime(text, DATE_FORMAT))
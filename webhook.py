@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+from contextlib import suppress
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ ВЕБХУКА ==================
+# Публичный адрес, на который Telegram шлёт апдейты, например https://bot.example.com
+WEBHOOK_URL = os.getenv("BRAINROT_WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("BRAINROT_WEBHOOK_PATH", "/webhook")
+# Без заданного секрета генерируется новый при каждом запуске - вебхук
+# всё равно переустанавливается при старте
+WEBHOOK_SECRET = os.getenv("BRAINROT_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+HOST = os.getenv("BRAINROT_WEBHOOK_HOST", "0.0.0.0")
+# Бесплатные хостинги обычно сами передают порт в PORT
+PORT = int(os.getenv("BRAINROT_WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+# Сколько ждать уже принятые апдейты при остановке
+SHUTDOWN_GRACE = 10
+READY_DB_TIMEOUT = 2
+
+
+class UpdateHandler(SimpleRequestHandler):
+    """Отвечает Telegram сразу, а апдейт обрабатывает в фоновой задаче"""
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def close(self):
+        pending = set(self._background_feed_update_tasks)
+        if pending:
+            logger.info(f"⏳ Дожидаюсь обработки {len(pending)} апдейтов")
+            await asyncio.wait(pending, timeout=SHUTDOWN_GRACE)
+        await super().close()
+
+
+class ForwardHandler(SimpleRequestHandler):
+    """Проверяет секрет и передаёт сырой апдейт дальше, например воркеру"""
+
+    def __init__(self, dispatcher, bot, forward, secret_token=None):
+        super().__init__(dispatcher=dispatcher, bot=bot, secret_token=secret_token)
+        self.forward = forward
+        self.in_flight = 0
+
+    async def handle(self, request):
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        self.forward(await request.json())
+        return web.json_response({})
+
+
+# ================== СЕРВЕР ==================
+class WebhookServer:
+    """aiohttp-сервер: вебхук плюс /healthz и /readyz для сторожа хостинга.
+
+    /healthz отвечает, пока жив event loop. /readyz отвечает 200 только
+    после установки вебхука и пока база отвечает на запросы.
+    С forward апдейты не обрабатываются здесь, а передаются в forward(update).
+    """
+
+    def __init__(self, dispatcher, bot, url=WEBHOOK_URL, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, host=HOST, port=PORT, forward=None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.url = url.rstrip("/") + path if url else ""
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.ready = False
+        self.forward = forward
+        if forward is None:
+            self.handler = UpdateHandler(dispatcher=dispatcher, bot=bot, secret_token=secret)
+        else:
+            self.handler = ForwardHandler(dispatcher, bot, forward, secret_token=secret)
+
+    def build_app(self):
+        app = web.Application()
+        self.handler.register(app, path=self.path)
+        app.router.add_get("/healthz", self.liveness)
+        app.router.add_get("/readyz", self.readiness)
+        if self.forward is None:
+            setup_application(app, self.dispatcher, bot=self.bot)
+        return app
+
+    async def liveness(self, request):
+        return web.json_response({"status": "ok"})
+
+    async def readiness(self, request):
+        if not self.ready:
+            return web.json_response({"status": "starting"}, status=503)
+        try:
+            await asyncio.wait_for(db.fetchone("SELECT 1"), READY_DB_TIMEOUT)
+        except Exception as e:
+            return web.json_response({"status": "db unavailable", "error": str(e)}, status=503)
+        return web.json_response({"status": "ready", "in_flight": self.handler.in_flight})
+
+    async def serve(self):
+        """Работает до SIGINT/SIGTERM"""
+        if not self.url:
+            raise RuntimeError("Для режима вебхука нужен BRAINROT_WEBHOOK_URL")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            # На Windows обработчики сигналов в event loop не поддерживаются
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop.set)
+
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            logger.info(f"🌐 Вебхук-сервер слушает {self.host}:{self.port}{self.path}")
+            await self.bot.set_webhook(
+                self.url,
+                secret_token=self.secret,
+                allowed_updates=self.dispatcher.resolve_used_update_types(),
+            )
+            self.ready = True
+            logger.info(f"✅ Вебхук установлен: {self.url}")
+            await stop.wait()
+            logger.info("🛑 Получен сигнал остановки")
+        finally:
+            self.ready = False
+            # Сначала закрываем приём, затем ждём фоновые апдейты и вызываем shutdown диспетчера
+            await runner.cleanup()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                with suppress(NotImplementedError):
+                    loop.remove_signal_handler(sig)
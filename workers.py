@@ -0,0 +1,181 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from contextlib import suppress
+
+from aiogram.methods import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+# ================== НАСТРОЙКИ ВОРКЕРОВ ==================
+# Один процесс-приёмщик (polling или вебхук) раздаёт апдейты N воркерам
+# по user_id % N. Все апдейты пользователя попадают в один и тот же
+# воркер, поэтому его FSM, позиция в ленте и прочие состояния живут
+# только там, а порядок его апдейтов сохраняется.
+WORKERS = int(os.getenv("BRAINROT_WORKERS", "1"))
+POLL_TIMEOUT = 30
+SHUTDOWN_GRACE = 10
+WATCH_INTERVAL = 1
+
+
+def user_of(update):
+    """id автора апдейта в сыром dict от Bot API; 0, если автора нет"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+def shard_of(update, count):
+    return user_of(update) % count
+
+
+def _on_signal(callback):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # На Windows обработчики сигналов в event loop не поддерживаются
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, callback)
+
+
+# ================== СУПЕРВИЗОР ==================
+class Supervisor:
+    """Запускает воркеры, раздаёт им апдейты и перезапускает упавшие.
+
+    target(index, count, updates) - функция процесса-воркера; updates -
+    его очередь, None в ней означает остановку.
+    """
+
+    def __init__(self, count, target):
+        self.count = count
+        self.target = target
+        # spawn, а не fork: у родителя уже есть потоки пула базы и event loop
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(count)]
+        self.processes = [None] * count
+        self.routed = [0] * count
+        self.restarts = 0
+        self._stopping = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=self.target, args=(index, self.count, self.queues[index]), name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"👷 Воркер {index} запущен (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+
+    def route(self, update):
+        shard = shard_of(update, self.count)
+        self.queues[shard].put(update)
+        self.routed[shard] += 1
+
+    async def watch(self):
+        while not self._stopping:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self._stopping:
+                    # Очередь принадлежит супервизору, так что накопленные апдейты дождутся нового воркера
+                    logger.error(f"💥 Воркер {index} завершился с кодом {process.exitcode}, перезапускаю")
+                    self.restarts += 1
+                    self._spawn(index)
+
+    async def poll(self, bot, allowed_updates):
+        """Long polling до SIGINT/SIGTERM; апдейты уходят воркерам"""
+        await bot.delete_webhook(drop_pending_updates=True)
+        task = asyncio.create_task(self._poll(bot, allowed_updates))
+        _on_signal(task.cancel)
+        with suppress(asyncio.CancelledError):
+            await task
+        logger.info("🛑 Получен сигнал остановки")
+
+    async def _poll(self, bot, allowed_updates):
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates,
+                    request_timeout=int(bot.session.timeout + POLL_TIMEOUT),
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(WATCH_INTERVAL)
+                continue
+            for update in updates:
+                self.route(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+                offset = update.update_id + 1
+
+    async def stop(self, timeout=SHUTDOWN_GRACE):
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"⚠️ Воркер {index} не остановился за {timeout} с, завершаю принудительно")
+                process.terminate()
+        for queue in self.queues:
+            queue.cancel_join_thread()
+
+    def stats_text(self):
+        alive = sum(1 for process in self.processes if process is not None and process.is_alive())
+        return f"{alive}/{self.count} воркеров, апдейтов {self.routed}, перезапусков {self.restarts}"
+
+
+# ================== ВОРКЕР ==================
+async def consume(dispatcher, bot, updates, timeout=SHUTDOWN_GRACE):
+    """Обрабатывает апдейты из очереди супервизора, пока не придёт None.
+
+    Апдейты разных пользователей обрабатываются параллельно, одного -
+    строго по очереди: каждый ждёт предыдущий апдейт того же автора.
+    """
+    loop = asyncio.get_running_loop()
+    # SIGTERM самому воркеру останавливает его так же, как супервизор
+    with suppress(NotImplementedError):
+        loop.add_signal_handler(signal.SIGTERM, updates.put, None)
+    tails = {}
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is None:
+            break
+        user_id = user_of(update)
+        task = asyncio.create_task(_process(dispatcher, bot, update, tails.get(user_id)))
+        tails[user_id] = task
+        task.add_done_callback(functools.partial(_release, tails, user_id))
+    if tails:
+        logger.info(f"⏳ Дожидаюсь обработки апдейтов {len(tails)} пользователей")
+        await asyncio.wait(list(tails.values()), timeout=timeout)
+
+
+def _release(tails, user_id, task):
+    if tails.get(user_id) is task:
+        del tails[user_id]
+
+
+async def _process(dispatcher, bot, update, previous):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        result = await dispatcher.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dispatcher.silent_call_request(bot, result)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при обработке апдейта {update.get('update_id')}: {e}")